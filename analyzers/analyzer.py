@@ -1,18 +1,160 @@
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
-import asyncio, logging, signal, sys
-import uvicorn
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+import asyncio, gzip, json, logging, os, signal, sys, time
+import httpx, uvicorn
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
+from engine import WindowEngine
 
 app = FastAPI(title="Analyzer MVP")
 
+# orjson decodes packet bodies several times faster when the image has it
+try:
+    from orjson import loads
+except ImportError:  # pragma: no cover - depends on the image
+    loads = json.loads
+
+# --------------- aggregation engine (see engine.py) ----------------
+ENGINE = WindowEngine(
+    bucket_seconds=float(os.getenv("WINDOW_BUCKET_SECONDS", "1")),
+    buckets=int(os.getenv("WINDOW_BUCKETS", "3600")),          # ring length: an hour of 1 s buckets
+    max_hosts=int(os.getenv("WINDOW_MAX_HOSTS", "1024")),
+    max_services=int(os.getenv("WINDOW_MAX_SERVICES", "256")),
+    flush_rows=int(os.getenv("WINDOW_FLUSH_ROWS", "65536")),
+)
+FLUSH_MS = float(os.getenv("WINDOW_FLUSH_MS", "250"))
+METRICS_WINDOW = float(os.getenv("WINDOW_METRICS_SECONDS", "60"))   # sliding window behind the error-rate gauge
+
+MESSAGES = Counter("analyzer_messages_total", "Messages aggregated", ["level"])
+LATE = Gauge("analyzer_late_messages", "Messages that arrived too late for the window ring")
+ERROR_RATE = Gauge("analyzer_error_rate", "Share of ERROR/CRITICAL/FATAL messages in the metrics window")
+FLUSH_SECONDS = Histogram("analyzer_flush_seconds", "Time to aggregate one flush",
+                          buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5))
+
+def _flush():
+    started = time.perf_counter()
+    added = ENGINE.flush()
+    for code, count in enumerate(added):
+        if count:
+            MESSAGES.labels(ENGINE.levels.names[code]).inc(int(count))
+    FLUSH_SECONDS.observe(time.perf_counter() - started)
+    LATE.set(ENGINE.late)
+
+async def _flusher():
+    while True:
+        await asyncio.sleep(FLUSH_MS / 1000)
+        try:
+            _flush()
+            ERROR_RATE.set(ENGINE.summary(METRICS_WINDOW, top=0)["error_rate"])
+        except Exception:
+            # keep flushing: a dead flusher would leave packets staged until the next /stats
+            logging.exception("Flush failed")
+
+@app.on_event("startup")
+async def _startup():
+    asyncio.create_task(_flusher())
+
+# --------------- compressed bodies ----------------
+# The distributor may send zstd or gzip (Content-Encoding), as one or more frames that decompress to one packet
+# or to NDJSON. zstd frames can use the distributor's trained dictionary, fetched from DICTIONARY_URL by the id
+# in the frame header. /health advertises what this analyzer can decode.
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the image
+    zstandard = None
+
+DICTIONARY_URL = os.getenv("DICTIONARY_URL", "")     # e.g. http://distributor:8000/compression/dictionaries
+ACCEPT_ENCODING = "zstd, gzip" if zstandard is not None and DICTIONARY_URL else "gzip"
+_BAD_BODY = (OSError, EOFError, zstandard.ZstdError) if zstandard is not None else (OSError, EOFError)
+_decompressors: dict[int, "zstandard.ZstdDecompressor"] = {}
+
+async def _decompressor(dict_id: int):
+    d = _decompressors.get(dict_id)
+    if d is None:
+        dict_data = None
+        if dict_id:
+            try:
+                async with httpx.AsyncClient(timeout=5) as client:
+                    response = await client.get(f"{DICTIONARY_URL.rstrip('/')}/{dict_id}")
+                response.raise_for_status()
+            except httpx.HTTPError as err:
+                # the distributor sends plain after a 415
+                raise HTTPException(415, f"can't fetch zstd dictionary {dict_id}: {err}") from err
+            dict_data = zstandard.ZstdCompressionDict(response.content)
+        d = _decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dict_data)
+    return d
+
+async def _unzstd(data: bytes) -> bytes:
+    out = []
+    while data:
+        stream = (await _decompressor(zstandard.get_frame_parameters(data).dict_id)).decompressobj()
+        out.append(stream.decompress(data))
+        data = stream.unused_data
+    return b"".join(out)
+
+async def decode_packets(body: bytes, content_encoding: str = "identity", content_type: str = ""):
+    """A request body as the packet or packets in it: decompressed per Content-Encoding, then JSON or NDJSON."""
+    encoding = content_encoding.lower()
+    try:
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "zstd" and "zstd" in ACCEPT_ENCODING:
+            body = await _unzstd(body)
+        elif encoding != "identity":
+            raise HTTPException(415, f"unsupported content-encoding {encoding!r}")
+    except _BAD_BODY as err:
+        raise HTTPException(400, f"bad {encoding} body: {err}") from err
+    try:
+        if "ndjson" in content_type:
+            return [loads(line) for line in body.splitlines() if line.strip()]
+        return loads(body)
+    except ValueError as err:
+        raise HTTPException(400, f"invalid packet: {err}") from err
+
+async def _decode(request: Request):
+    headers = request.headers
+    return await decode_packets(await request.body(), headers.get("content-encoding", "identity"),
+                                headers.get("content-type", ""))
+
 @app.post("/ingest")
-async def ingest(packet: dict):
-    # minimal ACK, we are NOT storing or processing the packet
+async def ingest(request: Request):
+    packet = await _decode(request)
+    try:
+        ENGINE.ingest(packet)
+    except ValueError as err:
+        raise HTTPException(400, f"invalid packet: {err}") from err
     return JSONResponse({"status": "ok"})
 
+@app.post("/ingest/batch")
+async def ingest_batch(request: Request):
+    # a JSON array or NDJSON; one ACK for the whole batch, the distributor accounts for each packet in it
+    packets = await _decode(request)
+    if not isinstance(packets, list):
+        raise HTTPException(400, "expected an array of packets")
+    try:
+        ENGINE.ingest_many(packets)     # all or nothing, so the distributor can re-send the good ones alone
+    except ValueError as err:
+        raise HTTPException(400, f"invalid packet: {err}") from err
+    return JSONResponse({"status": "ok", "count": len(packets)})
+
+@app.get("/stats")
+async def stats(window: float = 60.0, top: int = 10):
+    """Sliding window over the last `window` seconds: counts by level and service, error rate, top hosts."""
+    _flush()
+    return ENGINE.summary(window, max(0, top))
+
+@app.get("/stats/series")
+async def stats_series(window: float = 300.0, step: float = 10.0):
+    """Tumbling windows of `step` seconds over the last `window` seconds: messages and errors in each."""
+    _flush()
+    return ENGINE.series(window, step)
+
+@app.get("/metrics")
+def prom_metrics():
+    return PlainTextResponse(generate_latest())
+
 @app.get("/health")
 async def health():
-    return JSONResponse({"status": "ok"})
+    return JSONResponse({"status": "ok"}, headers={"accept-encoding": ACCEPT_ENCODING})
 
 def _graceful(sig, _frame):
     logging.warning("Analyzer shutting down")
@@ -0,0 +1,199 @@
+import datetime, functools, time
+from array import array
+import numpy as np
+
+# Windowed aggregation over the messages an analyzer receives.
+#
+# ingest() checks a packet, then appends to four typed arrays (ts as float seconds; level, service and host as
+# dictionary codes), which costs a few list/array appends per message. flush() turns the staged columns into NumPy
+# arrays and adds them into a ring of fixed-width time buckets with one vectorized scatter-add per column. Queries sum
+# bucket rows. Memory is fixed by the ring size and the dictionary caps; values past a cap share one "(other)" code.
+
+ERROR_LEVELS = ("ERROR", "CRITICAL", "FATAL")
+OTHER = "(other)"
+
+class Dictionary:
+    """Strings to small int codes, capped at `size` codes (the last one is OTHER)."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.names: list[str] = []
+        self._codes: dict[str, int] = {}
+
+    def code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            if len(self.names) < self.size - 1:
+                code = len(self.names)
+                self.names.append(name)
+            else:
+                if len(self.names) < self.size:
+                    self.names.append(OTHER)
+                code = self.size - 1
+            self._codes[name] = code
+            if len(self._codes) > 4 * self.size:     # overflow names all map to OTHER; don't remember them all
+                self._codes = {n: c for n, c in self._codes.items() if c < self.size - 1}
+        return code
+
+@functools.lru_cache(maxsize=4096)
+def _parse_ts(ts: str) -> float:
+    # emitters stamp a whole burst with one timestamp, so the cache takes most of the parsing
+    return datetime.datetime.fromisoformat(ts).timestamp()
+
+class WindowEngine:
+    def __init__(self, bucket_seconds: float = 1.0, buckets: int = 3600, max_hosts: int = 1024,
+                 max_services: int = 256, max_levels: int = 16, flush_rows: int = 65536):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self.flush_rows = flush_rows
+        self.levels = Dictionary(max_levels)
+        self.services = Dictionary(max_services)
+        self.hosts = Dictionary(max_hosts)
+        # staged columns, appended per message
+        self._ts = array("d")
+        self._level = array("i")
+        self._service = array("i")
+        self._host = array("i")
+        # ring of buckets: which bucket number each slot holds, and its counts per level/service/host code
+        self._bucket_of = np.full(buckets, -1, dtype=np.int64)
+        self._by_level = np.zeros((buckets, max_levels), dtype=np.int64)
+        self._by_service = np.zeros((buckets, max_services), dtype=np.int64)
+        self._by_host = np.zeros((buckets, max_hosts), dtype=np.int64)
+        self._newest = -1       # highest bucket number seen
+        self.late = 0           # messages too old for the ring when flushed
+
+    @property
+    def staged(self) -> int:
+        return len(self._ts)
+
+    def ingest(self, packet: dict, now: float | None = None) -> int:
+        """Stage a packet's messages; returns how many. Flushes inline once flush_rows are staged.
+
+        Raises ValueError, with nothing staged, if the packet is malformed.
+        """
+        return self.ingest_many((packet,), now)
+
+    def ingest_many(self, packets, now: float | None = None) -> int:
+        """Stage several packets' messages, all or none: one malformed packet raises ValueError before any is staged."""
+        rows = [self._columns(packet, now) for packet in packets]
+        count = 0
+        for ts, level, service, host in rows:
+            self._ts.extend(ts)
+            self._level.extend(level)
+            self._service.extend(service)
+            self._host.extend(host)
+            count += len(ts)
+        if len(self._ts) >= self.flush_rows:
+            self.flush()
+        return count
+
+    def _columns(self, packet, now: float | None) -> tuple[list[float], list[int], list[int], list[int]]:
+        """A packet's messages as the four staged columns, checked before any of them is kept."""
+        if not isinstance(packet, dict):
+            raise ValueError("packet is not an object")
+        messages = packet.get("messages") or []
+        if not isinstance(messages, list):
+            raise ValueError("messages is not an array")
+        ts, level, service, host = [], [], [], []
+        for m in messages:
+            if not isinstance(m, dict):
+                raise ValueError("message is not an object")
+            try:
+                ts.append(_parse_ts(m["ts"]))
+            except (KeyError, TypeError, ValueError):
+                ts.append(time.time() if now is None else now)
+            level.append(self.levels.code(str(m.get("level", ""))))
+            service.append(self.services.code(str(m.get("service", ""))))
+            host.append(self.hosts.code(str(m.get("host", ""))))
+        return ts, level, service, host
+
+    def flush(self) -> np.ndarray:
+        """Aggregate everything staged into the ring; returns the per-level counts that were added."""
+        added = np.zeros(self.levels.size, dtype=np.int64)
+        if not self._ts:
+            return added
+        ts = np.frombuffer(self._ts, dtype=np.float64)
+        level = np.frombuffer(self._level, dtype=np.int32)
+        service = np.frombuffer(self._service, dtype=np.int32)
+        host = np.frombuffer(self._host, dtype=np.int32)
+        # nothing lands past the current bucket, so a skewed clock can't age out the whole ring
+        bucket = np.minimum(np.floor(ts / self.bucket_seconds), time.time() // self.bucket_seconds).astype(np.int64)
+        self._newest = max(self._newest, int(bucket.max()))
+        keep = bucket > self._newest - self.buckets
+        self.late += int(keep.size - np.count_nonzero(keep))
+        if not keep.all():
+            bucket, level, service, host = bucket[keep], level[keep], service[keep], host[keep]
+        if bucket.size:
+            # slots whose previous bucket has aged out start from zero
+            fresh = np.unique(bucket)
+            slots = fresh % self.buckets
+            stale = self._bucket_of[slots] != fresh
+            if stale.any():
+                reset = slots[stale]
+                self._by_level[reset] = 0
+                self._by_service[reset] = 0
+                self._by_host[reset] = 0
+                self._bucket_of[reset] = fresh[stale]
+            # a slot can still hold an older bucket than a late message's; don't mix them
+            slot = bucket % self.buckets
+            current = self._bucket_of[slot] == bucket
+            if not current.all():
+                self.late += int(current.size - np.count_nonzero(current))
+                slot, level, service, host = slot[current], level[current], service[current], host[current]
+            np.add.at(self._by_level, (slot, level), 1)
+            np.add.at(self._by_service, (slot, service), 1)
+            np.add.at(self._by_host, (slot, host), 1)
+            added = np.bincount(level, minlength=self.levels.size)
+        self._ts = array("d")
+        self._level = array("i")
+        self._service = array("i")
+        self._host = array("i")
+        return added
+
+    def _rows(self, window: float, now: float | None = None) -> np.ndarray:
+        """Ring slots holding the buckets of the last `window` seconds."""
+        last = int((time.time() if now is None else now) // self.bucket_seconds)
+        first = last - max(1, min(self.buckets, round(window / self.bucket_seconds))) + 1
+        return np.flatnonzero((self._bucket_of >= first) & (self._bucket_of <= last))
+
+    def _error_codes(self) -> list[int]:
+        return [i for i, name in enumerate(self.levels.names) if name.upper() in ERROR_LEVELS]
+
+    def summary(self, window: float = 60.0, top: int = 10, now: float | None = None) -> dict:
+        """Sliding window: totals for the last `window` seconds, error rate and the `top` busiest hosts."""
+        rows = self._rows(window, now)
+        by_level = self._by_level[rows].sum(axis=0)
+        by_service = self._by_service[rows].sum(axis=0)
+        by_host = self._by_host[rows].sum(axis=0)
+        total = int(by_level.sum())
+        errors = int(by_level[self._error_codes()].sum())
+        k = min(top + 1, len(self.hosts.names))        # one spare in case OTHER is among them
+        busiest = np.argpartition(by_host, -k)[-k:] if k else np.array([], dtype=np.int64)
+        busiest = busiest[np.argsort(by_host[busiest])[::-1]]
+        return {
+            "window": window,
+            "messages": total,
+            "errors": errors,
+            "error_rate": errors / total if total else 0.0,
+            "by_level": {name: int(by_level[i]) for i, name in enumerate(self.levels.names) if by_level[i]},
+            "by_service": {name: int(by_service[i]) for i, name in enumerate(self.services.names) if by_service[i]},
+            "top_hosts": [[self.hosts.names[i], int(by_host[i])] for i in busiest
+                          if by_host[i] and self.hosts.names[i] != OTHER][:top],
+        }
+
+    def series(self, window: float = 300.0, step: float = 10.0, now: float | None = None) -> list[dict]:
+        """Tumbling windows of `step` seconds covering the last `window` seconds, oldest first."""
+        per = max(1, round(step / self.bucket_seconds))
+        last = int((time.time() if now is None else now) // self.bucket_seconds)
+        count = max(1, min(self.buckets, round(window / self.bucket_seconds)) // per)
+        first = (last // per - count + 1) * per          # windows aligned to multiples of `step`
+        rows = self._rows((last - first + 1) * self.bucket_seconds, now)
+        window_of = (self._bucket_of[rows] - first) // per
+        inside = window_of >= 0
+        rows, window_of = rows[inside], window_of[inside]
+        totals = np.bincount(window_of, weights=self._by_level[rows].sum(axis=1), minlength=count)
+        errors = np.bincount(window_of, weights=self._by_level[rows][:, self._error_codes()].sum(axis=1), minlength=count)
+        return [
+            {"start": (first + i * per) * self.bucket_seconds, "messages": int(totals[i]), "errors": int(errors[i])}
+            for i in range(count)
+        ]
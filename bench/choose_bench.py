@@ -0,0 +1,66 @@
+"""Per-packet registry cost at different fleet sizes.
+
+Run from the repo root:  python bench/choose_bench.py [iterations]
+
+Times choose() alone and the full per-packet cycle the dispatcher runs (choose, mark_delivered, release), plus
+choose() under the affinity policy with a different key per packet.
+"""
+import asyncio, json, pathlib, random, sys, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "distributor"))
+from app.registry import Analyzer, AnalyzerRegistry
+
+SIZES = (4, 64, 512)
+
+def make_registry(n: int, policy: str = "swrr") -> AnalyzerRegistry:
+    rng = random.Random(n)
+    analyzers = []
+    for i in range(n):
+        weight = rng.uniform(0.1, 1.0)
+        analyzers.append(Analyzer(id=f"a{i}", url=f"http://analyzer{i}:9000/ingest", weight=weight, effective_weight=weight))
+    # a generous budget so in-flight caps never block the benchmark
+    return AnalyzerRegistry(analyzers, inflight_budget=10**9, policy=policy)
+
+async def bench_choose(n: int, iterations: int) -> float:
+    registry = make_registry(n)
+    chosen = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        chosen.append(await registry.choose())
+    elapsed = time.perf_counter() - start
+    for a in chosen:
+        await registry.release(a.id)
+    return elapsed / iterations * 1e6
+
+async def bench_affinity(n: int, iterations: int) -> float:
+    registry = make_registry(n, "affinity")
+    keys = [f"host-{i % 1000}" for i in range(iterations)]
+    start = time.perf_counter()
+    for key in keys:
+        a = await registry.choose(key=key)
+        await registry.release(a.id)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+async def bench_cycle(n: int, iterations: int) -> float:
+    registry = make_registry(n)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        a = await registry.choose()
+        await registry.mark_delivered(a.id, 1)
+        await registry.release(a.id)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+async def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    report = []
+    for n in SIZES:
+        report.append({
+            "analyzers": n,
+            "choose_us": round(await bench_choose(n, iterations), 3),
+            "cycle_us": round(await bench_cycle(n, iterations), 3),
+            "affinity_cycle_us": round(await bench_affinity(n, iterations), 3),
+        })
+    print(json.dumps({"iterations": iterations, "results": report}, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
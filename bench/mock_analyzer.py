@@ -0,0 +1,144 @@
+"""analyzers/analyzer.py with injectable faults and delivery timing, for pipeline_bench.py.
+
+Run from the repo root:  python bench/mock_analyzer.py PORT
+
+Faults come from the environment:
+  MOCK_LATENCY_MS      added to every ingest request (default 0)
+  MOCK_JITTER_MS       uniform extra latency on top of that (default 0)
+  MOCK_ERROR_RATE      fraction of ingest requests answered with a 500 (default 0)
+  MOCK_STALL_EVERY     seconds between stalls, 0 for none (default 0)
+  MOCK_STALL_MS        how long a stall holds every ingest request (default 0)
+
+Bodies are decoded like the analyzer does (decode_packets: gzip, zstd with DICTIONARY_URL, JSON or NDJSON).
+Every delivered packet's latency is measured from its first message's "ts" (the load generator stamps it with
+the packet's scheduled send time). GET /bench/stats returns the counts and latencies; ?reset=1 clears them.
+"""
+import asyncio, datetime, json, os, pathlib, random, sys, time
+from urllib.parse import parse_qs
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "analyzers"))
+from analyzer import app as analyzer_app, decode_packets
+from fastapi import HTTPException
+
+class Faults:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, stall_every=0.0, stall_ms=0.0, seed=None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.stall_every = stall_every
+        self.stall = stall_ms / 1000
+        self.rng = random.Random(seed)
+        self.started = time.monotonic()
+
+    @classmethod
+    def from_env(cls) -> "Faults":
+        env = lambda name: float(os.getenv(name, "0"))
+        return cls(env("MOCK_LATENCY_MS"), env("MOCK_JITTER_MS"), env("MOCK_ERROR_RATE"),
+                   env("MOCK_STALL_EVERY"), env("MOCK_STALL_MS"))
+
+    def delay(self) -> float:
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if self.stall_every > 0 and self.stall > 0:
+            # stalls start every stall_every seconds; a request arriving inside one waits until it ends
+            into = (time.monotonic() - self.started) % self.stall_every
+            if into < self.stall:
+                delay += self.stall - into
+        return delay
+
+    def fail(self) -> bool:
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.received = 0
+        self.duplicates = 0
+        self.requests = 0
+        self.errors = 0
+        self.latencies: list[float] = []
+        self.seen: set[str] = set()
+        self.last_delivery = 0.0
+
+    def record(self, data):
+        now = time.time()
+        for packet in data if isinstance(data, list) else [data]:
+            if not isinstance(packet, dict):
+                continue
+            pid = packet.get("packetId")
+            if pid in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(pid)
+            self.received += 1
+            try:
+                sent = datetime.datetime.fromisoformat(packet["messages"][0]["ts"]).timestamp()
+                self.latencies.append(now - sent)
+            except (KeyError, IndexError, TypeError, ValueError):
+                pass
+        self.last_delivery = now
+
+    def as_dict(self) -> dict:
+        return {"received": self.received, "duplicates": self.duplicates, "requests": self.requests,
+                "errors": self.errors, "last_delivery": self.last_delivery, "latencies": self.latencies}
+
+class MockAnalyzer:
+    """ASGI wrapper around the analyzer app: delays or fails ingest requests and records what gets through."""
+
+    def __init__(self, app, faults: Faults):
+        self.app = app
+        self.faults = faults
+        self.stats = Stats()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope["path"]
+        if path == "/bench/stats":
+            body = json.dumps(self.stats.as_dict()).encode()
+            if "reset" in parse_qs(scope["query_string"].decode()):
+                self.stats.reset()
+            return await _respond(send, 200, body)
+        if not path.startswith("/ingest"):
+            return await self.app(scope, receive, send)
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        self.stats.requests += 1
+        delay = self.faults.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.faults.fail():
+            self.stats.errors += 1
+            return await _respond(send, 500, b'{"status":"injected error"}')
+        headers = {k.decode().lower(): v.decode() for k, v in scope["headers"]}
+        try:
+            self.stats.record(await decode_packets(body, headers.get("content-encoding", "identity"),
+                                                   headers.get("content-type", "")))
+        except HTTPException:
+            pass        # the analyzer answers it with the same error
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, replay, send)
+
+async def _respond(send, status: int, body: bytes):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+app = MockAnalyzer(analyzer_app, Faults.from_env())
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[1]) if len(sys.argv) > 1 else 9001, log_level="warning")
@@ -0,0 +1,80 @@
+"""CPU per packet on the distributor hot path: parsed dicts vs. raw-bytes passthrough.
+
+Run from the repo root:  python bench/passthrough_bench.py [packets]
+
+Each mode runs the real app in a child process (PASSTHROUGH is read at import), with the analyzer side left out:
+  ingest    POST /log-packet through the ASGI app (no sockets): routing, body checks, packet record, enqueue
+  dispatch  take each packet off the queue, build the analyzer request (_request_body) and its /ws/logs entry
+"default" decodes every body into a dict at ingest; "passthrough" checks the X-Packet-Id / X-Emitter headers and
+keeps the bytes as they arrived. Times are process CPU time, in microseconds per packet.
+"""
+import asyncio, datetime, json, os, pathlib, subprocess, sys, time, uuid
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+def make_body(i: int) -> bytes:
+    packet = {
+        "packetId": str(uuid.uuid4()),
+        "emitter": "emit1",
+        "messages": [
+            {
+                "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "level": "INFO",
+                "service": "demo_service",
+                "host": "emit1",
+                "message": f"Sample log message from emit1 #{i}",
+            }
+        ],
+    }
+    return json.dumps(packet, separators=(",", ":")).encode()
+
+async def _run(n: int) -> dict:
+    import httpx
+    from app import codec, main
+    bodies = [make_body(i) for i in range(n)]
+    headers = [{"content-type": "application/json", "x-packet-id": codec.loads(b)["packetId"], "x-emitter": "emit1"}
+               for b in bodies]
+    transport = httpx.ASGITransport(app=main.app)      # no lifespan: the dispatchers never start
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.process_time()
+        for body, hdr in zip(bodies, headers):
+            response = await client.post("/log-packet", content=body, headers=hdr)
+            assert response.status_code == 202, response.text
+        ingest = time.process_time() - start
+    target = main.registry.analyzers[0]
+    start = time.process_time()
+    for _ in range(n):
+        packet, _ = main.QUEUE.get_nowait()
+        main._request_body(target, [packet])
+        codec.log_entry(packet, target.id)
+    dispatch = time.process_time() - start
+    return {"ingest_us_per_packet": round(ingest / n * 1e6, 3),
+            "dispatch_us_per_packet": round(dispatch / n * 1e6, 3),
+            "total_us_per_packet": round((ingest + dispatch) / n * 1e6, 3)}
+
+def child(n: int):
+    sys.path.insert(0, str(ROOT / "distributor"))
+    print(json.dumps(asyncio.run(_run(n))))
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    static = ROOT / "distributor" / "app" / "static"
+    env = {
+        **os.environ,
+        "ANALYZERS_JSON": json.dumps([{"id": "a1", "url": "http://127.0.0.1:9/ingest", "weight": 1.0}]),
+        "EMITTERS_JSON": "[]",
+        "QUEUE_MAXSIZE": str(n + 1),
+        "STATIC_DIR": str(static if static.is_dir() else ROOT / "dashboard"),
+    }
+    results = {}
+    for mode, passthrough in (("default", "0"), ("passthrough", "1")):
+        out = subprocess.run([sys.executable, __file__, "--child", str(n)], env={**env, "PASSTHROUGH": passthrough},
+                             check=True, capture_output=True, text=True).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+    print(json.dumps({"packets": n, **results}, indent=2))
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        child(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,358 @@
+"""End-to-end throughput and latency of emitter -> distributor -> analyzers, swept over offered rate.
+
+Run from the repo root:  python bench/pipeline_bench.py [options]
+e.g.                     python bench/pipeline_bench.py --rates 500,1000,2000,4000 --batch 50 --out new.json --baseline old.json
+
+Starts mock analyzers (bench/mock_analyzer.py) and a distributor on localhost, or in this process with
+--in-process, then drives the distributor with an open-loop generator: requests go out on a fixed schedule
+whether or not earlier ones have been answered, and latency is measured from the scheduled send time, so a slow
+distributor can't hide its queueing by slowing the generator down.
+
+For each rate the report has offered/accepted/throttled/delivered counts, delivery latency percentiles (from
+the scheduled send to the analyzer receiving the packet) and ingest round-trip percentiles. The saturation
+point is the highest rate that still delivered everything it accepted within --slo-ms at p99 without being
+throttled. Distributor settings (BATCH_MAX_PACKETS, ROUTING_POLICY, ...) are taken from the environment.
+"""
+import argparse, asyncio, datetime, json, logging, os, pathlib, platform, subprocess, sys, tempfile, threading, time, uuid
+import httpx
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+PERCENTILES = (50, 90, 99, 99.9)
+
+def percentile(sorted_values: list[float], p: float) -> float | None:
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))   # nearest rank
+    return sorted_values[k]
+
+def summarize(values: list[float]) -> dict:
+    values = sorted(values)
+    summary = {f"p{p:g}_ms": round(percentile(values, p) * 1000, 2) if values else None for p in PERCENTILES}
+    summary["max_ms"] = round(values[-1] * 1000, 2) if values else None
+    return summary
+
+# ---------------- load generator ----------------
+class LoadGenerator:
+    """Open-loop packet source shaped like emitters/emitter.py, at any rate."""
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str, batch: int, messages: int, payload_bytes: int,
+                 max_outstanding: int, emitter: str = "bench"):
+        self.client = client
+        self.base_url = base_url
+        self.batch = batch
+        self.messages = messages
+        self.filler = "x" * max(0, payload_bytes)
+        self.max_outstanding = max_outstanding
+        self.emitter = emitter
+
+    def _packet(self, scheduled: float) -> dict:
+        ts = datetime.datetime.fromtimestamp(scheduled, datetime.timezone.utc).isoformat()
+        return {
+            "packetId": str(uuid.uuid4()),
+            "emitter": self.emitter,
+            "messages": [
+                {"ts": ts, "level": "INFO", "service": "bench", "host": self.emitter, "message": self.filler}
+                for _ in range(self.messages)
+            ],
+        }
+
+    async def run(self, rate: float, duration: float) -> dict:
+        counts = {"offered": 0, "accepted": 0, "throttled": 0, "rejected": 0, "errors": 0, "skipped": 0}
+        rtts: list[float] = []
+        outstanding: set[asyncio.Task] = set()
+        interval = self.batch / rate
+        requests = int(rate * duration / self.batch)
+        start = time.time()
+
+        async def send(scheduled: float, packets: list[dict]):
+            try:
+                if len(packets) == 1:
+                    headers = {"x-packet-id": packets[0]["packetId"], "x-emitter": self.emitter}
+                    response = await self.client.post(f"{self.base_url}/log-packet", json=packets[0], headers=headers)
+                else:
+                    headers = {"content-type": "application/x-ndjson", "x-emitter": self.emitter,
+                               "x-packet-ids": ",".join(p["packetId"] for p in packets)}
+                    body = "\n".join(json.dumps(p) for p in packets)
+                    response = await self.client.post(f"{self.base_url}/log-packets", content=body, headers=headers)
+                rtts.append(time.time() - scheduled)
+                if response.status_code == 202:
+                    counts["accepted"] += response.json().get("count", len(packets))
+                elif response.status_code == 429:
+                    counts["throttled"] += len(packets)
+                else:
+                    counts["rejected"] += len(packets)
+            except httpx.HTTPError:
+                counts["errors"] += len(packets)
+
+        for i in range(requests):
+            scheduled = start + i * interval
+            delay = scheduled - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            counts["offered"] += self.batch
+            if len(outstanding) >= self.max_outstanding:
+                # never wait for the distributor: a request that can't go out on time is counted, not delayed
+                counts["skipped"] += self.batch
+                continue
+            packets = [self._packet(scheduled) for _ in range(self.batch)]
+            task = asyncio.create_task(send(scheduled, packets))
+            outstanding.add(task)
+            task.add_done_callback(outstanding.discard)
+        sent_for = time.time() - start
+        if outstanding:
+            await asyncio.wait(outstanding)
+        counts["offered_per_sec"] = round(counts["offered"] / sent_for, 1) if sent_for > 0 else 0.0
+        return {**counts, "ingest_rtt": summarize(rtts)}
+
+# ---------------- services ----------------
+def _mock_env(args, index: int) -> dict:
+    faulty = args.faulty is None or index < args.faulty
+    return {
+        "MOCK_LATENCY_MS": str(args.latency_ms),
+        "MOCK_JITTER_MS": str(args.jitter_ms),
+        "MOCK_ERROR_RATE": str(args.error_rate if faulty else 0),
+        "MOCK_STALL_EVERY": str(args.stall_every if faulty else 0),
+        "MOCK_STALL_MS": str(args.stall_ms if faulty else 0),
+        # lets the mocks take zstd bodies compressed with the distributor's dictionary (COMPRESSION=1)
+        "DICTIONARY_URL": f"http://127.0.0.1:{args.port}/compression/dictionaries",
+    }
+
+def _distributor_env(args) -> dict:
+    analyzers = [{"id": f"mock{i}", "url": f"http://127.0.0.1:{args.analyzer_port + i}/ingest", "weight": 1.0}
+                 for i in range(args.analyzers)]
+    built = ROOT / "distributor" / "app" / "static"
+    static = os.getenv("STATIC_DIR") or str(built if built.is_dir() else ROOT / "dashboard")   # no dashboard build needed
+    return {"ANALYZERS_JSON": json.dumps(analyzers), "EMITTERS_JSON": "[]", "PORT": str(args.port), "STATIC_DIR": static}
+
+class LocalServices:
+    """Mock analyzers and the distributor as localhost subprocesses."""
+
+    def __init__(self, args):
+        self.args = args
+        self.procs: list[subprocess.Popen] = []
+        self.log = None
+
+    def start(self):
+        args = self.args
+        self.log = open(args.log, "ab")     # per-request service logging stays off the terminal
+        for i in range(args.analyzers):
+            env = {**os.environ, **_mock_env(args, i)}
+            self.procs.append(subprocess.Popen([sys.executable, str(ROOT / "bench" / "mock_analyzer.py"),
+                                                str(args.analyzer_port + i)], env=env,
+                                               stdout=self.log, stderr=subprocess.STDOUT))
+        cmd = args.distributor_cmd.format(python=sys.executable, port=args.port).split()
+        env = {**os.environ, **_distributor_env(args)}
+        self.procs.append(subprocess.Popen(cmd, cwd=ROOT / "distributor", env=env,
+                                           stdout=self.log, stderr=subprocess.STDOUT))
+
+    def stop(self):
+        for p in self.procs:
+            p.terminate()
+        for p in self.procs:
+            try:
+                p.wait(10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        if self.log:
+            self.log.close()
+
+class InProcessServices:
+    """The same services as uvicorn servers on threads of this process (they share its GIL with the generator)."""
+
+    def __init__(self, args):
+        self.args = args
+        self.servers = []
+
+    def _serve(self, app, port: int):
+        import uvicorn
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        self.servers.append(server)
+
+    def start(self):
+        args = self.args
+        sys.path.insert(0, str(ROOT / "bench"))
+        sys.path.insert(0, str(ROOT / "distributor"))
+        os.environ.setdefault("DICTIONARY_URL", _mock_env(args, 0)["DICTIONARY_URL"])   # read at import
+        from mock_analyzer import Faults, MockAnalyzer, analyzer_app
+        for i in range(args.analyzers):
+            env = _mock_env(args, i)
+            faults = Faults(float(env["MOCK_LATENCY_MS"]), float(env["MOCK_JITTER_MS"]), float(env["MOCK_ERROR_RATE"]),
+                            float(env["MOCK_STALL_EVERY"]), float(env["MOCK_STALL_MS"]))
+            self._serve(MockAnalyzer(analyzer_app, faults), args.analyzer_port + i)
+        os.environ.update(_distributor_env(args))     # the distributor reads its configuration at import
+        from app.main import app
+        logging.getLogger("httpx").setLevel(logging.WARNING)    # the distributor logs every forward at INFO
+        self._serve(app, args.port)
+
+    def stop(self):
+        for server in self.servers:
+            server.should_exit = True
+        time.sleep(0.5)
+
+async def _wait_ready(client: httpx.AsyncClient, args, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            analyzers = (await client.get(f"http://127.0.0.1:{args.port}/registry")).json()
+            if len(analyzers) == args.analyzers and all(a["healthy"] for a in analyzers):
+                return
+        except (httpx.HTTPError, ValueError):
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("distributor or mock analyzers did not come up")
+
+async def _analyzer_stats(client: httpx.AsyncClient, args, reset: bool = False) -> list[dict]:
+    query = "?reset=1" if reset else ""
+    return [(await client.get(f"http://127.0.0.1:{args.analyzer_port + i}/bench/stats{query}")).json()
+            for i in range(args.analyzers)]
+
+async def _drain(client: httpx.AsyncClient, args, accepted: int) -> list[dict]:
+    """Wait until the analyzers have everything that was accepted, or deliveries stop coming."""
+    deadline = time.monotonic() + args.drain
+    last, still = -1, 0
+    while True:
+        stats = await _analyzer_stats(client, args)
+        received = sum(s["received"] for s in stats)
+        if received >= accepted or time.monotonic() > deadline:
+            return stats
+        still = still + 1 if received == last else 0
+        if still >= 10:     # nothing new for a second
+            return stats
+        last = received
+        await asyncio.sleep(0.1)
+
+# ---------------- sweep ----------------
+async def run_step(client, generator: LoadGenerator, args, rate: float) -> dict:
+    await _analyzer_stats(client, args, reset=True)
+    started = time.time()
+    sent = await generator.run(rate, args.duration)
+    stats = await _drain(client, args, sent["accepted"])
+    latencies = [v for s in stats for v in s["latencies"]]
+    delivered = sum(s["received"] for s in stats)
+    finished = max([s["last_delivery"] for s in stats] + [started])
+    try:
+        accounting = (await client.get(f"http://127.0.0.1:{args.port}/accounting")).json()
+    except (httpx.HTTPError, ValueError):
+        accounting = None
+    step = {
+        "rate": rate,
+        **{k: sent[k] for k in ("offered", "offered_per_sec", "accepted", "throttled", "rejected", "errors", "skipped")},
+        "delivered": delivered,
+        "delivered_per_sec": round(delivered / (finished - started), 1) if finished > started else 0.0,
+        "duplicates_at_analyzers": sum(s["duplicates"] for s in stats),
+        "analyzer_errors_injected": sum(s["errors"] for s in stats),
+        "latency": summarize(latencies),
+        "ingest_rtt": sent["ingest_rtt"],
+        "distributor": accounting,
+    }
+    p99 = step["latency"]["p99_ms"]
+    step["sustained"] = (
+        sent["skipped"] == 0 and sent["throttled"] == 0 and sent["errors"] == 0
+        and delivered >= sent["accepted"] and p99 is not None and p99 <= args.slo_ms
+    )
+    return step
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Per-rate change in p99 latency and delivered throughput, plus the saturation point, against a baseline."""
+    before = {s["rate"]: s for s in baseline["steps"]}
+    steps = []
+    for s in report["steps"]:
+        b = before.get(s["rate"])
+        if b is None:
+            continue
+        steps.append({
+            "rate": s["rate"],
+            "p99_ms": [b["latency"]["p99_ms"], s["latency"]["p99_ms"]],
+            "delivered_per_sec": [b["delivered_per_sec"], s["delivered_per_sec"]],
+        })
+    return {"saturation_rate": [baseline.get("saturation_rate"), report.get("saturation_rate")], "steps": steps}
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def sweep(args) -> dict:
+    services = InProcessServices(args) if args.in_process else LocalServices(args)
+    services.start()
+    limits = httpx.Limits(max_connections=args.max_outstanding, max_keepalive_connections=args.max_outstanding)
+    try:
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            await _wait_ready(client, args)
+            generator = LoadGenerator(client, f"http://127.0.0.1:{args.port}", args.batch, args.messages,
+                                      args.payload_bytes, args.max_outstanding)
+            if args.warmup > 0:
+                warm = await generator.run(args.rates[0], args.warmup)
+                await _drain(client, args, warm["accepted"])
+            steps = []
+            for rate in args.rates:
+                step = await run_step(client, generator, args, rate)
+                steps.append(step)
+                print(f"rate {rate:>8g}/s  delivered {step['delivered_per_sec']:>9g}/s  "
+                      f"p50 {step['latency']['p50_ms']} ms  p99 {step['latency']['p99_ms']} ms  "
+                      f"throttled {step['throttled']}  {'ok' if step['sustained'] else 'SATURATED'}", file=sys.stderr)
+                if not step["sustained"] and args.stop_at_saturation:
+                    break
+    finally:
+        services.stop()
+    sustained = [s["rate"] for s in steps if s["sustained"]]
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "log")}
+    env = {k: v for k, v in os.environ.items() if k.isupper() and k not in ("ANALYZERS_JSON", "EMITTERS_JSON")
+           and not k.startswith(("PATH", "HOME", "LS_", "TERM", "SHELL", "PWD", "OLDPWD", "USER", "LANG"))}
+    return {
+        "commit": _git_commit(),
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": config,
+        "env": env,
+        "saturation_rate": max(sustained) if sustained else None,
+        "steps": steps,
+    }
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--rates", type=lambda s: [float(r) for r in s.split(",")], default=[200, 500, 1000, 2000, 4000],
+                   help="packets per second to offer, in order (default 200,500,1000,2000,4000)")
+    p.add_argument("--duration", type=float, default=10.0, help="seconds per rate")
+    p.add_argument("--warmup", type=float, default=2.0, help="seconds at the first rate before measuring")
+    p.add_argument("--drain", type=float, default=15.0, help="max seconds to wait for deliveries after a step")
+    p.add_argument("--batch", type=int, default=1, help="packets per ingest request (>1 posts NDJSON to /log-packets)")
+    p.add_argument("--messages", type=int, default=1, help="log messages per packet")
+    p.add_argument("--payload-bytes", type=int, default=64, help="size of each message's text")
+    p.add_argument("--max-outstanding", type=int, default=512, help="ingest requests in flight before sends are skipped")
+    p.add_argument("--timeout", type=float, default=10.0, help="ingest request timeout")
+    p.add_argument("--slo-ms", type=float, default=500.0, help="p99 delivery latency a rate must stay under")
+    p.add_argument("--stop-at-saturation", action="store_true", help="skip the remaining rates once one saturates")
+    p.add_argument("--analyzers", type=int, default=2)
+    p.add_argument("--latency-ms", type=float, default=0.0, help="mock analyzer latency per request")
+    p.add_argument("--jitter-ms", type=float, default=0.0, help="uniform extra mock analyzer latency")
+    p.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests a faulty mock answers with 500")
+    p.add_argument("--stall-every", type=float, default=0.0, help="seconds between stalls of a faulty mock")
+    p.add_argument("--stall-ms", type=float, default=0.0, help="length of each stall")
+    p.add_argument("--faulty", type=int, default=None, help="only the first N mocks get errors and stalls (default all)")
+    p.add_argument("--port", type=int, default=8800)
+    p.add_argument("--analyzer-port", type=int, default=9800, help="first mock analyzer port")
+    p.add_argument("--distributor-cmd", default="{python} -m uvicorn app.main:app --port {port} --log-level warning",
+                   help="e.g. '{python} -m app.cluster' for multi-process mode (PORT is set)")
+    p.add_argument("--in-process", action="store_true", help="run everything in this process instead of subprocesses")
+    p.add_argument("--log", default=os.path.join(tempfile.gettempdir(), "pipeline_bench.log"),
+                   help="where the subprocesses' output goes")
+    p.add_argument("--out", help="write the JSON report here as well as to stdout")
+    p.add_argument("--baseline", help="earlier report to compare against")
+    return p.parse_args(argv)
+
+def main():
+    args = parse_args()
+    report = asyncio.run(sweep(args))
+    if args.baseline:
+        report["comparison"] = compare(report, json.loads(pathlib.Path(args.baseline).read_text()))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        pathlib.Path(args.out).write_text(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
@@ -34,7 +34,7 @@ function AnalyzerRow({ a }: { a: Analyzer }) {
     return (
         <TableRow key={a.id}>
             <TableCell>{a.id}</TableCell>
-            <TableCell>{localHealthy && localEnabled ? "✅" : "❌"}</TableCell>
+            <TableCell>{!(localHealthy && localEnabled) ? "❌" : a.breaker === "half_open" ? "🟡" : "✅"}</TableCell>
             <TableCell>{localWeight.toFixed(2)}</TableCell>
             <TableCell>{localTxPackets}</TableCell>
             <TableCell>
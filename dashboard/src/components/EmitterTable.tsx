@@ -12,13 +12,17 @@ import {
 import { setEmitterRate, pauseEmitter, resumeEmitter } from "../api";
 import { type Emitter } from "../types";
 
+/* the slider is linear up to 10 rps, then logarithmic up to 10k */
+const toRps = (v: number) => (v <= 10 ? v : Math.round(10 ** (1 + (v - 10) / 10)));
+const fromRps = (rps: number) => (rps <= 10 ? rps : 10 + 10 * Math.log10(rps / 10));
+
 /* one row with optimistic‑UI */
 function EmitterRow({ e }: { e: Emitter }) {
-  const [localRate, setLocalRate] = useState(e.rate_rps);
+  const [localRate, setLocalRate] = useState(fromRps(e.rate_rps));
   const [localPaused, setLocalPaused] = useState(e.paused);
 
   useEffect(() => {
-    setLocalRate(e.rate_rps);
+    setLocalRate(fromRps(e.rate_rps));
     setLocalPaused(e.paused);
   }, [e]);
 
@@ -26,7 +30,7 @@ function EmitterRow({ e }: { e: Emitter }) {
     _evt: Event | React.SyntheticEvent,
     value: number | number[]
   ) => {
-    setEmitterRate(e.emitter_id, value as number).catch(console.error);
+    setEmitterRate(e.emitter_id, toRps(value as number)).catch(console.error);
   };
 
   const togglePause = () => {
@@ -45,7 +49,8 @@ function EmitterRow({ e }: { e: Emitter }) {
           onChangeCommitted={commitRate}
           step={0.5}
           min={0}
-          max={10}
+          max={40}
+          scale={toRps}
           valueLabelDisplay="auto"
           size="small"
         />
@@ -1,19 +1,15 @@
-import { useEffect, useRef, useState } from "react";
+import { useEffect, useState } from "react";
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip } from "recharts";
 import useMetrics from "../hooks/useMetrics";
 
 export default function PacketsPerSec() {
   const metrics = useMetrics();
-  const prev = useRef<number|null>(null);
   const [series, setSeries] = useState<{ts:number, pps:number}[]>([]);
 
   useEffect(()=>{
     if (!metrics) return;
-    if (prev.current !== null){
-      const delta = metrics.packets_rx - prev.current;
-      setSeries((s)=>[...s.slice(-29), { ts: metrics.ts, pps: delta }]);
-    }
-    prev.current = metrics.packets_rx;
+    // rate is computed by the distributor
+    setSeries((s)=>[...s.slice(-29), { ts: metrics.ts, pps: metrics.rx_per_sec }]);
   }, [metrics]);
 
   return (
@@ -7,11 +7,14 @@ export default function useLogs(max = 500) {
     useEffect(() => {
         const ws = new WebSocket(`ws://${location.host}/ws/logs`);
         ws.onmessage = (e) => {
-            const entry = JSON.parse(e.data) as LogEntry;
-            setLogs((prev) => [...prev.slice(-max + 1), entry]);
+            // frames are batches of entries, coalesced by the distributor
+            const data = JSON.parse(e.data) as LogEntry[] | LogEntry;
+            const entries = Array.isArray(data) ? data : [data];
+            if (entries.length === 0) return;
+            setLogs((prev) => [...prev, ...entries].slice(-max));
         };
         return () => ws.close();
     }, [max]);
 
     return logs;
-}
\ No newline at end of file
+}
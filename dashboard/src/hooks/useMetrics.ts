@@ -1,17 +1,53 @@
 import {useEffect, useState} from "react";
-import { type MetricsPayload } from "../types";
+import { type MetricsFrame, type MetricsPayload, type MetricsSnapshot } from "../types";
+
+type Tree = Record<string, unknown>;
+
+/* copy-on-write merge, so rows that didn't change keep their identity */
+function merge(target: Tree, patch: Tree): Tree {
+    const out: Tree = { ...target };
+    for (const [key, value] of Object.entries(patch)) {
+        const prev = out[key];
+        out[key] = value !== null && typeof value === "object" && prev !== null && typeof prev === "object"
+            ? merge(prev as Tree, value as Tree)
+            : value;
+    }
+    return out;
+}
+
+function remove(target: Tree, path: string[]): Tree {
+    const [key, ...rest] = path;
+    const out: Tree = { ...target };
+    if (rest.length === 0) delete out[key];
+    else if (out[key] && typeof out[key] === "object") out[key] = remove(out[key] as Tree, rest);
+    return out;
+}
+
+function toPayload(s: MetricsSnapshot): MetricsPayload {
+    return { ...s, analyzers: Object.values(s.analyzers), emitters: Object.values(s.emitters) };
+}
 
 export default function useMetrics() {
     const [data, setData] = useState<MetricsPayload | null>(null);
 
     useEffect(() => {
         const ws = new WebSocket(`ws://${location.host}/ws/metrics`);
+        let snapshot: MetricsSnapshot | null = null;
         ws.onmessage = (evt) => {
-            const payload = JSON.parse(evt.data) as MetricsPayload;
-            setData(payload);
+            const frame = JSON.parse(evt.data) as MetricsFrame;
+            if (frame.type === "full") {
+                snapshot = frame.data;
+            } else if (snapshot) {
+                let next = merge(snapshot as unknown as Tree, frame.set);
+                for (const path of frame.removed) next = remove(next, path);
+                snapshot = next as unknown as MetricsSnapshot;
+            } else {
+                return;     // a delta before the first full frame has nothing to apply to
+            }
+            setData(toPayload(snapshot));
         };
         return () => ws.close();
     }, []);
 
     return data;
-}
\ No newline at end of file
+}
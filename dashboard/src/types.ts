@@ -3,7 +3,9 @@ export interface Analyzer {
     effective_weight: number;
     healthy: boolean;
     admin_enabled: boolean;
+    breaker: "closed" | "open" | "half_open";
     tx_packets: number;
+    tx_per_sec: number;
 }
 
 export interface Emitter {
@@ -19,8 +21,21 @@ export interface MetricsPayload {
     analyzers: Analyzer[];
     emitters: Emitter[];
     packets_rx: number;
+    rx_per_sec: number;
+    tx_per_sec: number;
+    queue_trend: number;
 }
 
+/* /ws/metrics wire format: analyzers and emitters keyed by id, a full frame then deltas */
+export interface MetricsSnapshot extends Omit<MetricsPayload, "analyzers" | "emitters"> {
+    analyzers: Record<string, Analyzer>;
+    emitters: Record<string, Emitter>;
+}
+
+export type MetricsFrame =
+    | { type: "full"; seq: number; data: MetricsSnapshot }
+    | { type: "delta"; seq: number; set: Record<string, unknown>; removed: string[][] };
+
 export interface LogEntry {
   packet: {
     packetId: string;
@@ -0,0 +1,133 @@
+import asyncio, logging
+from collections import deque
+from fastapi import WebSocket
+from prometheus_client import Counter
+from . import codec, compression
+from .logstore import LogFilter
+
+# /ws/logs fan-out. The dispatcher hands entries to publish(), which never awaits: entries are sampled, then
+# coalesced into frames (a JSON array of entries) every flush_ms or frame_max entries. Each frame is encoded
+# once and offered to every client's bounded queue; a client that can't keep up loses frames, never the
+# data path. A client subscribed with a LogFilter gets its own frames holding only the entries it matches.
+# Clients that asked for an encoding get the frame compressed, once per encoding, as a binary message.
+
+WS_LOG_FRAMES = Counter("ws_log_frames_total", "Frames built for /ws/logs clients")
+WS_LOG_DROPPED = Counter("ws_log_entries_dropped_total", "Log entries not delivered to a /ws/logs client", ["reason"])
+
+DROP_POLICIES = ("drop_oldest", "drop_newest")
+
+class _Client:
+    __slots__ = ("ws", "frames", "ready", "where", "pending", "encoding")
+
+    def __init__(self, ws: WebSocket, max_frames: int, where: LogFilter | None = None, encoding: str | None = None):
+        self.ws = ws
+        self.frames: deque[tuple[str | bytes, int]] = deque(maxlen=max_frames)   # (frame, entries in it)
+        self.ready = asyncio.Event()
+        self.where = where
+        self.pending: list[bytes] = []      # filtered clients only
+        self.encoding = encoding
+
+def _frame(entries: list[bytes], encoding: str | None) -> str | bytes:
+    frame = b"[" + b",".join(entries) + b"]"
+    return compression.compress(frame, encoding) if encoding else frame.decode()
+
+class LogBroadcaster:
+    def __init__(self, flush_ms: float = 100, frame_max: int = 200, client_queue: int = 16,
+                 drop_policy: str = "drop_oldest", sample_rate: float = 1.0):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"unknown drop policy {drop_policy!r}, expected one of {DROP_POLICIES}")
+        self.flush_ms = flush_ms
+        self.frame_max = max(1, frame_max)
+        self.client_queue = max(1, client_queue)
+        self.drop_policy = drop_policy
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self._sample_credit = 0.0
+        self._pending: list[bytes] = []
+        self._clients: set[_Client] = set()         # unfiltered: share one frame
+        self._filtered: set[_Client] = set()
+        self._dropped_sampled = WS_LOG_DROPPED.labels("sampled")
+        self._dropped_overflow = WS_LOG_DROPPED.labels("overflow")
+
+    @property
+    def clients(self) -> int:
+        return len(self._clients) + len(self._filtered)
+
+    def publish(self, packet: codec.Packet, analyzer_id: str):
+        if not self._clients and not self._filtered:
+            return
+        # stride sampling: keeps exactly sample_rate of the entries, evenly spaced
+        self._sample_credit += self.sample_rate
+        if self._sample_credit < 1.0:
+            self._dropped_sampled.inc()
+            return
+        self._sample_credit -= 1.0
+        entry = codec.log_entry(packet, analyzer_id)
+        if entry is None:
+            return
+        for client in self._filtered:
+            if client.where.matches(packet, analyzer_id):
+                client.pending.append(entry)
+                if len(client.pending) >= self.frame_max:
+                    self._flush_one(client)
+        if self._clients:
+            self._pending.append(entry)
+            if len(self._pending) >= self.frame_max:
+                self._flush()
+
+    def _flush(self):
+        entries, self._pending = self._pending, []
+        frames: dict[str | None, str | bytes] = {}
+        WS_LOG_FRAMES.inc()
+        for client in self._clients:
+            frame = frames.get(client.encoding)
+            if frame is None:
+                frame = frames[client.encoding] = _frame(entries, client.encoding)
+            self._offer(client, frame, len(entries))
+
+    def _flush_one(self, client: _Client):
+        entries, client.pending = client.pending, []
+        WS_LOG_FRAMES.inc()
+        self._offer(client, _frame(entries, client.encoding), len(entries))
+
+    def _offer(self, client: _Client, frame: str | bytes, count: int):
+        if len(client.frames) == client.frames.maxlen:
+            if self.drop_policy == "drop_newest":
+                self._dropped_overflow.inc(count)
+                return
+            self._dropped_overflow.inc(client.frames[0][1])    # the append below evicts the oldest
+        client.frames.append((frame, count))
+        client.ready.set()
+
+    async def run(self):
+        """Flushes partially filled frames every flush_ms."""
+        while True:
+            await asyncio.sleep(self.flush_ms / 1000)
+            if self._pending:
+                self._flush()
+            for client in self._filtered:
+                if client.pending:
+                    self._flush_one(client)
+
+    async def serve(self, ws: WebSocket, backlog: list[bytes], where: LogFilter | None = None,
+                    encoding: str | None = None):
+        """Sender loop for one socket: the backlog as a single frame, then live frames until it disconnects."""
+        client = _Client(ws, self.client_queue, where or None, encoding)
+        if backlog:
+            client.frames.append((_frame(backlog, encoding), len(backlog)))
+            client.ready.set()
+        clients = self._filtered if client.where else self._clients
+        clients.add(client)
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                while client.frames:
+                    frame, _ = client.frames.popleft()
+                    if isinstance(frame, bytes):
+                        await ws.send_bytes(frame)
+                    else:
+                        await ws.send_text(frame)
+        except Exception as exc:
+            logging.info("Log client disconnected: %s", exc or type(exc).__name__)
+        finally:
+            clients.discard(client)
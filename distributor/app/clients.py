@@ -0,0 +1,96 @@
+import importlib.util, logging, time
+import httpx
+from prometheus_client import Counter, Histogram
+
+# Outbound HTTP, split by traffic class so health probes never queue behind data POSTs (and vice versa):
+#   data    -- one pool per analyzer for forwarding packets
+#   health  -- analyzer health probes, short timeouts
+#   control -- emitter polling and the dashboard's control proxies
+# Every request carries an httpcore trace hook that feeds the connection metrics below.
+
+CONN_OPENED = Counter("http_connections_opened_total", "Outbound connections opened", ["client"])
+CONN_REUSED = Counter("http_requests_reused_connection_total", "Outbound requests sent on an already open connection", ["client"])
+POOL_WAIT = Histogram("http_pool_wait_seconds", "Time a request waited for a pooled connection", ["client"],
+                      buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+
+class _Trace:
+    """httpcore trace callback for one request: did it open a connection, and how long did it wait for one."""
+    __slots__ = ("client", "started", "connecting", "connect_time")
+
+    def __init__(self, client: str):
+        self.client = client
+        self.started = time.perf_counter()
+        self.connecting = 0.0
+        self.connect_time = 0.0
+
+    async def __call__(self, event: str, info: dict):
+        if event == "connection.connect_tcp.started":
+            self.connecting = time.perf_counter()
+            CONN_OPENED.labels(self.client).inc()
+        elif event == "connection.connect_tcp.complete":
+            self.connect_time = time.perf_counter() - self.connecting
+        elif event.endswith("send_request_headers.started"):
+            if not self.connecting:
+                CONN_REUSED.labels(self.client).inc()
+            POOL_WAIT.labels(self.client).observe(max(0.0, time.perf_counter() - self.started - self.connect_time))
+
+class HttpClients:
+    def __init__(self, analyzer_pool: int = 8, analyzer_keepalive: int | None = None, keepalive_expiry: float = 30.0,
+                 http2: bool = False, data_timeout: float = 5.0, health_timeout: float = 1.0):
+        if http2 and importlib.util.find_spec("h2") is None:
+            logging.warning("ANALYZER_HTTP2 needs the h2 package, falling back to HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.data_timeout = data_timeout
+        self._data_timeout = httpx.Timeout(data_timeout, connect=2.0)
+        self._data_limits = httpx.Limits(
+            max_connections=analyzer_pool,
+            max_keepalive_connections=analyzer_keepalive if analyzer_keepalive is not None else analyzer_pool,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._analyzers: dict[str, httpx.AsyncClient] = {}
+        self.health = httpx.AsyncClient(
+            timeout=httpx.Timeout(health_timeout, connect=health_timeout),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64, keepalive_expiry=keepalive_expiry),
+        )
+        self.control = httpx.AsyncClient(
+            timeout=httpx.Timeout(5.0, connect=2.0),
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32, keepalive_expiry=keepalive_expiry),
+        )
+
+    def analyzer(self, aid: str) -> httpx.AsyncClient:
+        client = self._analyzers.get(aid)
+        if client is None:
+            client = self._analyzers[aid] = httpx.AsyncClient(
+                timeout=self._data_timeout, limits=self._data_limits, http2=self.http2,
+            )
+        return client
+
+    async def drop(self, aid: str):
+        """Close an analyzer's pool once it leaves the registry."""
+        client = self._analyzers.pop(aid, None)
+        if client is not None:
+            await client.aclose()
+
+    async def forward(self, aid: str, url: str, body: bytes, headers: dict, timeout: float | None = None) -> httpx.Response:
+        """POST to an analyzer; `timeout` caps the request below the data timeout (a retry's remaining budget)."""
+        limit = httpx.USE_CLIENT_DEFAULT
+        if timeout is not None and timeout < self.data_timeout:
+            limit = httpx.Timeout(timeout, connect=min(timeout, 2.0))
+        return await self.analyzer(aid).post(url, content=body, headers=headers, timeout=limit,
+                                             extensions={"trace": _Trace("data")})
+
+    async def probe(self, url: str) -> httpx.Response:
+        return await self.health.get(url, extensions={"trace": _Trace("health")})
+
+    async def control_get(self, url: str) -> httpx.Response:
+        return await self.control.get(url, extensions={"trace": _Trace("control")})
+
+    async def control_post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.control.post(url, extensions={"trace": _Trace("control")}, **kwargs)
+
+    async def aclose(self):
+        for aid in list(self._analyzers):
+            await self.drop(aid)
+        await self.health.aclose()
+        await self.control.aclose()
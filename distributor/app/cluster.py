@@ -0,0 +1,199 @@
+import fcntl, logging, mmap, multiprocessing, os, pathlib, shutil, signal, socket, struct, time
+from multiprocessing.connection import wait
+from typing import TYPE_CHECKING
+from . import codec
+
+if TYPE_CHECKING:
+    from .registry import AnalyzerRegistry
+
+# Multi-process mode: `python -m app.cluster` starts DISTRIBUTOR_WORKERS copies of the app, each with its own
+# listening socket on the same port (SO_REUSEPORT, so the kernel spreads connections across them).
+#
+# The workers coordinate through CLUSTER_DIR:
+#   state        -- SharedState document: the analyzer registry and the last emitter poll
+#   leader.lock  -- flock held by the one worker that runs health probes and emitter polling
+#   metrics/     -- PROMETHEUS_MULTIPROC_DIR, so /metrics on any worker reports the whole cluster
+#   dedup        -- SharedDedupIndex: packetIds accepted by any worker, so a re-sent packet isn't queued twice
+# Queues, in-flight limits and /ws/logs history stay per worker.
+
+_VERSION = struct.Struct("<Q")   # bumped to odd while a write is in progress, even once it is complete
+_LENGTH = struct.Struct("<I")
+_BODY = _VERSION.size + _LENGTH.size
+
+class SharedState:
+    """A JSON document shared by the worker processes through one memory-mapped file.
+
+    Writers serialize on an flock; readers take no lock and retry when they raced a write (a seqlock on the
+    version counter), so checking for changes is a single 8 byte read.
+    """
+
+    def __init__(self, path: str | os.PathLike, size: int = 1 << 20):
+        self.size = size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    @property
+    def version(self) -> int:
+        return _VERSION.unpack_from(self._map, 0)[0]
+
+    def read(self) -> tuple[int, dict]:
+        while True:
+            version = self.version
+            if version & 1:
+                time.sleep(0)
+                continue
+            length = _LENGTH.unpack_from(self._map, _VERSION.size)[0]
+            body = self._map[_BODY:_BODY + length]
+            if self.version == version:
+                return version, codec.loads(body) if length else {}
+
+    def update(self, change) -> dict:
+        """Apply change(doc) to the current document under the write lock and publish the result."""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            version, doc = self.read()
+            change(doc)
+            body = codec.dumps(doc)
+            if _BODY + len(body) > self.size:
+                raise ValueError(f"shared state of {len(body)} bytes does not fit in {self.size}")
+            _VERSION.pack_into(self._map, 0, version + 1)
+            self._map[_BODY:_BODY + len(body)] = body
+            _LENGTH.pack_into(self._map, _VERSION.size, len(body))
+            _VERSION.pack_into(self._map, 0, version + 2)
+            return doc
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+class Leadership:
+    """One worker at a time holds the leader flock; the kernel releases it when that process exits."""
+
+    def __init__(self, path: str | os.PathLike):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.held = False
+
+    def try_acquire(self) -> bool:
+        if not self.held:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.held = True
+                logging.info("Worker %d is now the cluster leader", os.getpid())
+            except BlockingIOError:
+                pass
+        return self.held
+
+def _record(a) -> dict:
+    # the part of an analyzer every worker must agree on; inflight, failures, latency and trial counts stay local
+    return {"url": a.url, "weight": a.weight, "healthy": a.healthy, "admin_enabled": a.admin_enabled,
+            "breaker": a.breaker, "ramp": a.ramp, "accept_encoding": a.accept_encoding}
+
+class RegistrySync:
+    """Keeps each worker's AnalyzerRegistry in step with the shared "registry" document.
+
+    Local changes are published as a three-way merge against the state this worker last synced, so two
+    workers changing different analyzers at the same time don't overwrite each other.
+    """
+
+    def __init__(self, registry: "AnalyzerRegistry", state: SharedState):
+        self.registry = registry
+        self.state = state
+        self._base = self._local()
+
+    def _local(self) -> dict:
+        return {"policy": self.registry.policy, "analyzers": {a.id: _record(a) for a in self.registry.analyzers}}
+
+    def seed(self):
+        """The first worker up publishes its configured analyzers; later ones adopt whatever is shared."""
+        local = self._local()
+        self.state.update(lambda doc: doc.setdefault("registry", local))
+
+    def publish(self):
+        local, base = self._local(), self._base
+
+        def merge(doc: dict):
+            shared = doc.setdefault("registry", {"policy": local["policy"], "analyzers": {}})
+            for aid, record in local["analyzers"].items():
+                if base["analyzers"].get(aid) != record:
+                    shared["analyzers"][aid] = record
+            for aid in base["analyzers"]:
+                if aid not in local["analyzers"]:
+                    shared["analyzers"].pop(aid, None)
+            if local["policy"] != base["policy"]:
+                shared["policy"] = local["policy"]
+
+        self.state.update(merge)
+        self._base = local
+
+    async def apply(self, doc: dict) -> list[str]:
+        """Adopt the shared registry; returns the ids of analyzers that were removed."""
+        shared = doc.get("registry")
+        if shared is None:
+            return []
+        removed = await self.registry.apply(shared["analyzers"], shared["policy"])
+        self._base = self._local()
+        return removed
+
+def metric_totals() -> dict[tuple[str, tuple], float]:
+    """Every metric sample summed across the workers, keyed by (sample name, label values)."""
+    from prometheus_client import CollectorRegistry
+    from prometheus_client.multiprocess import MultiProcessCollector
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    return {(s.name, tuple(s.labels.values())): s.value for m in registry.collect() for s in m.samples}
+
+# ---------------- launcher ----------------
+def _serve(index: int, host: str, port: int):
+    import uvicorn
+    os.environ["CLUSTER_WORKER"] = str(index)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    uvicorn.Server(uvicorn.Config("app.main:app", log_level=os.getenv("LOG_LEVEL", "info"))).run(sockets=[sock])
+
+def main():
+    workers = int(os.getenv("DISTRIBUTOR_WORKERS", str(os.cpu_count() or 1)))
+    host, port = os.getenv("HOST", "0.0.0.0"), int(os.getenv("PORT", "8000"))
+    cluster_dir = pathlib.Path(os.getenv("CLUSTER_DIR", "/tmp/distributor-cluster"))
+    shutil.rmtree(cluster_dir, ignore_errors=True)     # state and metrics from a previous run are stale
+    (cluster_dir / "metrics").mkdir(parents=True)
+    os.environ["CLUSTER_DIR"] = str(cluster_dir)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(cluster_dir / "metrics")
+    from prometheus_client import multiprocess
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S")
+    ctx = multiprocessing.get_context("spawn")
+
+    def start(index: int):
+        p = ctx.Process(target=_serve, args=(index, host, port), name=f"distributor-{index}")
+        p.start()
+        return p
+
+    procs = {i: start(i) for i in range(workers)}
+    logging.info("Started %d distributor workers on %s:%d", workers, host, port)
+    stopping = False
+
+    def _stop(*_):
+        nonlocal stopping
+        stopping = True
+        for p in procs.values():
+            p.terminate()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    while procs:
+        wait([p.sentinel for p in procs.values()], timeout=1.0)
+        for i, p in list(procs.items()):
+            if p.is_alive():
+                continue
+            multiprocess.mark_process_dead(p.pid)
+            if stopping:
+                del procs[i]
+            else:
+                logging.warning("Worker %d exited with %s, restarting", i, p.exitcode)
+                procs[i] = start(i)
+
+if __name__ == "__main__":
+    main()
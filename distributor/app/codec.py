@@ -0,0 +1,132 @@
+import json, re
+from . import compression
+
+# orjson is several times faster than the stdlib for both directions; fall back when it is not installed
+try:
+    import orjson
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    loads = orjson.loads
+except ImportError:  # pragma: no cover - depends on the image
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+class Packet:
+    """A packet as the distributor holds it: encoded once at ingest, plus the two fields routing needs.
+
+    Far smaller than the decoded dict (one bytes object instead of nested dicts and strings), and nothing in it
+    is a container the cyclic GC has to track. A packet that arrived compressed keeps its compressed frame as
+    `body` so it can be forwarded as is; `json` gives the plain encoding either way. `attempts` counts the
+    delivery rounds that failed on every analyzer tried. `lane` is the queue lane the packet was charged to at
+    ingest (the sending emitter), which can differ from the `emitter` the packet names.
+    """
+    __slots__ = ("body", "id", "emitter", "lane", "attempts", "_levels")
+
+    def __init__(self, body: bytes, id: str | None = None, emitter: str = "", attempts: int = 0,
+                 levels: tuple[str, ...] | None = None, lane: str | None = None):
+        self.body = body
+        self.id = id
+        self.emitter = emitter
+        self.lane = emitter if lane is None else lane
+        self.attempts = attempts
+        self._levels = levels
+
+    @classmethod
+    def from_dict(cls, packet: dict, body: bytes | None = None) -> "Packet":
+        """`body` is the packet's original encoding when there is one, so it isn't encoded again."""
+        messages = packet.get("messages")
+        levels = _levels(str(m.get("level", "")) for m in messages if isinstance(m, dict)) if isinstance(messages, list) else ()
+        return cls(body if body is not None else dumps(packet), packet.get("packetId"), str(packet.get("emitter", "")),
+                   levels=levels)
+
+    @property
+    def levels(self) -> tuple[str, ...]:
+        """Distinct message levels, in order of appearance, for the log index.
+
+        Set at ingest from the decoded packet or the emitter's X-Packet-Levels header. Otherwise they are read
+        out of the body without parsing it, which for a compressed packet means decompressing it once.
+        """
+        if self._levels is None:
+            try:
+                self._levels = _levels(m.decode() for m in _LEVEL.findall(self.json))
+            except ValueError:
+                self._levels = ()
+        return self._levels
+
+    @property
+    def encoding(self) -> str | None:
+        return compression.sniff(self.body)
+
+    @property
+    def json(self) -> bytes:
+        """The packet as plain JSON, decompressed on demand (not cached, to keep the packet compact).
+
+        Raises ValueError when it can't be decompressed, e.g. its zstd dictionary is gone.
+        """
+        if self.encoding is None:
+            return self.body
+        return compression.decompress(self.body).rstrip(b"\n")
+
+    def __repr__(self) -> str:
+        return f"Packet({self.id!r}, emitter={self.emitter!r}, lane={self.lane!r}, {len(self.body)} bytes)"
+
+def encode_packet(packet: Packet | dict | bytes) -> bytes:
+    """Packets taken in passthrough mode are already bytes and go out exactly as they arrived."""
+    if isinstance(packet, Packet):
+        return packet.body
+    return packet if isinstance(packet, bytes) else dumps(packet)
+
+def log_entry(packet: Packet | dict | bytes, analyzer_id: str) -> bytes | None:
+    """One /ws/logs entry; the packet's bytes are spliced in rather than re-encoding the whole entry.
+
+    None for a compressed packet that can't be decompressed any more (its dictionary is gone): the log views
+    skip it rather than show an entry without a packet.
+    """
+    try:
+        body = packet.json if isinstance(packet, Packet) else encode_packet(packet)
+    except ValueError:
+        return None
+    return b'{"packet":' + body + b',"analyzer":' + dumps(analyzer_id) + b"}"
+
+def log_frame(packet: Packet | dict | bytes, analyzer_id: str) -> str | None:
+    entry = log_entry(packet, analyzer_id)
+    return entry.decode() if entry is not None else None
+
+def stored_entry(seq: int, ts: float, packet: Packet, analyzer_id: str) -> bytes | None:
+    """A /logs query result: a log entry plus its position in the store and delivery time."""
+    entry = log_entry(packet, analyzer_id)
+    if entry is None:
+        return None
+    return b'{"seq":' + dumps(seq) + b',"ts":' + dumps(ts) + b"," + entry[1:]
+
+_LEVEL = re.compile(rb'"level"\s*:\s*"([^"]*)"')
+_LEVEL_SETS: dict[tuple[str, ...], tuple[str, ...]] = {}
+
+def _levels(names) -> tuple[str, ...]:
+    """Distinct names as a tuple shared by every packet with the same levels."""
+    levels = tuple(dict.fromkeys(names))
+    if len(_LEVEL_SETS) < 4096:
+        levels = _LEVEL_SETS.setdefault(levels, levels)
+    return levels
+
+def header_levels(value: str | None, count: int) -> list[tuple[str, ...] | None]:
+    """X-Packet-Levels: one entry per packet, comma-separated, each the packet's levels joined by "|".
+    Entries are None when the header is missing or doesn't have `count` of them."""
+    entries = value.split(",") if value else []
+    if len(entries) != count:
+        return [None] * count
+    return [_levels(entry.split("|")) if entry else () for entry in entries]
+
+_FIELDS: dict[str, re.Pattern] = {}
+
+def first_field(body: bytes, name: str) -> str | None:
+    """The first string value of `name` anywhere in an encoded packet, found without decoding it."""
+    pattern = _FIELDS.get(name)
+    if pattern is None:
+        pattern = _FIELDS[name] = re.compile(rb'"' + re.escape(name.encode()) + rb'"\s*:\s*"([^"]*)"')
+    match = pattern.search(body)
+    return match.group(1).decode() if match else None
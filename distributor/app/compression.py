@@ -0,0 +1,170 @@
+import gzip, logging, pathlib
+from typing import Callable
+
+# Content-Encoding for packet bodies on every hop (emitter -> distributor -> analyzer, and /ws/logs frames).
+#
+# A compressed body is one or more independent frames: zstd frames or gzip members. A frame holds one packet
+# followed by "\n" (or a whole NDJSON batch), so concatenated frames decompress to NDJSON and a batch can be
+# assembled from already-compressed packets without touching them. When a body holds several frames the
+# sender lists their compressed sizes in X-Frame-Sizes, so the distributor can split it without decompressing.
+#
+# zstd frames may use a dictionary trained by the distributor from recently delivered packets; the dictionary
+# id is in the frame header, and receivers fetch unknown ones from GET /compression/dictionaries/{id}.
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the image
+    zstandard = None
+
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)   # in order of preference
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+_MAGIC = {b"\x28\xb5\x2f\xfd": "zstd", b"\x1f\x8b": "gzip"}    # neither can start a JSON document
+
+class UnknownDictionary(ValueError):
+    def __init__(self, dict_id: int):
+        super().__init__(f"unknown zstd dictionary {dict_id}")
+        self.dict_id = dict_id
+
+def sniff(data: bytes) -> str | None:
+    """The encoding of a stored body, from its magic bytes; None for plain JSON."""
+    return _MAGIC.get(data[:4]) or _MAGIC.get(data[:2])
+
+def negotiate(accept: str, offered: tuple[str, ...] = ENCODINGS) -> str | None:
+    """The first of `offered` that an Accept-Encoding style list names."""
+    accepted = {token.split(";")[0].strip().lower() for token in accept.split(",")}
+    return next((enc for enc in offered if enc in accepted), None)
+
+def split(body: bytes, sizes: str | None) -> list[bytes]:
+    """The frames of a compressed body, cut at the X-Frame-Sizes lengths; one frame if they don't add up."""
+    try:
+        lengths = [int(n) for n in sizes.split(",")] if sizes else []
+    except ValueError:
+        lengths = []
+    if not lengths or sum(lengths) != len(body):
+        return [body]
+    frames, off = [], 0
+    for n in lengths:
+        frames.append(body[off:off + n])
+        off += n
+    return frames
+
+def dict_id(data: bytes) -> int:
+    """The dictionary a zstd body's first frame needs; 0 for none (or a body that isn't zstd)."""
+    return zstandard.get_frame_parameters(data).dict_id if zstandard is not None and sniff(data) == "zstd" else 0
+
+class Dictionaries:
+    """Trained zstd dictionaries by id, with the newest one used for compressing.
+
+    With a `directory` (shared by cluster workers, and kept across restarts) every dictionary is also written
+    there as <id>.zdict and never deleted, so a worker that didn't train it, or a packet replayed from the spill
+    log, can still be decoded. Only the last `keep` are held in memory. Without a directory an older one is
+    dropped only once `in_use()` (the ids of packets the caller still holds) no longer names it.
+    """
+
+    def __init__(self, directory: str | pathlib.Path | None = None, keep: int = 4,
+                 in_use: Callable[[], set[int]] | None = None):
+        self.dir = pathlib.Path(directory) if directory else None
+        self.keep = keep
+        self.in_use = in_use
+        self.current: "zstandard.ZstdCompressionDict | None" = None
+        self._by_id: dict[int, "zstandard.ZstdCompressionDict"] = {}
+        self._compressors: dict[int, "zstandard.ZstdCompressor"] = {}
+        self._decompressors: dict[int, "zstandard.ZstdDecompressor"] = {}
+        if self.dir is not None:
+            self.dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def version(self) -> int | None:
+        return self.current.dict_id() if self.current is not None else None
+
+    def add(self, data: bytes, publish: bool = True) -> int:
+        """Make `data` the current dictionary; returns its id."""
+        d = zstandard.ZstdCompressionDict(data)
+        self._remember(d)
+        self.current = d
+        if publish and self.dir is not None:
+            tmp = self.dir / f"{d.dict_id()}.tmp"
+            tmp.write_bytes(data)
+            tmp.replace(self.dir / f"{d.dict_id()}.zdict")
+        return d.dict_id()
+
+    def _remember(self, d: "zstandard.ZstdCompressionDict"):
+        self._by_id[d.dict_id()] = d
+        if len(self._by_id) <= self.keep:
+            return
+        pinned = self.in_use() if self.dir is None and self.in_use is not None else set()
+        for old in [i for i in self._by_id if i not in pinned and i != d.dict_id()]:
+            if len(self._by_id) <= self.keep:
+                break
+            del self._by_id[old]
+            self._compressors.pop(old, None)
+            self._decompressors.pop(old, None)
+
+    def get(self, dict_id: int) -> "zstandard.ZstdCompressionDict":
+        d = self._by_id.get(dict_id)
+        if d is None and self.dir is not None:
+            path = self.dir / f"{dict_id}.zdict"
+            if path.exists():
+                d = zstandard.ZstdCompressionDict(path.read_bytes())
+                self._remember(d)
+        if d is None:
+            raise UnknownDictionary(dict_id)
+        return d
+
+    def refresh(self):
+        """Adopt the newest dictionary another worker wrote to the shared directory."""
+        if self.dir is None:
+            return
+        newest = max(self.dir.glob("*.zdict"), key=lambda p: p.stat().st_mtime, default=None)
+        if newest is not None and int(newest.stem) != self.version:
+            self.add(newest.read_bytes(), publish=False)
+            logging.info("Using zstd dictionary %s", newest.stem)
+
+    def compressor(self) -> "zstandard.ZstdCompressor":
+        key = self.version or 0
+        c = self._compressors.get(key)
+        if c is None:
+            c = self._compressors[key] = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=self.current)
+        return c
+
+    def decompressor(self, dict_id: int) -> "zstandard.ZstdDecompressor":
+        d = self._decompressors.get(dict_id)
+        if d is None:
+            d = zstandard.ZstdDecompressor(dict_data=self.get(dict_id) if dict_id else None)
+            self._decompressors[dict_id] = d
+        return d
+
+DICTIONARIES = Dictionaries()     # replaced by main.py once it knows where dictionaries are shared
+
+def train(samples: list[bytes], size: int) -> bytes:
+    """A dictionary trained from sample packets, for Dictionaries.add(). CPU heavy; run it off the event loop."""
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return DICTIONARIES.compressor().compress(data)
+    if encoding == "gzip":
+        return gzip.compress(data, GZIP_LEVEL, mtime=0)
+    raise ValueError(f"unsupported encoding {encoding!r}")
+
+def decompress(data: bytes, encoding: str | None = None) -> bytes:
+    """All frames of a body, concatenated. Raises ValueError for bad input or an unknown dictionary."""
+    encoding = encoding or sniff(data)
+    if encoding == "gzip":
+        try:
+            return gzip.decompress(data)
+        except (OSError, EOFError) as err:
+            raise ValueError(f"bad gzip body: {err}") from err
+    if encoding != "zstd" or zstandard is None:
+        raise ValueError(f"unsupported encoding {encoding!r}")
+    out = []
+    try:
+        while data:
+            params = zstandard.get_frame_parameters(data)
+            stream = DICTIONARIES.decompressor(params.dict_id).decompressobj()
+            out.append(stream.decompress(data))
+            data = stream.unused_data
+    except zstandard.ZstdError as err:
+        raise ValueError(f"bad zstd body: {err}") from err
+    return b"".join(out)
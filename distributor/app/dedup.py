@@ -0,0 +1,88 @@
+import hashlib, math, mmap, os, struct, time
+
+class DedupIndex:
+    """Packet ids accepted recently, so an emitter re-sending a packet whose ack it lost doesn't queue it twice.
+
+    Two generations of hash sets: new ids go into the current one, and it becomes the previous one (dropping
+    the old previous) every `window` seconds or once it holds `max_ids`. An id is remembered for at least one
+    window and memory stays bounded by 2 * max_ids.
+    """
+
+    def __init__(self, window: float = 120.0, max_ids: int = 500_000):
+        self.window = window
+        self.max_ids = max_ids
+        self._current: set[str] = set()
+        self._previous: set[str] = set()
+        self._rotated = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def __contains__(self, pid: str) -> bool:
+        return pid in self._current or pid in self._previous
+
+    def add(self, pid: str):
+        if len(self._current) >= self.max_ids or time.monotonic() - self._rotated >= self.window:
+            self._previous, self._current = self._current, set()
+            self._rotated = time.monotonic()
+        self._current.add(pid)
+
+_SLOT = struct.Struct("<Qd")    # id fingerprint (0 = empty), time.time() it was added
+_PROBE = 8                      # slots searched per id
+
+def _fingerprint(pid: str) -> int:
+    return int.from_bytes(hashlib.blake2b(pid.encode(), digest_size=8).digest(), "little") or 1
+
+class SharedDedupIndex:
+    """DedupIndex for multi-process mode: a table in one memory-mapped file that every worker reads and writes.
+
+    A re-sent packet can arrive on a new connection that the kernel hands to a different worker, so the ids
+    each worker accepted must be visible to all of them. Each id is stored as a 64-bit fingerprint with the
+    time it was added, in one of `_PROBE` slots starting at fingerprint % slots; it matches for `window`
+    seconds. A full probe range overwrites its oldest entry, so memory stays fixed at 2 * max_ids slots and an
+    id can be forgotten early only under more than max_ids ids per window. Writes take no lock: two workers
+    racing on a slot at worst lose one entry, which means one duplicate gets through.
+    """
+
+    def __init__(self, path: str | os.PathLike, window: float = 120.0, max_ids: int = 500_000):
+        self.window = window
+        self.slots = 2 * max_ids
+        size = self.slots * _SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def __len__(self) -> int:
+        """Ids still inside the window; scans the whole table."""
+        cutoff = time.time() - self.window
+        return sum(1 for fp, at in _SLOT.iter_unpack(self._map) if fp and at >= cutoff)
+
+    def _range(self, fp: int):
+        first = fp % self.slots
+        return ((first + i) % self.slots * _SLOT.size for i in range(_PROBE))
+
+    def __contains__(self, pid: str) -> bool:
+        fp = _fingerprint(pid)
+        cutoff = time.time() - self.window
+        for offset in self._range(fp):
+            found, at = _SLOT.unpack_from(self._map, offset)
+            if found == fp and at >= cutoff:
+                return True
+        return False
+
+    def add(self, pid: str):
+        fp = _fingerprint(pid)
+        now = time.time()
+        oldest, oldest_at = None, math.inf
+        for offset in self._range(fp):
+            found, at = _SLOT.unpack_from(self._map, offset)
+            if found == fp or not found or at < now - self.window:
+                oldest = offset
+                break
+            if at < oldest_at:
+                oldest, oldest_at = offset, at
+        _SLOT.pack_into(self._map, oldest, fp, now)
@@ -0,0 +1,118 @@
+import asyncio
+from collections import deque
+
+def _wakeup_next(waiters: deque):
+    while waiters:
+        waiter = waiters.popleft()
+        if not waiter.done():
+            waiter.set_result(None)
+            break
+
+class FairQueue:
+    """Bounded queue made of one FIFO lane per key (emitter), drained by deficit round-robin.
+
+    Each lane gets `quantum` packets per turn before the next lane is served, so a noisy emitter's backlog
+    can't starve the others. Lanes are dropped as soon as they empty and don't bank credit while idle.
+    The get/put API mirrors asyncio.Queue, with an extra key on put.
+    """
+
+    def __init__(self, maxsize: int = 0, quantum: int = 8):
+        self.maxsize = maxsize
+        self.quantum = quantum
+        self._lanes: dict[str, deque] = {}
+        self._active: deque[str] = deque()      # keys with packets, in service order
+        self._deficit: dict[str, int] = {}
+        self._size = 0
+        self._getters: deque[asyncio.Future] = deque()
+        self._putters: deque[asyncio.Future] = deque()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def lane_size(self, key: str) -> int:
+        lane = self._lanes.get(key)
+        return len(lane) if lane else 0
+
+    def empty(self) -> bool:
+        return not self._size
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self._size
+
+    def put_nowait(self, item, key: str = ""):
+        if self.full():
+            raise asyncio.QueueFull
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+            self._active.append(key)
+            self._deficit[key] = 0
+        lane.append(item)
+        self._size += 1
+        _wakeup_next(self._getters)
+
+    def get_nowait(self):
+        if not self._size:
+            raise asyncio.QueueEmpty
+        key = self._active[0]
+        if self._deficit[key] <= 0:         # this lane's turn starts
+            self._deficit[key] += self.quantum
+        lane = self._lanes[key]
+        item = lane.popleft()
+        self._size -= 1
+        self._deficit[key] -= 1
+        if not lane:
+            self._active.popleft()
+            del self._lanes[key], self._deficit[key]
+        elif self._deficit[key] <= 0:       # turn used up, go to the back of the line
+            self._active.rotate(-1)
+        _wakeup_next(self._putters)
+        return item
+
+    def items(self):
+        """Queued items, lane by lane, without taking them. Don't await while iterating."""
+        return (item for key in self._active for item in self._lanes[key])
+
+    def drain(self) -> list[tuple[str, object]]:
+        """Remove everything, lane by lane, as (key, item) pairs."""
+        items = [(key, item) for key in self._active for item in self._lanes[key]]
+        self._lanes.clear()
+        self._active.clear()
+        self._deficit.clear()
+        self._size = 0
+        return items
+
+    # the waiting logic below follows asyncio.Queue, including its cancellation handling
+    async def put(self, item, key: str = ""):
+        while self.full():
+            putter = asyncio.get_running_loop().create_future()
+            self._putters.append(putter)
+            try:
+                await putter
+            except:
+                putter.cancel()
+                try:
+                    self._putters.remove(putter)
+                except ValueError:
+                    pass
+                if not self.full() and not putter.cancelled():
+                    _wakeup_next(self._putters)
+                raise
+        self.put_nowait(item, key)
+
+    async def get(self):
+        while self.empty():
+            getter = asyncio.get_running_loop().create_future()
+            self._getters.append(getter)
+            try:
+                await getter
+            except:
+                getter.cancel()
+                try:
+                    self._getters.remove(getter)
+                except ValueError:
+                    pass
+                if not self.empty() and not getter.cancelled():
+                    _wakeup_next(self._getters)
+                raise
+        return self.get_nowait()
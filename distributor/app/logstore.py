@@ -0,0 +1,161 @@
+import math, time
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from .codec import Packet
+
+@dataclass(frozen=True)
+class LogFilter:
+    """Which entries a query or a /ws/logs subscription wants; None matches anything."""
+    emitter: str | None = None
+    analyzer: str | None = None
+    level: str | None = None
+
+    def __bool__(self) -> bool:
+        return self.emitter is not None or self.analyzer is not None or self.level is not None
+
+    def matches(self, packet: Packet, analyzer_id: str, levels: tuple[str, ...] | None = None) -> bool:
+        if self.emitter is not None and packet.emitter != self.emitter:
+            return False
+        if self.analyzer is not None and analyzer_id != self.analyzer:
+            return False
+        if self.level is not None:
+            return self.level in (levels if levels is not None else packet.levels)
+        return True
+
+class _SeqIndex:
+    """Sequence numbers of the entries with one key, ascending. Eviction pops from the front in O(1)."""
+    __slots__ = ("seqs", "head")
+
+    def __init__(self):
+        self.seqs = array("q")
+        self.head = 0
+
+    def __len__(self) -> int:
+        return len(self.seqs) - self.head
+
+    def popleft(self):
+        self.head += 1
+        if self.head >= 1024 and self.head * 2 >= len(self.seqs):
+            del self.seqs[:self.head]
+            self.head = 0
+
+    def newest_first(self, lo: int, hi: int):
+        """Seqs in [lo, hi), newest first."""
+        seqs = self.seqs
+        i = bisect_left(seqs, hi, self.head) - 1
+        stop = bisect_left(seqs, lo, self.head, i + 1)
+        while i >= stop:
+            yield seqs[i]
+            i -= 1
+
+class LogStore:
+    """The last `capacity` delivered packets, queryable by emitter, analyzer, level and time.
+
+    Entries live in a ring addressed by a global sequence number. Each emitter, analyzer and level has an
+    index of the seqs carrying it; since entries are appended in seq order, evicting the oldest entry only
+    pops the front of its own indexes. Timestamps are kept non-decreasing in seq order, so a time range
+    becomes a seq range by binary search and the time index costs nothing extra. A query walks the smallest
+    matching index newest first and checks the remaining criteria on each entry.
+    """
+
+    def __init__(self, capacity: int = 50_000):
+        self.capacity = max(1, capacity)
+        self._ring: list[tuple[Packet, str, tuple[str, ...]] | None] = [None] * self.capacity
+        self._ts = array("d", bytes(8 * self.capacity))
+        self._next = 0          # seq of the next entry
+        self._indexes: dict[tuple[str, str], _SeqIndex] = {}
+
+    def __len__(self) -> int:
+        return min(self._next, self.capacity)
+
+    def packets(self):
+        """Every packet in the ring, oldest slot first (not in seq order once it has wrapped)."""
+        return (entry[0] for entry in self._ring if entry is not None)
+
+    @property
+    def first_seq(self) -> int:
+        return max(0, self._next - self.capacity)
+
+    def _keys(self, packet: Packet, analyzer_id: str, levels: tuple[str, ...]):
+        yield "emitter", packet.emitter
+        yield "analyzer", analyzer_id
+        for level in levels:
+            yield "level", level
+
+    def append(self, packet: Packet, analyzer_id: str, ts: float | None = None):
+        seq = self._next
+        slot = seq % self.capacity
+        evicted = self._ring[slot]
+        if evicted is not None:
+            for key in self._keys(*evicted):
+                index = self._indexes[key]
+                index.popleft()
+                if not index:
+                    del self._indexes[key]
+        ts = time.time() if ts is None else ts
+        if seq:
+            ts = max(ts, self._ts[(seq - 1) % self.capacity])    # a clock step back mustn't unsort the ring
+        levels = packet.levels
+        self._ring[slot] = (packet, analyzer_id, levels)
+        self._ts[slot] = ts
+        for key in self._keys(packet, analyzer_id, levels):
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = _SeqIndex()
+            index.seqs.append(seq)
+        self._next = seq + 1
+
+    def _seq_at(self, ts: float) -> int:
+        """The first seq whose timestamp is >= ts."""
+        lo, hi = self.first_seq, self._next
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts[mid % self.capacity] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, where: LogFilter = LogFilter(), since: float | None = None, until: float | None = None,
+              before: int | None = None, limit: int = 100) -> tuple[list[tuple[int, float, Packet, str]], int | None]:
+        """Up to `limit` matching entries, newest first, as (seq, ts, packet, analyzer id).
+
+        `before` is a seq to page back from; the second value returned is the cursor for the next page, or None
+        when there is nothing older.
+        """
+        lo = self.first_seq if since is None else self._seq_at(since)
+        hi = self._next if until is None else self._seq_at(math.nextafter(until, math.inf))   # until is inclusive
+        if before is not None:
+            hi = min(hi, before)
+        if lo >= hi or limit <= 0:
+            return [], None
+        keys = [("emitter", where.emitter), ("analyzer", where.analyzer), ("level", where.level)]
+        keys = [key for key in keys if key[1] is not None]
+        if keys:
+            indexes = [self._indexes.get(key) for key in keys]
+            if not all(indexes):
+                return [], None
+            seqs = min(indexes, key=len).newest_first(lo, hi)
+        else:
+            seqs = range(hi - 1, lo - 1, -1)
+        found, cursor = [], None
+        for seq in seqs:
+            packet, analyzer_id, levels = self._ring[seq % self.capacity]
+            if len(keys) > 1 and not where.matches(packet, analyzer_id, levels):
+                continue
+            if len(found) == limit:
+                cursor = found[-1][0]
+                break
+            found.append((seq, self._ts[seq % self.capacity], packet, analyzer_id))
+        return found, cursor
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self),
+            "capacity": self.capacity,
+            "first_seq": self.first_seq,
+            "next_seq": self._next,
+            "emitters": sum(1 for kind, _ in self._indexes if kind == "emitter"),
+            "analyzers": sum(1 for kind, _ in self._indexes if kind == "analyzer"),
+        }
@@ -1,10 +1,23 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import JSONResponse, PlainTextResponse
-import asyncio, os, json, signal, logging, httpx, time, pathlib
+from fastapi import FastAPI, Request, WebSocket, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+import asyncio, itertools, os, json, math, logging, time, pathlib, datetime, threading
 from collections import deque
 from fastapi.staticfiles import StaticFiles
-from prometheus_client import Counter, Gauge, generate_latest
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
 from .registry import AnalyzerRegistry, Analyzer
+from .routing import POLICIES
+from .spill import MAX_KEY_BYTES, SpillLog, SpillQueue
+from .clients import HttpClients
+from .probes import ProbeScheduler
+from .dedup import DedupIndex, SharedDedupIndex
+from .broadcast import LogBroadcaster
+from .logstore import LogFilter, LogStore
+from . import instrument
+from .instrument import stage
+from .publisher import MetricsPublisher
+from .cluster import Leadership, RegistrySync, SharedState, metric_totals
+from . import codec, compression
+from .codec import Packet
 
 app = FastAPI(title="Log Distributor MVP v3")
 
@@ -20,7 +33,83 @@ if not an_json:
     raise RuntimeError("ANALYZERS_JSON environment variable is not set")
 raw_list = json.loads(an_json)
 analyzers = [Analyzer(**x, effective_weight=x["weight"]) for x in raw_list]
-registry = AnalyzerRegistry(analyzers)
+
+# --------------- Dispatcher pool sizing ----------------
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))            # concurrent forwarding coroutines
+ANALYZER_INFLIGHT = int(os.getenv("ANALYZER_INFLIGHT", str(DISPATCH_WORKERS)))  # in-flight budget split by weight
+
+ROUTING_POLICY = os.getenv("ROUTING_POLICY", "swrr")   # swrr | least_outstanding | ewma | p2c | affinity
+# affinity: packets with the same key stick to one analyzer on a consistent-hash ring (see routing.py)
+AFFINITY_KEY = os.getenv("AFFINITY_KEY", "emitter")    # emitter | service | host
+if AFFINITY_KEY not in ("emitter", "service", "host"):
+    raise RuntimeError(f"AFFINITY_KEY must be emitter, service or host, not {AFFINITY_KEY!r}")
+
+# Circuit breaker (see registry.py): how long an analyzer stays out after it trips, and the trial ramp on return
+registry = AnalyzerRegistry(
+    analyzers, inflight_budget=ANALYZER_INFLIGHT, policy=ROUTING_POLICY,
+    open_seconds=float(os.getenv("CB_OPEN_SECONDS", "2")),
+    max_open_seconds=float(os.getenv("CB_MAX_OPEN_SECONDS", "30")),
+    trial_requests=int(os.getenv("CB_TRIAL_REQUESTS", "20")),   # deliveries per ramp step while half-open
+    failure_penalty=float(os.getenv("EWMA_FAILURE_PENALTY", "1.0")),   # latency a failed request counts as, at least
+    policy_options={"affinity": {
+        "vnodes": int(os.getenv("AFFINITY_VNODES", "400")),               # ring points per unit of weight
+        "load_factor": float(os.getenv("AFFINITY_LOAD_FACTOR", "1.25")),  # max in-flight vs. fair share
+    }},
+)
+
+def _affinity_key(packet: Packet) -> str | None:
+    if not registry.keyed:
+        return None
+    if AFFINITY_KEY == "emitter":
+        return packet.emitter
+    try:
+        return codec.first_field(packet.json, AFFINITY_KEY)
+    except ValueError:
+        return None     # can't be decompressed; _request_body dead-letters it
+
+# --------------- Retries ----------------
+# A packet an analyzer didn't accept is retried on a different analyzer, up to RETRY_MAX times, as long as the
+# whole delivery stays within RETRY_DEADLINE_MS; after that it is dropped.
+RETRY_MAX = int(os.getenv("RETRY_MAX", "2"))
+RETRY_DEADLINE_MS = float(os.getenv("RETRY_DEADLINE_MS", "3000"))
+# On shutdown a worker mid-delivery gets this long to finish; then it is cancelled and its batch requeued
+SHUTDOWN_GRACE_MS = float(os.getenv("SHUTDOWN_GRACE_MS", str(RETRY_DEADLINE_MS)))
+
+# --------------- Dead letters ----------------
+# A packet an analyzer refuses as bad (a 4xx other than 408, 415 or 429) is the packet's fault, not the
+# analyzer's: it is dead-lettered instead of requeued, and a batch it was in is re-sent one packet at a time so
+# the rest still get through. A packet requeued DELIVERY_MAX_ATTEMPTS times is dead-lettered too.
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "20"))
+DEAD_LETTERS: deque[dict] = deque(maxlen=int(os.getenv("DEAD_LETTER_KEEP", "1000")))   # newest last, for /dead-letters
+_RETRYABLE_4XX = (408, 415, 429)
+
+# --------------- Cluster mode (set up by `python -m app.cluster`) ----------------
+# Each worker process runs this whole app. The registry and emitter metrics are shared through CLUSTER_DIR,
+# and only the leader worker runs health probes and emitter polling.
+CLUSTER_DIR = os.getenv("CLUSTER_DIR", "")
+CLUSTER_WORKER = os.getenv("CLUSTER_WORKER", "0")
+CLUSTER_SYNC_MS = float(os.getenv("CLUSTER_SYNC_MS", "200"))
+if CLUSTER_DIR:
+    STATE = SharedState(pathlib.Path(CLUSTER_DIR) / "state")
+    LEADER = Leadership(pathlib.Path(CLUSTER_DIR) / "leader.lock")
+    SYNC = RegistrySync(registry, STATE)
+    registry.on_change = SYNC.publish
+else:
+    STATE = LEADER = SYNC = None
+
+def _is_leader() -> bool:
+    return LEADER is None or LEADER.held
+
+# --------------- Batched forwarding (enabled when BATCH_MAX_PACKETS > 1) ----------------
+BATCH_MAX_PACKETS = int(os.getenv("BATCH_MAX_PACKETS", "1"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(256 * 1024)))
+BATCH_LINGER_MS = float(os.getenv("BATCH_LINGER_MS", "5"))
+
+# --------------- Raw-bytes passthrough (PASSTHROUGH=1) ----------------
+# /log-packet keeps the request body as it arrived and forwards it to analyzers without re-encoding.
+PASSTHROUGH = os.getenv("PASSTHROUGH", "0") == "1"
+JSON_HEADERS = {"content-type": "application/json"}
+NDJSON_HEADERS = {"content-type": "application/x-ndjson"}
 
 # --------------- Initialize Emitters from docker-compose.yml ----------------
 em_json = os.getenv("EMITTERS_JSON", "[]")
@@ -31,45 +120,355 @@ EMITTER_METRICS: dict[str, dict] = {e["emitter_id"]: {
         "buffer_size": 0, 
         "rate_rps": 0, 
         "paused": True,
-        "prev_rate": 1.0
     } for e in raw_emitters}
 emitters_index = {e["emitter_id"]: e for e in raw_emitters}
 
-SYSTEM_PAUSED = False  # global flag to pause all emitters
-
 # --------------- metrics ----------------
 PACKETS_RX = Counter("packets_received_total", "Packets received from emitters") # tracks incoming packets to the distributor
 PACKETS_TX = Counter("packets_forwarded_total", "Packets forwarded to analyzers", ["analyzer_id"]) # tracks packets sent to analyzers
-QUEUE_SIZE = Gauge("queue_size", "Packets in the distributor queue")
+PACKETS_THROTTLED = Counter("packets_throttled_total", "Packets refused at ingest because the emitter had no credit", ["emitter"])
+PACKETS_FAILED = Counter("packets_failed_total", "Packets an analyzer did not accept", ["analyzer_id"])
+PACKETS_RETRIED = Counter("packets_retried_total", "Packets retried on another analyzer", ["analyzer_id"])
+PACKETS_REQUEUED = Counter("packets_requeued_total", "Packets put back in the queue after every retry failed")
+PACKETS_DROPPED = Counter("packets_dropped_total", "Packets lost because the queue could not take them back")
+PACKETS_DEAD = Counter("packets_dead_lettered_total", "Packets given up on: rejected by an analyzer or out of attempts", ["reason"])
+PACKETS_DUPLICATE = Counter("packets_duplicate_total", "Packets acked but not queued because their packetId was already accepted")
+PACKETS_INFLIGHT = Gauge("packets_inflight", "Packets taken off the queue and not yet delivered or requeued", multiprocess_mode="livesum")
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+EMIT_LATENCY = Histogram("emitter_to_distributor_seconds", "From the packet's first message ts to ingest", buckets=_LATENCY_BUCKETS)
+QUEUE_WAIT = Histogram("queue_wait_seconds", "From ingest until a dispatcher takes the packet", buckets=_LATENCY_BUCKETS)
+FORWARD_LATENCY = Histogram("distributor_to_analyzer_seconds", "Analyzer request time, per attempt", buckets=_LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("forward_batch_packets", "Packets per analyzer request", buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+QUEUE_SIZE = Gauge("queue_size", "Packets in the distributor queue", multiprocess_mode="livesum")
+WORKER_BUSY = Gauge("dispatcher_worker_busy", "1 while a dispatcher worker is handling a packet", ["worker"], multiprocess_mode="livesum")
+WORKER_BUSY_SECONDS = Counter("dispatcher_worker_busy_seconds_total", "Time dispatcher workers spent handling packets", ["worker"])
+WORKER_IDLE_SECONDS = Counter("dispatcher_worker_idle_seconds_total", "Time dispatcher workers spent waiting on the queue", ["worker"])
 
-RECENT_LOGS: deque = deque(maxlen=500)     # keep last 500 packets
-log_clients: set[WebSocket] = set()        # connected UI sockets
+# Delivered packets, indexed by emitter, analyzer, level and time for GET /logs and filtered /ws/logs
+LOG_STORE = LogStore(capacity=int(os.getenv("LOG_RETENTION", "50000")))
+LOG_BACKLOG = int(os.getenv("LOG_BACKLOG", "500"))       # entries replayed to a new /ws/logs socket
+LOG_QUERY_MAX = 1000
+# Live /ws/logs feed: sampled entries coalesced into one shared frame every LOG_FLUSH_MS or LOG_FRAME_MAX entries
+LOGS = LogBroadcaster(
+    flush_ms=float(os.getenv("LOG_FLUSH_MS", "100")),
+    frame_max=int(os.getenv("LOG_FRAME_MAX", "200")),
+    client_queue=int(os.getenv("LOG_CLIENT_QUEUE", "16")),       # frames buffered per socket before dropping
+    drop_policy=os.getenv("LOG_DROP_POLICY", "drop_oldest"),     # drop_oldest | drop_newest
+    sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "1.0")),      # fraction of forwarded packets shown
+)
 
 # --------------- HTTP client and queue ----------------
-# Async HTTP client shared by workers
-HTTP = httpx.AsyncClient(timeout=httpx.Timeout(5.0, connect=2.0))
-# In-memory queue
-QUEUE: asyncio.Queue = asyncio.Queue(maxsize=10_000)
+# Outbound HTTP clients, one per traffic class and one pool per analyzer (see clients.py)
+HTTP = HttpClients(
+    analyzer_pool=int(os.getenv("ANALYZER_POOL_SIZE", str(ANALYZER_INFLIGHT))),
+    analyzer_keepalive=int(os.getenv("ANALYZER_KEEPALIVE", os.getenv("ANALYZER_POOL_SIZE", str(ANALYZER_INFLIGHT)))),
+    keepalive_expiry=float(os.getenv("KEEPALIVE_EXPIRY", "30")),
+    http2=os.getenv("ANALYZER_HTTP2", "0") == "1",
+    health_timeout=float(os.getenv("HEALTH_TIMEOUT", "0.5")),
+)
+# In-memory queue, with an optional disk tier (SPILL_DIR) that takes the overflow
+SPILL_DIR = os.getenv("SPILL_DIR", "")
+if SPILL_DIR and CLUSTER_DIR:
+    SPILL_DIR = os.path.join(SPILL_DIR, f"worker-{CLUSTER_WORKER}")   # each worker keeps its own log
+SPILL_SEGMENT_MB = int(os.getenv("SPILL_SEGMENT_MB", "64"))
+SPILL_MAX_MB = int(os.getenv("SPILL_MAX_MB", "1024"))
+QUEUE_MAXSIZE = int(os.getenv("QUEUE_MAXSIZE", "10000"))
+QUEUE: SpillQueue = SpillQueue(
+    maxsize=QUEUE_MAXSIZE,
+    spill=SpillLog(SPILL_DIR, SPILL_SEGMENT_MB << 20, SPILL_MAX_MB << 20) if SPILL_DIR else None,
+    encode=codec.encode_packet,
+    decode=lambda payload, lane: _unspill(payload, lane),
+    quantum=int(os.getenv("FAIR_QUANTUM", "8")),       # packets per emitter per round-robin turn
+)
+def _unspill(payload: bytes, lane: str) -> Packet:
+    """A packet back from the spill log, which keeps only its lane; its own emitter is read back out of the body."""
+    try:
+        emitter = codec.first_field(Packet(payload).json, "emitter")
+    except ValueError:
+        emitter = None
+    return Packet(payload, None, emitter or "", lane=lane)
+
+# Credit-based admission: each emitter may have FAIR_LANE_MAX packets waiting (memory + disk). Beyond that
+# ingest answers 429 with Retry-After and the emitter backs off on its own.
+FAIR_LANE_MAX = int(os.getenv("FAIR_LANE_MAX", str(QUEUE_MAXSIZE // max(1, len(raw_emitters)))))
+FLOW_RETRY_AFTER = float(os.getenv("FLOW_RETRY_AFTER", "1.0"))
+# At-least-once: emitters re-send anything not acked with a 202, so ingest remembers accepted packetIds for
+# DEDUP_WINDOW seconds and acks a re-sent packet without queueing it again. Workers in multi-process mode share
+# one index, since a re-sent packet may reach a different worker.
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "120"))
+DEDUP_MAX_IDS = int(os.getenv("DEDUP_MAX_IDS", "500000"))
+if CLUSTER_DIR:
+    DEDUP = SharedDedupIndex(pathlib.Path(CLUSTER_DIR) / "dedup", window=DEDUP_WINDOW, max_ids=DEDUP_MAX_IDS)
+else:
+    DEDUP = DedupIndex(window=DEDUP_WINDOW, max_ids=DEDUP_MAX_IDS)
+SPILL_SIZE = Gauge("spill_packets", "Packets waiting in the disk spill log", multiprocess_mode="livesum")
+
+# --------------- Instrumentation (see instrument.py) ----------------
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))   # seconds between event-loop lag samples
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# --------------- Compression (COMPRESSION=1, see compression.py) ----------------
+# Compressed ingest is always accepted. COMPRESSION=1 also trains a shared zstd dictionary from delivered packets
+# and compresses traffic to analyzers that advertise an encoding in their /health Accept-Encoding header.
+COMPRESSION = os.getenv("COMPRESSION", "0") == "1"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "512"))       # plain bodies below this go uncompressed
+COMPRESS_DICT_BYTES = int(os.getenv("COMPRESS_DICT_BYTES", str(16 * 1024)))
+COMPRESS_TRAIN_SAMPLES = int(os.getenv("COMPRESS_TRAIN_SAMPLES", "2000"))   # delivered packets to train from
+COMPRESS_RETRAIN_SECONDS = float(os.getenv("COMPRESS_RETRAIN_SECONDS", "600"))
+# Dictionaries must outlive the packets compressed with them: by default they are kept next to the spill log
+# (which survives restarts), else in CLUSTER_DIR so the workers share them, else only in memory.
+_SPILL_ROOT = os.getenv("SPILL_DIR", "")
+COMPRESS_DICT_DIR = os.getenv("COMPRESS_DICT_DIR", os.path.join(_SPILL_ROOT, "zstd-dicts") if _SPILL_ROOT
+                              else os.path.join(CLUSTER_DIR, "dicts") if CLUSTER_DIR else "")
+
+IN_FLIGHT: dict[asyncio.Task, list[Packet]] = {}     # each dispatcher's batch, taken off the queue
+
+def _held_dictionaries() -> set[int]:
+    """Dictionaries the packets still held need: queued in memory, in flight, or in the recent-log ring. Without
+    COMPRESS_DICT_DIR these aren't dropped (there is no spill log then, so nothing else can hold a packet)."""
+    held = itertools.chain(QUEUE.memory_items(), *IN_FLIGHT.values(), LOG_STORE.packets())
+    return {compression.dict_id(p.body) for p in held if p.encoding == "zstd"}
+
+if compression.zstandard is not None:
+    compression.DICTIONARIES = compression.Dictionaries(COMPRESS_DICT_DIR or None, in_use=_held_dictionaries)
+
+def _encoding(request: Request) -> str | None:
+    encoding = request.headers.get("content-encoding", "identity").lower()
+    if encoding == "identity":
+        return None
+    if encoding not in compression.ENCODINGS:
+        raise HTTPException(415, f"unsupported content-encoding {encoding!r}, expected one of {compression.ENCODINGS}")
+    return encoding
+
+def _one_line(plain: bytes) -> bool:
+    """True if a compressed frame's content is one NDJSON line: frames are concatenated into one stream when they
+    are sent on, so a frame can only be kept as it arrived if it ends in exactly one newline and holds no other."""
+    return plain.endswith(b"\n") and b"\n" not in plain[:-1]
+
+def _plain(body: bytes, encoding: str | None) -> bytes:
+    """The body decompressed; a 415 tells the emitter to fetch the current dictionary."""
+    if encoding is None:
+        return body
+    try:
+        return compression.decompress(body, encoding)
+    except compression.UnknownDictionary as err:
+        raise HTTPException(415, str(err)) from err
+
+@app.get("/compression")
+def compression_info():
+    """What emitters and analyzers need at startup: accepted encodings and the current dictionary version."""
+    version = compression.DICTIONARIES.version if compression.zstandard is not None else None
+    return {
+        "encodings": list(compression.ENCODINGS),
+        "enabled": COMPRESSION,
+        "dictionary": version,
+        "dictionary_url": f"/compression/dictionaries/{version}" if version else None,
+        "min_bytes": COMPRESS_MIN_BYTES,
+    }
+
+@app.get("/compression/dictionaries/{dict_id}")
+def get_dictionary(dict_id: int):
+    if compression.zstandard is None:
+        raise HTTPException(404, "zstd is not available")
+    try:
+        data = compression.DICTIONARIES.get(dict_id).as_bytes()
+    except compression.UnknownDictionary as err:
+        raise HTTPException(404, str(err)) from err
+    return Response(data, media_type="application/octet-stream")
 
 # --------------- API endpoints ----------------
-@app.post("/log-packet")
-async def ingest(packet: dict):
-    """Emitters POST packets here."""
+async def ingest(request: Request):
+    """Emitters POST packets here, optionally compressed (Content-Encoding: zstd or gzip)."""
+    body = await request.body()
+    started = time.perf_counter()
+    encoding = _encoding(request)
+    try:
+        plain = _plain(body, encoding)
+        packet = codec.loads(plain)
+    except ValueError as err:
+        raise HTTPException(400, f"invalid packet: {err}") from err
+    if not isinstance(packet, dict):
+        raise HTTPException(400, "expected a packet object")
+    # kept as it arrived, so a compressed packet stays compressed, unless it isn't one NDJSON line: packets are
+    # sent on as NDJSON lines, so a pretty-printed one (or a frame without its newline) is re-encoded, plain
+    keep = _one_line(plain) if encoding is not None else b"\n" not in plain.rstrip()
+    packets = [Packet.from_dict(packet, body if keep else None)]
+    stage["ingest"].observe(time.perf_counter() - started)
+    return await _enqueue(packets, str(packet.get("emitter", "")), [packet])
+
+async def ingest_raw(request: Request):
+    """Emitters POST packets here (passthrough mode).
+
+    Only the X-Packet-Id / X-Emitter headers are checked; the body is decoded (and decompressed) solely when
+    they are missing. X-Packet-Levels saves decompressing a compressed packet to index it for /logs.
+    """
+    body = await request.body()
+    started = time.perf_counter()
+    encoding = _encoding(request)
+    emitter = request.headers.get("x-emitter")
+    packet_id = request.headers.get("x-packet-id")
+    if encoding is None and b"\n" in body.rstrip():
+        # packets are sent on as NDJSON lines, so a pretty-printed one is re-encoded (one of the few decoded)
+        try:
+            body = codec.dumps(codec.loads(body))
+        except ValueError as err:
+            raise HTTPException(400, f"invalid packet: {err}") from err
+    if not (packet_id and emitter):
+        try:
+            packet = codec.loads(_plain(body, encoding))
+        except ValueError as err:
+            raise HTTPException(400, f"invalid packet: {err}") from err
+        if not isinstance(packet, dict) or "packetId" not in packet or "emitter" not in packet:
+            raise HTTPException(400, "packet needs packetId and emitter")
+        emitter, packet_id = str(packet["emitter"]), packet["packetId"]
+    levels = codec.header_levels(request.headers.get("x-packet-levels"), 1)[0]
+    stage["ingest"].observe(time.perf_counter() - started)
+    return await _enqueue([Packet(body, packet_id, emitter, levels=levels)], emitter)
+
+app.add_api_route("/log-packet", ingest_raw if PASSTHROUGH else ingest, methods=["POST"])
+
+@app.post("/log-packets")
+async def ingest_many(request: Request):
+    """Emitters POST a JSON array of packets here, or NDJSON with content-type application/x-ndjson.
+
+    NDJSON lines are queued as they arrived, without re-encoding; in passthrough mode they aren't decoded
+    either, and their ids come from the comma-separated X-Packet-Ids header. A compressed NDJSON body sent as one
+    frame per packet (X-Frame-Sizes) keeps each packet's frame, and in passthrough mode isn't decompressed at
+    all (the emitter's frames are taken to be one NDJSON line each); X-Packet-Levels then gives each packet's
+    message levels for the log index. Otherwise, if any frame isn't exactly one line, the packets are queued as
+    their plain lines instead. The batch is charged to the X-Emitter header, or to the first packet's emitter.
+    """
+    body = await request.body()
+    started = time.perf_counter()
+    emitter = request.headers.get("x-emitter")
+    encoding = _encoding(request)
+    frames = compression.split(body, request.headers.get("x-frame-sizes")) if encoding else None
+    header_ids = request.headers.get("x-packet-ids")
+    decoded = None
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            if PASSTHROUGH and frames is not None and header_ids and len(header_ids.split(",")) == len(frames):
+                levels = codec.header_levels(request.headers.get("x-packet-levels"), len(frames))
+                packets = [Packet(frame, pid, emitter or "", levels=lv)
+                           for frame, pid, lv in zip(frames, header_ids.split(","), levels)]
+            else:
+                # with frames, each is decompressed on its own to check it is one line and can be kept as it arrived
+                plains = [_plain(frame, encoding) for frame in frames] if frames is not None else [body]
+                lines = [line for line in b"".join(plains).splitlines() if line.strip()]
+                bodies = frames if frames is not None and all(map(_one_line, plains)) else lines
+                if PASSTHROUGH:
+                    ids = _packet_ids(lines, header_ids)
+                    levels = codec.header_levels(request.headers.get("x-packet-levels"), len(lines))
+                    packets = [Packet(b, pid, emitter or "", levels=lv) for b, pid, lv in zip(bodies, ids, levels)]
+                else:
+                    decoded = [codec.loads(line) for line in lines]
+                    _check_batch(decoded)
+                    packets = [Packet.from_dict(p, b) for p, b in zip(decoded, bodies)]
+        else:
+            decoded = codec.loads(_plain(body, encoding))
+            _check_batch(decoded)
+            packets = [Packet.from_dict(p) for p in decoded]
+    except ValueError as err:
+        raise HTTPException(400, f"invalid packet batch: {err}") from err
+    if emitter is None:
+        emitter = packets[0].emitter if packets else ""
+    stage["ingest"].observe(time.perf_counter() - started)
+    return await _enqueue(packets, emitter, decoded)
+
+def _check_batch(packets):
+    if not isinstance(packets, list) or not all(isinstance(p, dict) for p in packets):
+        raise HTTPException(400, "expected an array of packets")
+
+def _packet_ids(lines: list[bytes], header: str | None) -> list[str | None]:
+    ids = header.split(",") if header else []
+    if len(ids) == len(lines):
+        return ids
+    ids = []
+    for line in lines:       # no usable header, decode just for the ids
+        try:
+            ids.append(codec.loads(line).get("packetId"))
+        except (ValueError, AttributeError):
+            ids.append(None)
+    return ids
+
+def _emitted_at(packet: dict) -> float | None:
     try:
-        await QUEUE.put(packet)  # may await if queue is full
-        PACKETS_RX.inc()
+        return datetime.datetime.fromisoformat(packet["messages"][0]["ts"]).timestamp()
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+async def _enqueue(packets: list[Packet], emitter: str, decoded: list[dict] | None = None):
+    """Admit packets into the emitter's lane, or tell the emitter to back off.
+
+    `decoded` holds the packets as dicts when ingest parsed them, for the emitter latency histogram. A 202 acks
+    the whole request, including packets skipped as duplicates.
+    """
+    if len(emitter.encode()) > MAX_KEY_BYTES:
+        # the emitter is the packet's lane key, which the spill log stores with a one-byte length
+        raise HTTPException(400, f"emitter id longer than {MAX_KEY_BYTES} bytes")
+    started = time.perf_counter()
+    credit = FAIR_LANE_MAX - QUEUE.backlog(emitter)
+    if credit <= 0 or QUEUE.full():
+        PACKETS_THROTTLED.labels(emitter).inc(len(packets))
+        return JSONResponse(
+            {"status": "throttled", "credit": 0, "retry_after": FLOW_RETRY_AFTER},
+            status_code=429,
+            headers={"Retry-After": str(math.ceil(FLOW_RETRY_AFTER))},
+        )
+    queued = duplicates = 0
+    now = time.time()
+    try:
+        for i, packet in enumerate(packets):
+            if packet.id is not None and packet.id in DEDUP:
+                duplicates += 1
+                continue
+            packet.lane = emitter       # the lane it was charged to, and goes back to if requeued
+            # fill whatever room the queue has without yielding, only await once it is full
+            if QUEUE.full():
+                await QUEUE.put(packet, emitter)
+            else:
+                QUEUE.put_nowait(packet, emitter)
+            if packet.id is not None:
+                DEDUP.add(packet.id)      # only once queued, so a failed request can be re-sent
+            queued += 1
+            if decoded is not None:
+                emitted = _emitted_at(decoded[i])
+                if emitted is not None:
+                    EMIT_LATENCY.observe(max(0.0, now - emitted))
+        PACKETS_RX.inc(queued)
+        PACKETS_DUPLICATE.inc(duplicates)
         QUEUE_SIZE.set(QUEUE.qsize())
-        return JSONResponse({"status": "queued"}, status_code=202)
+        SPILL_SIZE.set(QUEUE.spilled)
+        return JSONResponse(
+            {"status": "queued", "count": queued, "duplicates": duplicates, "credit": max(0, credit - queued)},
+            status_code=202,
+        )
     except asyncio.CancelledError:
         raise
     except Exception as exc:
         logging.exception("failed to enqueue")
         return JSONResponse({"error": str(exc)}, status_code=500)
+    finally:
+        stage["enqueue"].observe(time.perf_counter() - started)
 
 @app.get("/registry")
 async def list_registry():
     return [a.model_dump() for a in registry.analyzers]
 
+@app.get("/registry/policy")
+async def get_policy():
+    return {"policy": registry.policy, "available": sorted(POLICIES)}
+
+@app.post("/registry/policy")
+async def set_policy(data: dict):
+    try:
+        await registry.set_policy(data["policy"])
+    except KeyError as err:
+        raise HTTPException(400, f"missing field: {err}") from err
+    except ValueError as err:
+        raise HTTPException(400, str(err)) from err
+    return {"policy": registry.policy}
+
 @app.post("/registry/add")
 async def add_analyzer(data: dict):
     try:
@@ -78,7 +477,6 @@ async def add_analyzer(data: dict):
             id=data["id"],
             url=data["url"],
             weight=weight,
-            current_weight=0.0,
             effective_weight=0.0,
             healthy=True,
             admin_enabled=True,
@@ -96,6 +494,7 @@ async def add_analyzer(data: dict):
 @app.delete("/registry/{aid}")
 async def remove_analyzer(aid: str):
     await registry.remove(aid)
+    await HTTP.drop(aid)
     return {"removed": aid}
 
 @app.post("/analyzer/{aid}/enable")
@@ -114,7 +513,7 @@ async def proxy_rate(eid: str, body: dict):
     e = emitters_index.get(eid)
     if not e:
         raise HTTPException(404, "unknown emitter")
-    await HTTP.post(f'{e["url"]}/rate', json=body)
+    await HTTP.control_post(f'{e["url"]}/rate', json=body)
     return {"ok": True}
 
 @app.post("/emitter/{eid}/pause")
@@ -122,7 +521,7 @@ async def proxy_pause(eid: str):
     e = emitters_index.get(eid)
     if not e:
         raise HTTPException(404, "unknown emitter")
-    await HTTP.post(f'{e["url"]}/pause')
+    await HTTP.control_post(f'{e["url"]}/pause')
     return {"ok": True}
 
 @app.post("/emitter/{eid}/resume")
@@ -130,7 +529,7 @@ async def proxy_resume(eid: str):
     e = emitters_index.get(eid)
     if not e:
         raise HTTPException(404, "unknown emitter")
-    await HTTP.post(f'{e["url"]}/resume')
+    await HTTP.control_post(f'{e["url"]}/resume')
     return {"ok": True}
 
 @app.get("/emitter/{eid}/metrics")
@@ -138,188 +537,556 @@ async def proxy_metrics(eid: str):
     e = emitters_index.get(eid)
     if not e:
         raise HTTPException(404, "unknown emitter")
-    response = await HTTP.get(f'{e["url"]}/metrics')
+    response = await HTTP.control_get(f'{e["url"]}/metrics')
     return response.json()
 
-async def _pause_all_emitters():
-    global SYSTEM_PAUSED
-    if SYSTEM_PAUSED:
-        return
-    SYSTEM_PAUSED = True
-    for eid, meta in EMITTER_METRICS.items():
-        try:
-            await HTTP.post(f'{emitters_index[eid]["url"]}/pause')
-            logging.warning("Back-pressure: paused emitter %s", eid)
-            meta["paused"] = True
-        except Exception as exc:
-            logging.error("Failed to pause emitter %s: %s", eid, exc)
-
-async def _resume_all_emitters():
-    global SYSTEM_PAUSED
-    if not SYSTEM_PAUSED:
-        return
-    SYSTEM_PAUSED = False
-    for eid, meta in EMITTER_METRICS.items():
-        try:
-            await HTTP.post(f'{emitters_index[eid]["url"]}/resume')
-            await HTTP.post(f'{emitters_index[eid]["url"]}/rate', json={"rate_rps": meta["prev_rate"]})
-            logging.info("Resumed %s at %.2f rps", eid, meta["prev_rate"])
-            meta["paused"] = False
-        except Exception as exc:
-            logging.error("Failed to resume emitter %s: %s", eid, exc)
-
 # ----------------- Prometheus Metrics ----------------
 @app.get("/metrics")
 def prom_metrics():
+    if CLUSTER_DIR:
+        # aggregate the samples every worker wrote to PROMETHEUS_MULTIPROC_DIR
+        from prometheus_client import CollectorRegistry
+        from prometheus_client.multiprocess import MultiProcessCollector
+        collector = CollectorRegistry()
+        MultiProcessCollector(collector)
+        return PlainTextResponse(generate_latest(collector))
     return PlainTextResponse(generate_latest())
 
-# ---------------- WebSocket for real-time updates ----------------
-clients: set[WebSocket] = set()
+@app.get("/accounting")
+def accounting():
+    """Where every accepted packet is. `unaccounted` stays 0 unless packets were lost in between."""
+    if CLUSTER_DIR:
+        totals = metric_totals()
+        total = lambda metric, name: sum(v for (n, _), v in totals.items() if n == name)
+    else:
+        total = lambda metric, name: sum(_counter_totals(metric).values()) if name.endswith("_total") else metric._value.get()
+    counts = {
+        "received": total(PACKETS_RX, "packets_received_total"),
+        "duplicates": total(PACKETS_DUPLICATE, "packets_duplicate_total"),
+        "forwarded": total(PACKETS_TX, "packets_forwarded_total"),
+        "requeued": total(PACKETS_REQUEUED, "packets_requeued_total"),
+        "dropped": total(PACKETS_DROPPED, "packets_dropped_total"),
+        "dead_lettered": total(PACKETS_DEAD, "packets_dead_lettered_total"),
+        "queued": total(QUEUE_SIZE, "queue_size"),
+        "inflight": total(PACKETS_INFLIGHT, "packets_inflight"),
+    }
+    counts["unaccounted"] = (counts["received"] - counts["forwarded"] - counts["dropped"] - counts["dead_lettered"]
+                             - counts["queued"] - counts["inflight"])
+    return counts
+
+def _counter_totals(counter) -> dict[tuple, float]:
+    """Current value of every label set of a counter, through the public collect() API."""
+    return {tuple(s.labels.values()): s.value for m in counter.collect() for s in m.samples if s.name.endswith("_total")}
+
+def _metrics_snapshot() -> dict:
+    """One /ws/metrics snapshot, taken once per tick no matter how many dashboards are connected."""
+    if CLUSTER_DIR:
+        totals = metric_totals()
+        tx = {k[1]: v for k, v in totals.items() if k[0] == "packets_forwarded_total"}
+        rx = totals.get(("packets_received_total", ()), 0)
+        depth = totals.get(("queue_size", ()), 0)
+    else:
+        tx = _counter_totals(PACKETS_TX)
+        rx = _counter_totals(PACKETS_RX).get((), 0)
+        depth = QUEUE.qsize()
+    return {
+        "ts": time.time(),
+        "queue_depth": depth,
+        "packets_rx": rx,
+        "analyzers": {
+            a.id: {
+                "id": a.id,
+                "effective_weight": a.effective_weight,
+                "healthy": a.healthy,
+                "admin_enabled": a.admin_enabled,
+                "breaker": a.breaker,
+                "tx_packets": tx.get((a.id,), 0),
+            }
+            for a in registry.analyzers
+        },
+        "emitters": {
+            e_id: {
+                "emitter_id": e_id,
+                "buffer_size": vals["buffer_size"],
+                "rate_rps": vals["rate_rps"],
+                "paused": vals["paused"],
+            }
+            for e_id, vals in EMITTER_METRICS.items()
+        },
+    }
+
+METRICS_STREAM = MetricsPublisher(_metrics_snapshot, interval=float(os.getenv("METRICS_INTERVAL", "1.0")))
 
 @app.websocket("/ws/metrics")
 async def ws_metrics(ws: WebSocket):
+    """A full snapshot, then one delta frame per tick (see publisher.py for the format)."""
     await ws.accept()
-    clients.add(ws)
-    try:
-        while True:
-            await asyncio.sleep(1)
-            def _tx_for(a_id: str) -> int:
-                try:
-                    return PACKETS_TX.labels(a_id)._value.get()     # after first .inc()
-                except KeyError:
-                    return 0
-
-            payload = {
-                "ts": time.time(),
-                "queue_depth": QUEUE.qsize(),
-                "analyzers": [
-                    {
-                        "id": a.id,
-                        "effective_weight": a.effective_weight,
-                        "healthy": a.healthy,
-                        "admin_enabled": a.admin_enabled,
-                        "tx_packets": _tx_for(a.id),
-                    }
-                    for a in registry.analyzers
-                ],
-                "emitters": [
-                    {
-                        "emitter_id": e_id,
-                        "buffer_size": vals["buffer_size"],
-                        "rate_rps": vals["rate_rps"],
-                        "paused": vals["paused"],
-                    }
-                    for e_id, vals in EMITTER_METRICS.items()
-                ],
-                "packets_rx": PACKETS_RX._value.get(),
-            }
-            await ws.send_json(payload)
-    except WebSocketDisconnect:
-        pass
-    finally:
-        clients.discard(ws)
+    await METRICS_STREAM.serve(ws)
 
 @app.websocket("/ws/logs")
-async def ws_logs(ws: WebSocket):
+async def ws_logs(ws: WebSocket, emitter: str | None = None, analyzer: str | None = None, level: str | None = None,
+                  encoding: str | None = None):
+    """Frames are JSON arrays of log entries; the first one is the recent-log backlog.
+
+    The emitter, analyzer and level query parameters narrow both the backlog and the live feed. With
+    encoding=zstd or gzip frames are sent as binary messages compressed in that encoding (zstd with the current
+    dictionary, see /compression).
+    """
     await ws.accept()
-    # send backlog first
-    for item in list(RECENT_LOGS):
-        await ws.send_json(item)
-    log_clients.add(ws)
-    try:
-        while True:
-            await asyncio.sleep(3600)  # keep the connection alive
-    except WebSocketDisconnect:
-        pass
-    finally:
-        log_clients.discard(ws)
+    where = LogFilter(emitter, analyzer, level)
+    found, _ = LOG_STORE.query(where, limit=LOG_BACKLOG)
+    backlog = [e for e in (codec.log_entry(packet, analyzer_id) for _, _, packet, analyzer_id in reversed(found))
+               if e is not None]
+    await LOGS.serve(ws, backlog, where, encoding if encoding in compression.ENCODINGS else None)
 
-# ---------------- Log WebSocket clients ----------------
-async def _broadcast_log(entry: dict):
-    for ws in list(log_clients):
-        try:
-            await ws.send_json(entry)
-        except Exception as exc:
-            logging.error("Failed to send log entry to client: %s", exc)
-            log_clients.discard(ws)
+@app.get("/logs")
+def query_logs(emitter: str | None = None, analyzer: str | None = None, level: str | None = None,
+               since: float | None = None, until: float | None = None, last: float | None = None,
+               before: int | None = None, limit: int = 100):
+    """Recent delivered packets, newest first. `since`/`until` are epoch seconds and `last` means the last N
+    seconds; pass `next` back as `before` for the following page."""
+    if last is not None:
+        since = time.time() - last
+    found, cursor = LOG_STORE.query(LogFilter(emitter, analyzer, level), since=since, until=until,
+                                    before=before, limit=max(0, min(limit, LOG_QUERY_MAX)))
+    entries = b",".join(e for e in (codec.stored_entry(*entry) for entry in found) if e is not None)
+    return Response(b'{"entries":[' + entries + b'],"next":' + codec.dumps(cursor) + b"}", media_type="application/json")
+
+@app.get("/dead-letters")
+def dead_letters(limit: int = 100):
+    """Packets given up on, newest first (this worker's, in multi-process mode)."""
+    return list(DEAD_LETTERS)[::-1][:max(0, limit)]
+
+@app.get("/debug/profile")
+async def profile(seconds: float = 10.0, hz: float = 100.0):
+    """Sample the event loop thread for `seconds` and return folded stacks, one "a;b;c count" line per stack.
+
+    Feed the output to flamegraph.pl or speedscope. Costs nothing unless a profile is running.
+    """
+    loop_thread = threading.get_ident()
+    seconds, hz = min(max(seconds, 0.1), PROFILE_MAX_SECONDS), min(max(hz, 1.0), 1000.0)
+    try:
+        folded = await asyncio.to_thread(instrument.sample_stacks, loop_thread, seconds, hz)
+    except instrument.ProfilerBusy:
+        raise HTTPException(409, "a profile is already running") from None
+    return PlainTextResponse(folded)
 
 # ---------------- Background worker ----------------
-async def dispatcher():
+DISPATCHERS: list[asyncio.Task] = []
+BUSY: set[asyncio.Task] = set()         # dispatchers holding a batch, given SHUTDOWN_GRACE_MS on shutdown
+STOPPING = asyncio.Event()              # set on shutdown: a dispatcher exits after its batch instead of taking more
+
+async def dispatcher(worker: str = "0"):
     """Pop packet -> pick analyzer -> forward"""
-    while True:
-        packet = await QUEUE.get()
-        target = await registry.choose()
+    busy = WORKER_BUSY.labels(worker)
+    busy_seconds = WORKER_BUSY_SECONDS.labels(worker)
+    idle_seconds = WORKER_IDLE_SECONDS.labels(worker)
+    while not STOPPING.is_set():
+        idle_since = time.monotonic()
+        packet, enqueued_at = await QUEUE.get()
+        PACKETS_INFLIGHT.inc()
+        QUEUE_SIZE.set(QUEUE.qsize())
+        QUEUE_WAIT.observe(max(0.0, time.time() - enqueued_at))
+        started = time.monotonic()
+        idle_seconds.inc(started - idle_since)
+        busy.set(1)
+        BUSY.add(asyncio.current_task())
+        try:
+            await _dispatch_one(packet)
+        finally:
+            BUSY.discard(asyncio.current_task())
+            busy.set(0)
+            busy_seconds.inc(time.monotonic() - started)
+
+async def _dispatch_one(packet: Packet):
+    batch = IN_FLIGHT[asyncio.current_task()] = [packet]
+    taken = 1       # packets this call took off the queue, in flight until it returns
+    try:
+        started = time.perf_counter()
+        key = _affinity_key(packet)
+        target = await registry.choose(key=key)
+        stage["choose"].observe(time.perf_counter() - started)
         if not target:
             logging.error("No healthy analyzers! Placing packet back %s in queue", packet)
-            if not QUEUE.full():
-                await QUEUE.put(packet)
-            else:
-                logging.error("Queue is full and no analyzers available for %s", packet)
-                await _pause_all_emitters()
-            await asyncio.sleep(1)  # wait before retrying
+            # hold it for the wait, so it is only in flight meanwhile and other workers don't spin on it
+            await asyncio.sleep(1)
+            _requeue(batch)
+            return
+        filled = BATCH_MAX_PACKETS <= 1
+        deadline = time.monotonic() + RETRY_DEADLINE_MS / 1000
+        tried: set[str] = set()
+        while True:
+            tried.add(target.id)
+            try:
+                if not filled:
+                    batch = await _fill_batch(packet)
+                    taken = len(batch)
+                    filled = True
+                body, headers, batch = _request_body(target, batch)
+                if not batch:
+                    return
+                result = await _forward(target, batch, body, headers, deadline)
+                if result == "unsupported":
+                    # same analyzer, same slot, now plain
+                    body, headers, batch = _request_body(target, batch)
+                    if not batch:
+                        return
+                    result = await _forward(target, batch, body, headers, deadline)
+                if result == "delivered":
+                    return
+                if result == "rejected":
+                    await _isolate(target, batch)
+                    return
+            finally:
+                await registry.release(target.id)
+            remaining = deadline - time.monotonic()
+            if len(tried) > RETRY_MAX or remaining <= 0:
+                break
+            started = time.perf_counter()
+            try:
+                target = await asyncio.wait_for(registry.choose(exclude=tried, key=key), remaining)
+            except asyncio.TimeoutError:
+                target = None
+            stage["choose"].observe(time.perf_counter() - started)
+            if target is None:
+                break
+            PACKETS_RETRIED.labels(target.id).inc(len(batch))
+        logging.error("Requeueing %d packet(s) after %d failed attempt(s)", len(batch), len(tried))
+        _requeue(batch, failed=True)
+    except asyncio.CancelledError:
+        # shutting down: the batch goes back to the queue (and with it to the checkpoint) rather than being lost.
+        # One the analyzer already took may be delivered twice.
+        _requeue(batch)
+        raise
+    finally:
+        IN_FLIGHT.pop(asyncio.current_task(), None)
+        PACKETS_INFLIGHT.dec(taken)
+
+async def _isolate(target: Analyzer, batch: list[Packet]):
+    """`target` refused `batch` as bad: dead-letter a lone packet, or re-send a batch one packet at a time so
+    only the bad ones are dropped. Packets that then fail for another reason are requeued."""
+    if len(batch) == 1:
+        _dead_letter(batch[0], "rejected")
+        return
+    deadline = time.monotonic() + RETRY_DEADLINE_MS / 1000
+    for p in batch:
+        body, headers, sending = _request_body(target, [p])
+        if not sending:
             continue
+        result = await _forward(target, [p], body, headers, deadline)
+        if result == "rejected":
+            _dead_letter(p, "rejected")
+        elif result != "delivered":
+            _requeue([p], failed=True)
+
+def _dead_letter(packet: Packet, reason: str):
+    PACKETS_DEAD.labels(reason).inc()
+    DEAD_LETTERS.append({"id": packet.id, "emitter": packet.emitter, "reason": reason, "attempts": packet.attempts,
+                         "ts": time.time(), "body": packet.body[:256].decode(errors="replace")})
+    logging.error("Dead-lettering %s (%s)", packet, reason)
+
+def _requeue(batch: list[Packet], failed: bool = False):
+    """Back into the queue (at the end of the emitter's lane) for another try; lost only if the queue is full.
+
+    `failed` counts a delivery round against each packet; one out of rounds is dead-lettered instead. The count
+    lives on the Packet, so a packet that goes through the spill log starts over.
+    """
+    for p in batch:
+        if failed:
+            p.attempts += 1
+            if p.attempts >= DELIVERY_MAX_ATTEMPTS:
+                _dead_letter(p, "attempts")
+                continue
+            PACKETS_REQUEUED.inc()
         try:
-            response = await HTTP.post(target.url, json=packet)
-            if response.status_code == 200:
-                PACKETS_TX.labels(target.id).inc()
-                await registry.mark_success(target.id)
-                entry = {"packet": packet, "analyzer": target.id}
-                RECENT_LOGS.append(entry); asyncio.create_task(_broadcast_log(entry))
-                if SYSTEM_PAUSED:
-                    await _resume_all_emitters()
-            else:
-                await registry.mark_failure(target.id)
-        except Exception as exc:
-            logging.error("HTTP request failed for %s: %s", target.id, exc)
-            await registry.mark_failure(target.id)
+            QUEUE.put_nowait(p, p.lane)
+        except asyncio.QueueFull:
+            PACKETS_DROPPED.inc()
+            logging.error("Queue is full, dropping %s", p)
+    QUEUE_SIZE.set(QUEUE.qsize())
+
+def _request_body(target: Analyzer, batch: list[Packet]) -> tuple[bytes, dict, list[Packet]]:
+    """Body and headers for sending `batch` to `target`, and the packets the body holds.
+
+    With an encoding the analyzer accepts, packets already compressed in it go out as the frames they arrived
+    in, and runs of the others are compressed once into a frame each (above COMPRESS_MIN_BYTES); the frames
+    concatenate into one NDJSON stream. Otherwise packets go out plain. A packet that would have to be
+    decompressed but can't be (its zstd dictionary is gone) is dead-lettered and left out.
+    """
+    encoding = compression.negotiate(target.accept_encoding) if COMPRESSION else None
+    packets: list[Packet] = []
+    plain: list[bytes | None] = []      # each packet's JSON, or None when it goes out as the frame it arrived in
+    for p in batch:
+        if encoding is not None and p.encoding == encoding:
+            packets.append(p)
+            plain.append(None)
+            continue
+        try:
+            plain.append(p.json)
+        except ValueError:
+            _dead_letter(p, "undecodable")
+            continue
+        packets.append(p)
+    if not packets:
+        return b"", {}, packets
+    if BATCH_MAX_PACKETS <= 1:
+        body = plain[0]
+        if body is None:
+            return packets[0].body, {**JSON_HEADERS, "content-encoding": encoding}, packets
+        if encoding is not None and len(body) >= COMPRESS_MIN_BYTES:
+            return compression.compress(body + b"\n", encoding), {**JSON_HEADERS, "content-encoding": encoding}, packets
+        return body, JSON_HEADERS, packets
+    if encoding is None:
+        return b"[" + b",".join(plain) + b"]", JSON_HEADERS, packets
+    frames: list[bytes] = []
+    run: list[bytes] = []
+    for p, body in zip(packets, plain):
+        if body is None:
+            if run:
+                frames.append(compression.compress(b"\n".join(run) + b"\n", encoding))
+                run = []
+            frames.append(p.body)
+        else:
+            run.append(body)
+    if run:
+        joined = b"\n".join(run) + b"\n"
+        if not frames and len(joined) < COMPRESS_MIN_BYTES:
+            return joined, NDJSON_HEADERS, packets
+        frames.append(compression.compress(joined, encoding))
+    headers = {**NDJSON_HEADERS, "content-encoding": encoding, "x-frame-sizes": ",".join(str(len(f)) for f in frames)}
+    return b"".join(frames), headers, packets
+
+async def _forward(target: Analyzer, batch: list[Packet], body: bytes, headers: dict, deadline: float) -> str:
+    """One delivery attempt; updates metrics, latency and the analyzer's breaker.
+
+    Returns "delivered", "rejected" (the analyzer refused the packets themselves), "unsupported" (it refused the
+    content-encoding, and is sent plain from now on) or "failed".
+    """
+    started = time.perf_counter()
+    try:
+        return await _attempt(target, batch, body, headers, deadline)
+    finally:
+        stage["forward"].observe(time.perf_counter() - started)
+
+async def _attempt(target: Analyzer, batch: list[Packet], body: bytes, headers: dict, deadline: float) -> str:
+    url = target.url.replace("/ingest", "/ingest/batch") if BATCH_MAX_PACKETS > 1 else target.url
+    sent = time.monotonic()
+    try:
+        response = await HTTP.forward(target.id, url, body, headers, timeout=max(deadline - sent, 0.01))
+        elapsed = time.monotonic() - sent
+        status = response.status_code
+        rejected = 400 <= status < 500 and status not in _RETRYABLE_4XX
+        registry.observe(target.id, elapsed, failed=status not in (200, 415) and not rejected)
+        FORWARD_LATENCY.observe(elapsed)
+        BATCH_SIZE.observe(len(batch))
+        if rejected:
+            # the analyzer is fine, the packets aren't: no breaker failure
+            logging.warning("Analyzer %s rejected %d packet(s), status code %d", target.id, len(batch), status)
+            PROBES.observe(("analyzer", target.id), True)
+            return "rejected"
+        if status == 200:
+            PACKETS_TX.labels(target.id).inc(len(batch))
+            PROBES.observe(("analyzer", target.id), True)
+            await registry.mark_delivered(target.id, len(batch))
+            started = time.perf_counter()
+            for p in batch:
+                LOG_STORE.append(p, target.id)
+                LOGS.publish(p, target.id)
+            stage["broadcast"].observe(time.perf_counter() - started)
+            return "delivered"
+        if status == 415:
+            # the analyzer answered, it just can't read this body: not a breaker failure
+            PROBES.observe(("analyzer", target.id), True)
+            if "content-encoding" in headers:
+                # e.g. a dictionary it couldn't fetch: send it plain from now on
+                logging.warning("Analyzer %s refused %s, sending it plain", target.id, headers["content-encoding"])
+                await registry.set_accept_encoding(target.id, "")
+                return "unsupported"
+            logging.warning("Analyzer %s refused %d plain packet(s), status code 415", target.id, len(batch))
+            PACKETS_FAILED.labels(target.id).inc(len(batch))
+            return "failed"
+    except Exception as exc:
+        logging.error("HTTP request failed for %s: %s", target.id, exc)
+        registry.observe(target.id, time.monotonic() - sent, failed=True)
+        FORWARD_LATENCY.observe(time.monotonic() - sent)
+    PACKETS_FAILED.labels(target.id).inc(len(batch))
+    PROBES.observe(("analyzer", target.id), False)
+    await registry.mark_failure(target.id)
+    return "failed"
+
+async def _fill_batch(first: Packet) -> list[Packet]:
+    """Drain packets queued behind `first` until the count, byte or linger limit is hit.
+
+    Packets were encoded (and maybe compressed) at ingest; the byte limit counts them as they are held.
+    """
+    packets = IN_FLIGHT[asyncio.current_task()] = [first]
+    size = len(first.body) + 2
+    deadline = time.monotonic() + BATCH_LINGER_MS / 1000
+    while len(packets) < BATCH_MAX_PACKETS and size < BATCH_MAX_BYTES:
+        try:
+            packet, enqueued_at = QUEUE.get_nowait()
+        except asyncio.QueueEmpty:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                packet, enqueued_at = await asyncio.wait_for(QUEUE.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            except asyncio.CancelledError:
+                _requeue(packets[1:])       # the caller requeues `first`
+                PACKETS_INFLIGHT.dec(len(packets) - 1)
+                raise
+        PACKETS_INFLIGHT.inc()
+        QUEUE_WAIT.observe(max(0.0, time.time() - enqueued_at))
+        packets.append(packet)
+        size += len(packet.body) + 1
+    QUEUE_SIZE.set(QUEUE.qsize())
+    SPILL_SIZE.set(QUEUE.spilled)
+    return packets
+
+# ---------------- Health probes and emitter polling ----------------
+# Both run on the probe scheduler (see probes.py): every target on its own jittered, adaptive schedule, checked
+# concurrently. Only the cluster leader actually sends them.
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", "1.0"))    # healthy analyzer
+PROBE_FAST = float(os.getenv("PROBE_FAST", "0.2"))            # failing or recovering analyzer
+PROBE_SLOW = float(os.getenv("PROBE_SLOW", "2.0"))            # analyzer that has been healthy for a while
+EMITTER_POLL_INTERVAL = float(os.getenv("EMITTER_POLL_INTERVAL", "1.0"))
+PROBES = ProbeScheduler(fanout=int(os.getenv("PROBE_FANOUT", "64")), jitter=float(os.getenv("PROBE_JITTER", "0.2")))
+
+async def _probe_analyzer(aid: str) -> bool | None:
+    a = registry.get(aid)
+    if a is None or not a.admin_enabled or time.time() < a.last_check or not _is_leader():
+        return None
+    try:
+        response = await HTTP.probe(a.url.replace("/ingest", "/health"))
+        ok = response.status_code == 200
+    except Exception:
+        ok = False
+    if ok:
+        await registry.set_accept_encoding(aid, response.headers.get("accept-encoding", ""))
+        await registry.mark_success(aid)
+    else:
+        await registry.mark_failure(aid)
+    return ok
+
+async def _poll_emitter(e: dict) -> bool | None:
+    if not _is_leader():
+        return None
+    try:
+        r = await HTTP.control_get(f'{e["url"]}/metrics')
+        m = r.json()
+        EMITTER_METRICS[e["emitter_id"]] = {
+            "buffer_size": m["buffer_size"],
+            "rate_rps": m["rate_rps"],
+            "paused": m["paused"],
+        }
+        return True
+    except Exception:
+        # unreachable emitter -> flag as paused & buffer unknown
+        EMITTER_METRICS[e["emitter_id"]] = {"buffer_size": None, "rate_rps": 0, "paused": True}
+        return False
 
 async def health_probe():
+    """Keeps one probe target per analyzer in the registry."""
     while True:
-        await asyncio.sleep(2)
-        for a in registry.analyzers:
-            now = time.time()
-            if now < a.last_check:
-                continue
-            try:
-                response = await HTTP.get(a.url.replace("/ingest", "/health"))
-                ok = response.status_code == 200
-            except Exception as exc:
-                ok = False
-            if ok:
-                await registry.mark_success(a.id)
-            else:
-                await registry.mark_failure(a.id)
+        current = {a.id for a in registry.analyzers}
+        for key in PROBES.keys("analyzer"):
+            if key[1] not in current:
+                PROBES.discard(key)
+        known = {key[1] for key in PROBES.keys("analyzer")}
+        for aid in current - known:
+            PROBES.add(("analyzer", aid), "analyzer", lambda aid=aid: _probe_analyzer(aid),
+                       base=PROBE_INTERVAL, fast=PROBE_FAST, slow=PROBE_SLOW)
+        await asyncio.sleep(1)
 
 async def poll_emitters():
+    for e in raw_emitters:
+        PROBES.add(("emitter", e["emitter_id"]), "emitter", lambda e=e: _poll_emitter(e), base=EMITTER_POLL_INTERVAL)
+    while STATE is not None:
+        # followers show the leader's view of the emitters
+        await asyncio.sleep(EMITTER_POLL_INTERVAL)
+        if _is_leader():
+            STATE.update(lambda doc: doc.__setitem__("emitters", EMITTER_METRICS))
+
+async def compression_trainer():
+    """Trains the shared zstd dictionary from delivered packets once enough have been seen, then retrains every
+    COMPRESS_RETRAIN_SECONDS. Followers adopt whatever the leader wrote to COMPRESS_DICT_DIR."""
+    trained_at = None
     while True:
-        await asyncio.sleep(1)
-        for e in raw_emitters:
+        await asyncio.sleep(5)
+        if not _is_leader():
+            compression.DICTIONARIES.refresh()
+            continue
+        due = trained_at is None or time.monotonic() - trained_at >= COMPRESS_RETRAIN_SECONDS
+        if not due or len(LOG_STORE) < COMPRESS_TRAIN_SAMPLES:
+            continue
+        found, _ = LOG_STORE.query(limit=COMPRESS_TRAIN_SAMPLES)
+        samples = []
+        for _, _, packet, _ in found:
             try:
-                r = await HTTP.get(f'{e["url"]}/metrics')
-                m = r.json()
-                EMITTER_METRICS[e["emitter_id"]] = {
-                    "buffer_size": m["buffer_size"],
-                    "rate_rps": m["rate_rps"],
-                    "paused": m["paused"],
-                    "prev_rate": m["rate_rps"] or EMITTER_METRICS[e["emitter_id"]]["prev_rate"],
-                }
-                global emitters_index
-                emitters_index = {e["emitter_id"]: e for e in raw_emitters}
-            except Exception:
-                # unreachable emitter -> flag as paused & buffer unknown
-                EMITTER_METRICS[e["emitter_id"]] = {"buffer_size": None, "rate_rps": 0, "paused": True}
+                samples.append(packet.json + b"\n")    # frames hold one packet and a newline
+            except ValueError:
+                continue
+        try:
+            data = await asyncio.to_thread(compression.train, samples, COMPRESS_DICT_BYTES)
+            version = compression.DICTIONARIES.add(data)      # on the loop: it looks at the queued packets
+        except Exception as exc:
+            logging.warning("zstd dictionary training failed: %s", exc)
+        else:
+            logging.info("Trained zstd dictionary %d from %d packets", version, len(samples))
+        trained_at = time.monotonic()
+
+async def cluster_sync():
+    """Follow the shared state: adopt registry changes made by other workers and the leader's emitter poll."""
+    seen = -1
+    while True:
+        await asyncio.sleep(CLUSTER_SYNC_MS / 1000)
+        LEADER.try_acquire()
+        if STATE.version == seen:
+            continue
+        seen, doc = STATE.read()
+        for aid in await SYNC.apply(doc):
+            await HTTP.drop(aid)
+        if not _is_leader():
+            EMITTER_METRICS.update(doc.get("emitters", {}))
 
 @app.on_event("startup")
 async def _startup():
-    asyncio.create_task(dispatcher())
+    if CLUSTER_DIR:
+        LEADER.try_acquire()
+        SYNC.seed()
+        await SYNC.apply(STATE.read()[1])
+        asyncio.create_task(cluster_sync())
+    for i in range(DISPATCH_WORKERS):
+        DISPATCHERS.append(asyncio.create_task(dispatcher(f"{CLUSTER_WORKER}.{i}" if CLUSTER_DIR else str(i))))
+    asyncio.create_task(PROBES.run())
     asyncio.create_task(poll_emitters())
+    asyncio.create_task(LOGS.run())
+    asyncio.create_task(METRICS_STREAM.run())
     asyncio.create_task(health_probe())
+    asyncio.create_task(instrument.monitor_loop(LOOP_LAG_INTERVAL))
+    if COMPRESSION and compression.zstandard is not None:
+        compression.DICTIONARIES.refresh()      # carry on with the dictionary from before a restart
+        asyncio.create_task(compression_trainer())
     logging.info("Log Distributor started")
 
-def _sigterm(*_):
-    logging.warning("SIGTERM-shutting down")
-    raise SystemExit()
-
-signal.signal(signal.SIGTERM, _sigterm)
+@app.on_event("shutdown")
+async def _shutdown():
+    """uvicorn stops taking requests on SIGTERM, then runs this: stop the dispatchers, put what they were holding
+    back in the queue, then checkpoint the queue."""
+    STOPPING.set()
+    for task in DISPATCHERS:
+        if task not in BUSY:
+            task.cancel()
+    busy = [task for task in DISPATCHERS if task in BUSY]
+    if busy:
+        logging.warning("Shutting down: waiting on %d dispatcher(s) mid-delivery", len(busy))
+        _, late = await asyncio.wait(busy, timeout=SHUTDOWN_GRACE_MS / 1000)
+        for task in late:
+            task.cancel()
+    await asyncio.gather(*DISPATCHERS, return_exceptions=True)
+    QUEUE.close()
+    await HTTP.aclose()
 
 app.mount("/", StaticFiles(directory=os.getenv("STATIC_DIR", pathlib.Path(__file__).parent / "static"), html=True), name="static")
\ No newline at end of file
@@ -0,0 +1,132 @@
+import asyncio, heapq, itertools, logging, random, time
+from typing import Awaitable, Callable, Hashable
+from prometheus_client import Counter
+
+# Periodic checks (analyzer health probes, emitter polling) for many targets at once. Each target has its own
+# schedule in a heap; due checks run concurrently, at most `fanout` at a time, so one dead host only costs its
+# own timeout. Intervals adapt per target:
+#   failing or just recovered  -> fast, so failover and recovery are noticed quickly
+#   healthy                    -> base, doubling up to slow once the target has been steady for a while
+# Every interval gets +/- jitter so checks don't synchronize. Passive results from the data path feed in
+# through observe(): a recent success stands in for the next probe, a failure pulls the next probe forward.
+
+PROBE_CHECKS = Counter("probe_checks_total", "Scheduled checks by outcome", ["kind", "result"])
+
+RECOVERY_CHECKS = 3      # successes at the fast interval before a recovered target counts as steady
+STEADY_CHECKS = 6        # successes at base interval before backing off towards slow
+
+Check = Callable[[], Awaitable[bool | None]]   # True ok, False failed, None skipped (not ours to check)
+
+class _Target:
+    __slots__ = ("kind", "check", "base", "fast", "slow", "interval", "due", "streak", "failing",
+                 "passive_ok", "running")
+
+    def __init__(self, kind: str, check: Check, base: float, fast: float, slow: float):
+        self.kind = kind
+        self.check = check
+        self.base, self.fast, self.slow = base, fast, slow
+        self.interval = base
+        self.due = 0.0
+        self.streak = 0          # consecutive successes
+        self.failing = False     # failed since it was last steady
+        self.passive_ok = 0.0    # last data-path success
+        self.running = False
+
+    def adapt(self, ok: bool):
+        if not ok:
+            self.streak, self.failing, self.interval = 0, True, self.fast
+            return
+        self.streak += 1
+        if self.failing and self.streak < RECOVERY_CHECKS:
+            self.interval = self.fast
+        elif self.streak < STEADY_CHECKS:
+            self.failing, self.interval = False, self.base
+        else:
+            self.interval = min(self.slow, max(self.base, self.interval * 2))
+
+class ProbeScheduler:
+    def __init__(self, fanout: int = 64, jitter: float = 0.2, rng: random.Random | None = None):
+        self.jitter = jitter
+        self._targets: dict[Hashable, _Target] = {}
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._seq = itertools.count()
+        self._slots = asyncio.Semaphore(fanout)
+        self._wake = asyncio.Event()
+        self._rng = rng or random.Random()
+
+    def keys(self, kind: str) -> set:
+        return {key for key, t in self._targets.items() if t.kind == kind}
+
+    def add(self, key: Hashable, kind: str, check: Check, base: float, fast: float | None = None,
+            slow: float | None = None, delay: float = 0.0):
+        """Start checking a target; the first check runs after `delay` plus jitter."""
+        t = self._targets[key] = _Target(kind, check, base, fast or base, slow or base)
+        self._schedule(key, t, delay + self._rng.uniform(0, base * self.jitter))
+
+    def discard(self, key: Hashable):
+        self._targets.pop(key, None)     # its heap entry is skipped when it comes up
+
+    def observe(self, key: Hashable, ok: bool):
+        """Passive result from real traffic."""
+        t = self._targets.get(key)
+        if t is None:
+            return
+        if ok:
+            t.passive_ok = time.monotonic()
+        elif t.due - time.monotonic() > t.fast and not t.running:
+            self._schedule(key, t, t.fast)
+
+    def _schedule(self, key: Hashable, t: _Target, delay: float):
+        t.due = time.monotonic() + delay
+        heapq.heappush(self._heap, (t.due, next(self._seq), key))
+        self._wake.set()
+
+    def _jittered(self, interval: float) -> float:
+        return interval * self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def run(self):
+        while True:
+            if not self._heap:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            due, _, key = self._heap[0]
+            delay = due - time.monotonic()
+            if delay > 0:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            t = self._targets.get(key)
+            if t is None or t.due != due or t.running:
+                continue        # removed or rescheduled since this entry was pushed
+            if not t.failing and time.monotonic() - t.passive_ok < t.interval:
+                # real traffic succeeded since the last check, that is as good as a probe
+                PROBE_CHECKS.labels(t.kind, "suppressed").inc()
+                t.adapt(True)
+                self._schedule(key, t, self._jittered(t.interval))
+                continue
+            t.running = True
+            asyncio.create_task(self._check(key, t))
+
+    async def _check(self, key: Hashable, t: _Target):
+        try:
+            async with self._slots:
+                try:
+                    ok = await t.check()
+                except Exception as exc:
+                    logging.debug("check %s failed: %s", key, exc)
+                    ok = False
+        finally:
+            t.running = False
+        if self._targets.get(key) is not t:
+            return
+        if ok is None:
+            PROBE_CHECKS.labels(t.kind, "skipped").inc()
+        else:
+            PROBE_CHECKS.labels(t.kind, "ok" if ok else "failed").inc()
+            t.adapt(ok)
+        self._schedule(key, t, self._jittered(t.interval))
@@ -0,0 +1,133 @@
+import asyncio, logging, time
+from collections import deque
+from typing import Callable
+from fastapi import WebSocket
+from . import codec
+
+# /ws/metrics fan-out. One task takes a snapshot per tick, derives rates from it and sends every subscriber the
+# same pre-encoded frame, so the cost doesn't grow with the number of dashboards watching.
+#
+# Frames:
+#   {"type": "full",  "seq": n, "data": snapshot}
+#   {"type": "delta", "seq": n, "set": {changed fields}, "removed": [[path...], ...]}
+# "set" is nested like the snapshot and holds only the leaves that changed; "removed" lists the paths of keys
+# that disappeared (an analyzer taken out of the registry). Analyzers and emitters are keyed by id.
+
+_MISSING = object()
+
+def _diff(old: dict, new: dict, path: tuple, removed: list) -> dict:
+    changed = {}
+    for key, value in new.items():
+        before = old.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(before, dict):
+            sub = _diff(before, value, path + (key,), removed)
+            if sub:
+                changed[key] = sub
+        elif value != before:
+            changed[key] = value
+    for key in old.keys() - new.keys():
+        removed.append([*path, key])
+    return changed
+
+class _Subscriber:
+    __slots__ = ("frames", "ready")
+
+    def __init__(self, max_frames: int):
+        self.frames: deque[str] = deque(maxlen=max_frames)
+        self.ready = asyncio.Event()
+
+class MetricsPublisher:
+    def __init__(self, snapshot: Callable[[], dict], interval: float = 1.0, client_queue: int = 8, trend_window: int = 5):
+        self._take = snapshot
+        self.interval = interval
+        self.client_queue = max(1, client_queue)
+        self._subscribers: set[_Subscriber] = set()
+        self._snapshot: dict | None = None
+        self._seq = 0
+        self._taken_at = 0.0
+        self._queue_history: deque[tuple[float, float]] = deque(maxlen=trend_window + 1)
+
+    # ---------------- snapshots ----------------
+    def _next_snapshot(self) -> dict:
+        """Snapshot plus the rates derived from the previous one."""
+        now = time.monotonic()
+        snap = self._take()
+        prev, elapsed = self._snapshot, now - self._taken_at
+        self._taken_at = now
+        self._queue_history.append((now, snap["queue_depth"]))
+        if prev is None or elapsed <= 0:
+            snap["rx_per_sec"] = snap["tx_per_sec"] = snap["queue_trend"] = 0.0
+            for a in snap["analyzers"].values():
+                a["tx_per_sec"] = 0.0
+            return snap
+        tx_total = 0.0
+        for aid, a in snap["analyzers"].items():
+            before = prev["analyzers"].get(aid)
+            a["tx_per_sec"] = round(max(0.0, a["tx_packets"] - before["tx_packets"]) / elapsed, 2) if before else 0.0
+            tx_total += a["tx_per_sec"]
+        snap["rx_per_sec"] = round(max(0.0, snap["packets_rx"] - prev["packets_rx"]) / elapsed, 2)
+        snap["tx_per_sec"] = round(tx_total, 2)
+        (t0, q0), (t1, q1) = self._queue_history[0], self._queue_history[-1]
+        snap["queue_trend"] = round((q1 - q0) / (t1 - t0), 2) if t1 > t0 else 0.0   # packets/s the queue grows by
+        return snap
+
+    def _full_frame(self) -> str:
+        return codec.dumps({"type": "full", "seq": self._seq, "data": self._snapshot}).decode()
+
+    def _reset(self):
+        self._snapshot = None
+        self._queue_history.clear()
+
+    # ---------------- fan-out ----------------
+    def _offer(self, sub: _Subscriber, frame: str, full: Callable[[], str]):
+        if len(sub.frames) == sub.frames.maxlen:
+            # too far behind to replay deltas: start it over from the current snapshot
+            sub.frames.clear()
+            frame = full()
+        sub.frames.append(frame)
+        sub.ready.set()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._subscribers:
+                self._reset()
+                continue
+            try:
+                snap = self._next_snapshot()
+            except Exception:
+                logging.exception("metrics snapshot failed")
+                continue
+            removed: list = []
+            changed = _diff(self._snapshot or {}, snap, (), removed)
+            self._snapshot = snap
+            self._seq += 1
+            delta = codec.dumps({"type": "delta", "seq": self._seq, "set": changed, "removed": removed}).decode()
+            full_cache: list[str] = []
+
+            def full() -> str:
+                if not full_cache:
+                    full_cache.append(self._full_frame())
+                return full_cache[0]
+
+            for sub in self._subscribers:
+                self._offer(sub, delta, full)
+
+    async def serve(self, ws: WebSocket):
+        """Sender loop for one socket: a full frame now, deltas every tick after that."""
+        sub = _Subscriber(self.client_queue)
+        if self._snapshot is None:
+            self._snapshot = self._next_snapshot()
+        sub.frames.append(self._full_frame())
+        sub.ready.set()
+        self._subscribers.add(sub)
+        try:
+            while True:
+                await sub.ready.wait()
+                sub.ready.clear()
+                while sub.frames:
+                    await ws.send_text(sub.frames.popleft())
+        except Exception as exc:
+            logging.info("Metrics client disconnected: %s", exc or type(exc).__name__)
+        finally:
+            self._subscribers.discard(sub)
@@ -1,119 +1,320 @@
 from pydantic import BaseModel
-from typing import List
-import asyncio, logging, time
+from typing import Callable, Collection, List
+import asyncio, logging, math, time
+from .routing import POLICIES, RoutingPolicy
+from .instrument import TimedLock
 
 class Analyzer(BaseModel):
     id: str
     url: str
     weight: float = 1.0
-    current_weight: float = 0.0
     effective_weight: float = 0.0
     healthy: bool = True
     admin_enabled: bool = True
     failures: int = 0
     last_check: float = 0.0
+    inflight: int = 0
+    max_inflight: int = 1
+    ewma_latency: float = 0.0   # seconds, fed by the dispatcher through observe()
+    breaker: str = "closed"     # closed | open | half_open
+    ramp: float = 1.0           # share of its weight a half-open analyzer gets
+    trials: int = 0             # trial requests delivered at the current ramp step
+    opened_at: float = 0.0      # monotonic time the breaker last opened
+    cooldown: float = 0.0       # seconds the breaker stays open before trial traffic
+    accept_encoding: str = ""   # from its /health Accept-Encoding header: what compressed bodies it takes
+
+# Circuit breaker: max_fail consecutive failures open an analyzer's breaker (it leaves the pool). Once `cooldown`
+# has passed, a successful health probe half-opens it: it rejoins at RAMP_STEPS[0] of its weight and moves up a
+# step after every `trial_requests` delivered packets, closing at 1.0. Any failure while half-open reopens it
+# with the cooldown doubled, up to max_open_seconds.
+RAMP_STEPS = (0.1, 0.25, 0.5, 1.0)
 
 class AnalyzerRegistry:
-    def __init__(self, analyzers: List[Analyzer], max_fail: int = 3):
+    def __init__(self, analyzers: List[Analyzer], max_fail: int = 3, inflight_budget: int = 32,
+                 policy: str = "swrr", ewma_alpha: float = 0.3, failure_penalty: float = 1.0, open_seconds: float = 2.0,
+                 max_open_seconds: float = 30.0, trial_requests: int = 20, policy_options: dict[str, dict] | None = None):
         self.analyzers = analyzers
         self.max_fail = max_fail
-        self._lock = asyncio.Lock()
+        self.inflight_budget = inflight_budget   # total concurrent requests shared by all analyzers
+        self.ewma_alpha = ewma_alpha             # weight of the newest latency sample
+        self.failure_penalty = failure_penalty   # seconds a failed request counts as, at least
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.trial_requests = trial_requests
+        self.policy_options = policy_options or {}   # constructor kwargs per policy name
+        self._index: dict[str, Analyzer] = {a.id: a for a in analyzers}
+        self._pool: list[Analyzer] = []          # eligible analyzers, rebuilt on state transitions
+        self._policy: RoutingPolicy = self._make_policy(policy)
+        self._waiting = 0                        # dispatchers blocked in choose()
+        self._lock = TimedLock("registry")          # contended waits go to lock_wait_seconds
+        self._capacity = asyncio.Condition(self._lock)   # signalled when a slot frees up
+        self.on_change: Callable[[], None] | None = None  # called after local state transitions (cluster sync)
         self._normalize_effective_weights()
 
     # gets an analyzer by ID
     def _by_id(self, aid: str) -> Analyzer:
-        return next(x for x in self.analyzers if x.id == aid)
+        return self._index[aid]
     
+    def get(self, aid: str) -> Analyzer | None:
+        return self._index.get(aid)
+
     # checks if an analyzer is healthy and eligible for routing
     def _eligible(self, a: Analyzer) -> bool:
         return a.healthy and a.admin_enabled and a.effective_weight > 0
     
+    def _make_policy(self, name: str) -> RoutingPolicy:
+        if name not in POLICIES:
+            raise ValueError(f"unknown routing policy {name!r}, expected one of {sorted(POLICIES)}")
+        return POLICIES[name](**self.policy_options.get(name, {}))
+
+    @property
+    def policy(self) -> str:
+        return self._policy.name
+
+    @property
+    def keyed(self) -> bool:
+        """Whether the active policy routes by key, i.e. choose() wants one."""
+        return self._policy.keyed
+
+    # Runs on state transitions only: re-derives effective weights, in-flight caps and the routing policy's view
+    def _normalize_effective_weights(self, publish: bool = True):
+        self._rebalance_weights()
+        self._apply_ramps()
+        pool = []
+        for a in self.analyzers:
+            a.max_inflight = max(1, math.ceil(a.effective_weight * self.inflight_budget))
+            if self._eligible(a):
+                pool.append(a)
+        self._pool = pool
+        self._policy.rebuild(pool)
+        # routing state changed, let blocked dispatchers re-evaluate
+        if self._lock.locked():
+            self._capacity.notify_all()
+        if publish and self.on_change:
+            self.on_change()
+
     # normalizes effective weights based on current weights and total weight
-    def _normalize_effective_weights(self):
+    def _rebalance_weights(self):
         eligible = [a for a in self.analyzers if a.healthy and a.admin_enabled]
+        for a in self.analyzers:
+            a.effective_weight = 0.0
 
         if not eligible:
-            for a in self.analyzers:
-                a.effective_weight = 0.0
             return
 
         total = sum(a.weight for a in eligible)
 
         if total == 0:          # all weights were 0
             equalSplit = 1.0 / len(eligible)
-            for a in self.analyzers:
-                a.effective_weight = equalSplit if a in eligible else 0.0
+            for a in eligible:
+                a.effective_weight = equalSplit
         elif total < 1.0:       # lost weight, therefore spread evenly
             gap = (1.0 - total) / len(eligible)
-            for a in self.analyzers:
-                a.effective_weight = (a.weight + gap) if a in eligible else 0.0
+            for a in eligible:
+                a.effective_weight = a.weight + gap
         else:                   # total > 1.0, therefore scale down proportionally
             scale = 1.0 / total
-            for a in self.analyzers:
-                a.effective_weight = (a.weight * scale) if a in eligible else 0.0
+            for a in eligible:
+                a.effective_weight = a.weight * scale
+
+    # half-open analyzers keep only `ramp` of their share; the rest goes to the closed ones
+    def _apply_ramps(self):
+        eligible = [a for a in self.analyzers if a.healthy and a.admin_enabled]
+        ramping = [a for a in eligible if a.ramp < 1.0]
+        if not ramping:
+            return
+        closed = [a for a in eligible if a.ramp >= 1.0]
+        closed_total = sum(a.effective_weight for a in closed)
+        if closed_total <= 0:      # nothing else can take the traffic
+            return
+        freed = 0.0
+        for a in ramping:
+            freed += a.effective_weight * (1.0 - a.ramp)
+            a.effective_weight *= a.ramp
+        for a in closed:
+            a.effective_weight += freed * a.effective_weight / closed_total
 
+    # Routing helper -- the active policy picks among analyzers with a free in-flight slot
+    def _pick(self, exclude: Collection[str] = (), key: str | None = None) -> Analyzer | None:
+        best = self._policy.pick(exclude, key)
+        if best:
+            best.inflight += 1
+            self._policy.outstanding += 1
+        return best
 
-    # Routing helper -- this is a weighted round-robin
-    async def choose(self) -> Analyzer | None:
-        async with self._lock:
-            best = None
-            total = 0.0
-            for a in self.analyzers:
-                if not self._eligible(a):
-                    continue
-                a.current_weight += a.effective_weight
-                total += a.effective_weight
-                if best is None or a.current_weight > best.current_weight:
-                    best = a
-            if best:
-                best.current_weight -= total
+    def _has_candidates(self, exclude: Collection[str]) -> bool:
+        return any(a.id not in exclude for a in self._pool) if exclude else bool(self._pool)
+
+    # Returns None only when no analyzer outside `exclude` is eligible; waits while all of them are at their cap.
+    # Every analyzer returned here holds an in-flight slot that must be given back with release().
+    # `key` is the packet's routing key, used by keyed policies (affinity).
+    async def choose(self, exclude: Collection[str] = (), key: str | None = None) -> Analyzer | None:
+        # _pick() never awaits, so the common path needs no lock
+        best = self._pick(exclude, key)
+        if best or not self._has_candidates(exclude):
             return best
+        async with self._capacity:
+            self._waiting += 1
+            try:
+                while True:
+                    best = self._pick(exclude, key)
+                    if best or not self._has_candidates(exclude):
+                        return best
+                    await self._capacity.wait()
+            finally:
+                self._waiting -= 1
+
+    async def release(self, aid: str):
+        a = self._index.get(aid)
+        if a is not None and a.inflight > 0:
+            a.inflight -= 1
+            if self._policy.outstanding > 0:
+                self._policy.outstanding -= 1
+        if self._waiting:
+            # wake every waiter: the freed slot is on one analyzer, and a waiter that excluded it (a retry)
+            # or was over its cap would otherwise take the only wakeup and leave the rest asleep
+            async with self._capacity:
+                self._capacity.notify_all()
     
+    # Response time of one request, smoothed into the analyzer's EWMA for the latency-aware policies. A failed
+    # request counts as at least failure_penalty, so an analyzer that errors quickly doesn't look like the fastest.
+    def observe(self, aid: str, seconds: float, failed: bool = False):
+        a = self._index.get(aid)
+        if a is None:
+            return
+        if failed:
+            seconds = max(seconds, self.failure_penalty)
+        a.ewma_latency = seconds if a.ewma_latency == 0 else a.ewma_latency + self.ewma_alpha * (seconds - a.ewma_latency)
+
+    async def set_policy(self, name: str):
+        async with self._lock:
+            if name == self._policy.name:
+                return
+            self._policy = self._make_policy(name)
+            self._policy.rebuild(self._pool)
+            self._capacity.notify_all()
+            logging.info("Routing policy changed to %s", name)
+            if self.on_change:
+                self.on_change()
+
     # Health management
+    def _open(self, a: Analyzer, reason: str):
+        a.cooldown = min(self.max_open_seconds, a.cooldown * 2) if a.breaker == "half_open" else self.open_seconds
+        a.breaker, a.healthy, a.trials = "open", False, 0
+        a.opened_at = time.monotonic()
+        logging.warning("Analyzer %s marked UNHEALTHY (%s), circuit open for %.1fs", a.id, reason, a.cooldown)
+        self._normalize_effective_weights()
+
+    # Failure from a probe or from the data path
     async def mark_failure(self, aid: str):
         async with self._lock:
-            a = self._by_id(aid)
+            a = self._index.get(aid)
+            if a is None:       # removed while a request was in flight
+                return
             a.failures += 1
-            if a.failures >= self.max_fail and a.healthy:
-                a.healthy = False
-                a.current_weight = 0.0
-                logging.warning("Analyzer %s marked UNHEALTHY after %d failures", aid, a.failures)
-                logging.info("Effective weight for %s set to 0.0", aid)
-                self._normalize_effective_weights()
-    
+            if a.breaker == "half_open":
+                self._open(a, "trial request failed")
+            elif a.breaker == "closed" and a.healthy and a.failures >= self.max_fail:
+                self._open(a, f"{a.failures} failures")
+
+    # Successful health probe: resets the failure count, half-opens an open breaker once its cooldown is over
     async def mark_success(self, aid: str):
+        a = self._index.get(aid)
+        if a is None or (a.breaker != "open" and a.failures == 0):
+            return      # fast path: nothing changes, so skip the lock
+        async with self._lock:
+            a.failures = 0
+            if a.breaker != "open" or time.monotonic() - a.opened_at < a.cooldown:
+                return
+            a.breaker, a.healthy, a.ramp, a.trials = "half_open", True, RAMP_STEPS[0], 0
+            logging.info("Analyzer %s circuit half-open, trial traffic at %d%% of its weight", aid, a.ramp * 100)
+            self._normalize_effective_weights()
+
+    # Packets delivered on the data path: advances a half-open analyzer's ramp
+    async def mark_delivered(self, aid: str, count: int = 1):
+        a = self._index.get(aid)
+        if a is None or (a.breaker == "closed" and a.failures == 0):
+            return      # per-packet fast path
         async with self._lock:
-            a = self._by_id(aid)
             a.failures = 0
-            if not a.healthy:
-                logging.info("Analyzer %s marked HEALTHY", aid)
-                a.current_weight = 0.0
-            a.healthy = True
-            a.effective_weight = a.weight
+            if a.breaker != "half_open":
+                return
+            a.trials += count
+            if a.trials < self.trial_requests:
+                return
+            a.trials = 0
+            a.ramp = next((r for r in RAMP_STEPS if r > a.ramp), 1.0)
+            if a.ramp >= 1.0:
+                a.breaker, a.cooldown = "closed", 0.0
+                logging.info("Analyzer %s marked HEALTHY, circuit closed", aid)
+            else:
+                logging.info("Analyzer %s trial traffic at %d%% of its weight", aid, a.ramp * 100)
             self._normalize_effective_weights()
     
+    # What the analyzer says it can decompress; not a routing change, but shared with the other workers
+    async def set_accept_encoding(self, aid: str, value: str):
+        a = self._index.get(aid)
+        if a is None or a.accept_encoding == value:
+            return
+        a.accept_encoding = value
+        if self.on_change:
+            self.on_change()
+
     async def toggle_admin(self, aid: str, enable: bool):
         async with self._lock:
             a = self._by_id(aid)
             if a.admin_enabled != enable:
                 a.admin_enabled = enable
-                a.current_weight = 0.0
+                a.healthy = enable
+                if enable:      # an operator's enable starts from a clean breaker
+                    a.breaker, a.ramp, a.failures, a.cooldown = "closed", 1.0, 0, 0.0
                 logging.info("Analyzer %s admin status changed to %s", aid, "ENABLED" if enable else "DISABLED")
                 self._normalize_effective_weights()
-                a.healthy = True if enable else False
     
     async def add(self, a: Analyzer):
         async with self._lock:
-            if a.id in [x.id for x in self.analyzers]:
+            if a.id in self._index:
                 raise ValueError(f"Analyzer with ID {a.id} already exists")
             a.last_check = time.time() + 5 # grace period before first health check
             self.analyzers.append(a)
+            self._index[a.id] = a
             logging.info("Added new analyzer %s", a.id)
             self._normalize_effective_weights()
     
     async def remove(self, aid: str):
         async with self._lock:
-            a = self._by_id(aid)
+            a = self._index.pop(aid)
             self.analyzers.remove(a)
             logging.info("Removed analyzer %s", aid)
-            self._normalize_effective_weights()
\ No newline at end of file
+            self._normalize_effective_weights()
+
+    # Adopts another worker's view of the shared fields (cluster mode); returns the ids that were removed
+    async def apply(self, records: dict[str, dict], policy: str) -> list[str]:
+        async with self._lock:
+            removed = [a.id for a in self.analyzers if a.id not in records]
+            for aid in removed:
+                self.analyzers.remove(self._index.pop(aid))
+            changed = bool(removed)
+            for aid, record in records.items():
+                a = self._index.get(aid)
+                if a is None:
+                    a = Analyzer(id=aid, **record)
+                    self.analyzers.append(a)
+                    self._index[aid] = a
+                    changed = True
+                    continue
+                if record["healthy"] and not a.healthy:
+                    a.failures = 0
+                if record.get("breaker") == "open" and a.breaker != "open":
+                    a.opened_at, a.cooldown = time.monotonic(), a.cooldown or self.open_seconds
+                for field, value in record.items():
+                    if getattr(a, field) != value:
+                        setattr(a, field, value)
+                        changed = True
+            if policy != self._policy.name:
+                self._policy = self._make_policy(policy)
+                changed = True
+            if changed:
+                logging.info("Registry synced from cluster state")
+                self._normalize_effective_weights(publish=False)
+            return removed
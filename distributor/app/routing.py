@@ -0,0 +1,200 @@
+import bisect, functools, hashlib, heapq, itertools, math, random
+from typing import TYPE_CHECKING, Collection
+
+if TYPE_CHECKING:
+    from .registry import Analyzer
+
+# Routing policies used by AnalyzerRegistry.choose(). A policy gets the eligible analyzers through rebuild()
+# whenever the registry's state changes and must answer pick() without awaiting. pick() may only return an
+# analyzer below its in-flight cap and not in `exclude` (ids a retry has already tried); the registry takes the slot.
+# A keyed policy also gets the packet's routing key. `outstanding` is the pool's total in-flight count, kept up to
+# date by the registry for policies that bound load relative to the average.
+
+def _free(a: "Analyzer", exclude: Collection[str] = ()) -> bool:
+    return a.inflight < a.max_inflight and a.id not in exclude
+
+class RoutingPolicy:
+    name = ""
+    keyed = False       # True if pick() routes by the packet's key
+    outstanding = 0
+
+    def rebuild(self, pool: list["Analyzer"]):
+        self.pool = pool
+        self.outstanding = sum(a.inflight for a in pool)
+
+    def pick(self, exclude: Collection[str] = (), key: str | None = None) -> "Analyzer | None":
+        raise NotImplementedError
+
+class SmoothWeightedRoundRobin(RoutingPolicy):
+    """Static weighted shares, done as stride scheduling. Each eligible analyzer sits in a heap keyed by its
+    next virtual pass and advances 1 / effective_weight per pick, so a pick is O(log n). Analyzers at their
+    in-flight cap lose their turn."""
+    name = "swrr"
+
+    def __init__(self):
+        self._heap: list[list] = []
+        self._vtime = 0.0       # virtual time of the last pick
+        self._seq = itertools.count()
+
+    def rebuild(self, pool):
+        super().rebuild(pool)
+        # newcomers start half a stride ahead so they interleave instead of bursting
+        self._heap = [[self._vtime + 0.5 / a.effective_weight, next(self._seq), a, 1.0 / a.effective_weight] for a in pool]
+        heapq.heapify(self._heap)
+
+    def pick(self, exclude=(), key=None):
+        heap = self._heap
+        skipped = []
+        best = None
+        while heap:
+            entry = heap[0]
+            entry[0] += entry[3]
+            if _free(entry[2], exclude):
+                best = entry[2]
+                self._vtime = entry[0] - entry[3]
+                heapq.heapreplace(heap, entry)
+                break
+            skipped.append(heapq.heappop(heap))
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return best
+
+class LeastOutstandingRequests(RoutingPolicy):
+    """Fewest in-flight requests relative to weight, so a slow analyzer stops getting work it can't finish."""
+    name = "least_outstanding"
+
+    def pick(self, exclude=(), key=None):
+        best, best_score = None, 0.0
+        for a in self.pool:
+            if not _free(a, exclude):
+                continue
+            score = (a.inflight + 1) / a.effective_weight
+            if best is None or score < best_score:
+                best, best_score = a, score
+        return best
+
+def _latency_score(a: "Analyzer") -> float:
+    # expected wait if this request joins the analyzer's queue; analyzers without samples look fast so they get probed
+    return (a.inflight + 1) * (a.ewma_latency or 1e-3) / a.effective_weight
+
+class EwmaLatency(RoutingPolicy):
+    """Lowest EWMA response time scaled by queue depth and weight."""
+    name = "ewma"
+
+    def pick(self, exclude=(), key=None):
+        best, best_score = None, 0.0
+        for a in self.pool:
+            if not _free(a, exclude):
+                continue
+            score = _latency_score(a)
+            if best is None or score < best_score:
+                best, best_score = a, score
+        return best
+
+class PowerOfTwoChoices(RoutingPolicy):
+    """Sample two analyzers by weight and keep the one with the better latency score. O(log n) per pick."""
+    name = "p2c"
+
+    def __init__(self, rng: random.Random | None = None):
+        self._rng = rng or random.Random()
+        self._cum: list[float] = []
+
+    def rebuild(self, pool):
+        super().rebuild(pool)
+        self._cum = list(itertools.accumulate(a.effective_weight for a in pool))
+
+    def _sample(self) -> "Analyzer":
+        i = bisect.bisect_right(self._cum, self._rng.random() * self._cum[-1])
+        return self.pool[min(i, len(self.pool) - 1)]
+
+    def pick(self, exclude=(), key=None):
+        if not self.pool:
+            return None
+        a, b = self._sample(), self._sample()
+        candidates = [x for x in (a, b) if _free(x, exclude)]
+        if not candidates:
+            # both samples are full, fall back to a scan so a free analyzer is never missed
+            candidates = [x for x in self.pool if _free(x, exclude)]
+            if not candidates:
+                return None
+        return min(candidates, key=_latency_score)
+
+_HASH_SPACE = 1 << 64
+
+@functools.lru_cache(maxsize=65536)
+def _hash(key: str) -> int:
+    # stable across processes (unlike hash()), so every cluster worker maps a key the same way
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class ConsistentHash(RoutingPolicy):
+    """Affinity: a key always goes to the same analyzer while the pool is unchanged.
+
+    Each analyzer owns `vnodes * weight` points on a hash ring (its configured weight, so health ramps don't
+    move keys); a key goes to the first point clockwise from its hash. An analyzer joining or leaving only takes
+    or gives up its own arcs, about 1/N of the keys. Bounded load: an analyzer is skipped for the next one on the
+    ring once it holds more than `load_factor` times its share of the pool's in-flight requests, so a hot key
+    spills over instead of piling onto one analyzer. A half-open analyzer keeps its points but takes only a `ramp`
+    fraction of the keys landing on them, chosen by hash so a key it took at one ramp step stays with it at the
+    next; the other keys go on to the next analyzer on the ring. Points are cached per (id, weight); pick is a
+    bisect plus a short walk.
+    """
+    name = "affinity"
+    keyed = True
+
+    def __init__(self, vnodes: int = 400, load_factor: float = 1.25):
+        self.vnodes = vnodes
+        self.load_factor = load_factor
+        self._points: list[int] = []
+        self._owners: list["Analyzer"] = []
+        self._cache: dict[tuple[str, float], list[int]] = {}
+
+    def _points_of(self, a: "Analyzer") -> list[int]:
+        points = self._cache.get((a.id, a.weight))
+        if points is None:
+            count = max(1, round(self.vnodes * a.weight))
+            points = self._cache[(a.id, a.weight)] = [_hash(f"{a.id}#{i}") for i in range(count)]
+        return points
+
+    def rebuild(self, pool):
+        super().rebuild(pool)
+        ring = sorted((point, i) for i, a in enumerate(pool) for point in self._points_of(a))
+        self._points = [point for point, _ in ring]
+        self._owners = [pool[i] for _, i in ring]
+        live = {(a.id, a.weight) for a in pool}
+        if len(self._cache) > 4 * len(live):
+            self._cache = {k: v for k, v in self._cache.items() if k in live}
+
+    def _within_bound(self, a: "Analyzer") -> bool:
+        return a.inflight < math.ceil(self.load_factor * (self.outstanding + 1) * a.effective_weight)
+
+    @staticmethod
+    def _ramped_in(a: "Analyzer", key: str) -> bool:
+        return a.ramp >= 1.0 or _hash(f"{key}@{a.id}") < a.ramp * _HASH_SPACE
+
+    def pick(self, exclude=(), key=None):
+        points = self._points
+        if not points:
+            return None
+        key = key or ""
+        start = bisect.bisect(points, _hash(key))
+        owners = self._owners
+        fallback = None
+        seen: set[str] = set()
+        for i in range(start, start + len(points)):
+            a = owners[i % len(points)]
+            if a.id in seen:
+                continue
+            seen.add(a.id)
+            if _free(a, exclude) and self._ramped_in(a, key):
+                if self._within_bound(a):
+                    return a
+                fallback = fallback or a
+            if len(seen) == len(self.pool):
+                break
+        # every free analyzer is over its bound (only possible with ramping shares): take the nearest free one
+        return fallback
+
+POLICIES: dict[str, type[RoutingPolicy]] = {
+    p.name: p for p in (SmoothWeightedRoundRobin, LeastOutstandingRequests, EwmaLatency, PowerOfTwoChoices,
+                        ConsistentHash)
+}
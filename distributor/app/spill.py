@@ -0,0 +1,328 @@
+import asyncio, logging, mmap, os, pathlib, struct, time, zlib
+from collections import Counter
+from .fairqueue import FairQueue
+
+# Disk tier behind the distributor queue. Packets overflow into a segmented, append-only log of memory-mapped
+# files and are replayed in arrival order once the in-memory tier has room again.
+#
+# Segment layout: records of [length u32][crc32 u32][payload], terminated by a zero header. Segments are
+# preallocated (sparse) to segment_bytes and numbered consecutively; the read position lives in a 16 byte
+# memory-mapped cursor file. Fully consumed segments are deleted, and when the log drains completely the
+# write position rewinds to the start of the current segment, so disk use stays bounded by max_bytes.
+
+_HEADER = struct.Struct("<II")   # payload length, crc32
+_CURSOR = struct.Struct("<QQ")   # read segment, read offset
+_STAMP = struct.Struct("<d")     # enqueue time of a queued packet
+
+class SpillFull(Exception):
+    """The spill log has reached its disk budget."""
+
+class SpillLog:
+    def __init__(self, directory: str | os.PathLike, segment_bytes: int = 64 << 20, max_bytes: int = 1 << 30):
+        self.dir = pathlib.Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, segment_bytes)
+        self._maps: dict[int, mmap.mmap] = {}   # open segments by number
+        self._count = 0
+        self._cursor_map = self._open_cursor()
+        self._recover()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def at_capacity(self) -> bool:
+        """True when the next segment roll would exceed the disk budget."""
+        return (self._write_seg - self._read_seg + 2) * self.segment_bytes > self.max_bytes
+
+    # ---------------- files ----------------
+    def _path(self, n: int) -> pathlib.Path:
+        return self.dir / f"seg-{n:012d}.log"
+
+    def _open(self, n: int) -> mmap.mmap:
+        mm = self._maps.get(n)
+        if mm is None:
+            path = self._path(n)
+            with open(path, "a+b") as f:
+                if os.fstat(f.fileno()).st_size < self.segment_bytes:
+                    f.truncate(self.segment_bytes)
+                mm = mmap.mmap(f.fileno(), self.segment_bytes)
+            self._maps[n] = mm
+        return mm
+
+    def _close(self, n: int):
+        mm = self._maps.pop(n, None)
+        if mm is not None:
+            mm.flush()
+            mm.close()
+
+    def _drop(self, n: int):
+        self._close(n)
+        self._path(n).unlink(missing_ok=True)
+
+    def _open_cursor(self) -> mmap.mmap:
+        with open(self.dir / "cursor", "a+b") as f:
+            if os.fstat(f.fileno()).st_size < _CURSOR.size:
+                f.truncate(_CURSOR.size)
+            return mmap.mmap(f.fileno(), _CURSOR.size)
+
+    def _save_cursor(self):
+        _CURSOR.pack_into(self._cursor_map, 0, self._read_seg, self._read_off)
+
+    # ---------------- crash recovery ----------------
+    def _scan(self, n: int, offset: int) -> tuple[int, int]:
+        """Count intact records in segment n from offset; returns (records, end offset). Stops at a torn write."""
+        mm = self._open(n)
+        count = 0
+        while offset + _HEADER.size <= self.segment_bytes:
+            length, crc = _HEADER.unpack_from(mm, offset)
+            start = offset + _HEADER.size
+            if length == 0 or start + length > self.segment_bytes or zlib.crc32(mm[start:start + length]) != crc:
+                break
+            offset = start + length
+            count += 1
+        return count, offset
+
+    def _recover(self):
+        segments = sorted(int(p.stem.split("-")[1]) for p in self.dir.glob("seg-*.log"))
+        read_seg, read_off = _CURSOR.unpack_from(self._cursor_map, 0)
+        if not segments:
+            self._read_seg = self._write_seg = read_seg
+            self._read_off = self._write_off = 0
+            self._open(self._write_seg)
+            self._seal(0)
+            self._save_cursor()
+            return
+
+        if read_seg not in segments:     # cursor lost or points at a deleted segment
+            read_seg, read_off = next((n for n in segments if n > read_seg), segments[0]), 0
+        for n in segments:
+            if n < read_seg:
+                self._drop(n)
+        self._read_seg, self._read_off = read_seg, read_off
+        self._write_seg = segments[-1]
+
+        for n in range(read_seg, self._write_seg + 1):
+            count, end = self._scan(n, read_off if n == read_seg else 0)
+            self._count += count
+            if n != self._write_seg and n != read_seg:
+                self._close(n)
+        self._write_off = end
+        self._seal(end)          # cut off a torn tail so it can't be mistaken for a record
+        self._save_cursor()
+        if self._count:
+            logging.warning("Spill log recovered %d packet(s) from %s", self._count, self.dir)
+
+    def _seal(self, offset: int):
+        if offset + _HEADER.size <= self.segment_bytes:
+            _HEADER.pack_into(self._open(self._write_seg), offset, 0, 0)
+
+    # ---------------- append / pop ----------------
+    def append(self, payload: bytes):
+        need = _HEADER.size + len(payload)
+        if need + _HEADER.size > self.segment_bytes:
+            raise ValueError(f"record of {len(payload)} bytes does not fit in a spill segment")
+        if self._write_off + need + _HEADER.size > self.segment_bytes:
+            if self.at_capacity():
+                raise SpillFull(f"spill log at {self.max_bytes} bytes")
+            if self._write_seg != self._read_seg:
+                self._close(self._write_seg)
+            self._write_seg += 1
+            self._write_off = 0
+        mm = self._open(self._write_seg)
+        off = self._write_off
+        mm[off + _HEADER.size:off + need] = payload
+        _HEADER.pack_into(mm, off + need, 0, 0)
+        _HEADER.pack_into(mm, off, len(payload), zlib.crc32(payload))   # publish the header last
+        self._write_off += need
+        self._count += 1
+
+    def pop(self) -> bytes | None:
+        while self._count:
+            mm = self._open(self._read_seg)
+            length, _ = _HEADER.unpack_from(mm, self._read_off) if self._read_off + _HEADER.size <= self.segment_bytes else (0, 0)
+            if length == 0:
+                # end of a consumed segment, delete it and move on
+                self._drop(self._read_seg)
+                self._read_seg += 1
+                self._read_off = 0
+                continue
+            start = self._read_off + _HEADER.size
+            payload = mm[start:start + length]
+            self._read_off = start + length
+            self._count -= 1
+            if not self._count and self._read_seg == self._write_seg:
+                # drained: rewind so a lightly used spill keeps reusing one segment
+                self._read_off = self._write_off = 0
+                self._seal(0)
+            self._save_cursor()
+            return payload
+        return None
+
+    def records(self):
+        """The unread records, oldest first, without consuming them."""
+        seg, off, left = self._read_seg, self._read_off, self._count
+        while left:
+            mm = self._open(seg)
+            length, _ = _HEADER.unpack_from(mm, off) if off + _HEADER.size <= self.segment_bytes else (0, 0)
+            if length == 0:
+                if seg != self._read_seg and seg != self._write_seg:
+                    self._close(seg)
+                seg, off = seg + 1, 0
+                continue
+            start = off + _HEADER.size
+            yield mm[start:start + length]
+            off = start + length
+            left -= 1
+
+    def close(self):
+        for n in list(self._maps):
+            self._close(n)
+        self._cursor_map.flush()
+        self._cursor_map.close()
+
+    # ---------------- memory-tier checkpoint ----------------
+    # On a graceful shutdown the packets still in memory are older than everything in the log, so they are
+    # written to a separate checkpoint file and loaded back ahead of the log on startup.
+    def write_checkpoint(self, payloads: list[bytes]):
+        path = self.dir / "memory.ckpt"
+        with open(path.with_suffix(".tmp"), "wb") as f:
+            for p in payloads:
+                f.write(_HEADER.pack(len(p), zlib.crc32(p)))
+                f.write(p)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path.with_suffix(".tmp"), path)
+
+    def read_checkpoint(self) -> list[bytes]:
+        path = self.dir / "memory.ckpt"
+        if not path.exists():
+            return []
+        data = path.read_bytes()
+        payloads, off = [], 0
+        while off + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, off)
+            payload = data[off + _HEADER.size:off + _HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            payloads.append(payload)
+            off += _HEADER.size + length
+        path.unlink()
+        return payloads
+
+# queue records: [key length u8][key][enqueue time f64][packet]
+MAX_KEY_BYTES = 255     # callers reject longer keys before queueing
+
+def _with_key(key: str, enqueued_at: float, payload: bytes) -> bytes:
+    k = key.encode()
+    if len(k) > MAX_KEY_BYTES:
+        raise ValueError(f"queue key is {len(k)} bytes, at most {MAX_KEY_BYTES} fit a spill record")
+    return bytes([len(k)]) + k + _STAMP.pack(enqueued_at) + payload
+
+def _split_key(record: bytes) -> tuple[str, float, bytes]:
+    n = record[0]
+    (enqueued_at,) = _STAMP.unpack_from(record, 1 + n)
+    return record[1:1 + n].decode(), enqueued_at, record[1 + n + _STAMP.size:]
+
+class SpillQueue:
+    """Distributor queue: a FairQueue memory tier of maxsize packets with an optional SpillLog behind it.
+
+    Packets are put with the emitter they came from. Once anything is spilled, new packets also go to the log
+    so arrival order is kept; the memory tier is refilled from the log as the dispatcher drains it and each
+    packet returns to its emitter's lane. get() returns (packet, enqueue time) so callers can measure queue
+    wait. `encode(packet)` gives the bytes written to disk and `decode(payload, key)` rebuilds a packet from
+    them; without a decode, spilled packets come back as the encoded bytes.
+    """
+
+    def __init__(self, maxsize: int, spill: SpillLog | None = None, encode=None, quantum: int = 8, decode=None):
+        self.maxsize = maxsize
+        self._memory = FairQueue(maxsize=maxsize, quantum=quantum)
+        self._spill = spill
+        self._encode = encode
+        self._decode = decode or (lambda payload, key: payload)
+        self._spilled_by: Counter[str] = Counter()   # per-emitter packets on disk
+        if spill is not None:
+            # a log recovered from before a restart still counts against each emitter's backlog
+            for record in spill.records():
+                self._spilled_by[_split_key(record)[0]] += 1
+            for record in spill.read_checkpoint():
+                key, enqueued_at, payload = _split_key(record)
+                if self._memory.full():
+                    self._spill.append(record)
+                    self._spilled_by[key] += 1
+                else:
+                    self._memory.put_nowait((self._decode(payload, key), enqueued_at), key)
+
+    @property
+    def spilled(self) -> int:
+        return len(self._spill) if self._spill is not None else 0
+
+    def qsize(self) -> int:
+        return self._memory.qsize() + self.spilled
+
+    def backlog(self, key: str) -> int:
+        """Packets from one emitter still waiting, in memory or on disk.
+
+        The log replays in arrival order across emitters, so round-robin only evens out what is in memory; a cap
+        on this (not just on the memory lane) is what keeps one emitter from filling the log ahead of the rest.
+        """
+        return self._memory.lane_size(key) + self._spilled_by[key]
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def full(self) -> bool:
+        if not self._memory.full():
+            return False
+        # a disk tier that can still roll a segment keeps the queue "not full"
+        return self._spill is None or self._spill.at_capacity()
+
+    def _spill_one(self, packet, key: str, enqueued_at: float):
+        self._spill.append(_with_key(key, enqueued_at, self._encode(packet)))
+        self._spilled_by[key] += 1
+
+    def _refill(self):
+        while self.spilled and not self._memory.full():
+            key, enqueued_at, payload = _split_key(self._spill.pop())
+            if self._spilled_by[key] > 0:
+                self._spilled_by[key] -= 1
+            self._memory.put_nowait((self._decode(payload, key), enqueued_at), key)
+
+    def memory_items(self):
+        """Packets in the memory tier, without taking them (the spilled ones stay on disk)."""
+        return (packet for packet, _ in self._memory.items())
+
+    def put_nowait(self, packet, key: str = ""):
+        now = time.time()
+        if self._spill is None or (not self.spilled and not self._memory.full()):
+            self._memory.put_nowait((packet, now), key)
+            return
+        try:
+            self._spill_one(packet, key, now)
+        except SpillFull:
+            raise asyncio.QueueFull from None
+
+    async def put(self, packet, key: str = ""):
+        try:
+            self.put_nowait(packet, key)
+        except asyncio.QueueFull:
+            # disk budget exhausted too: wait for memory like a plain queue
+            await self._memory.put((packet, time.time()), key)
+
+    def get_nowait(self) -> tuple[object, float]:
+        self._refill()
+        return self._memory.get_nowait()
+
+    async def get(self) -> tuple[object, float]:
+        self._refill()
+        return await self._memory.get()
+
+    def close(self):
+        """Persist the memory tier and close the log. Only meaningful with a spill log."""
+        if self._spill is None:
+            return
+        pending = [_with_key(key, at, self._encode(packet)) for key, (packet, at) in self._memory.drain()]
+        spill, self._spill = self._spill, None   # anything still running sees a plain, empty queue
+        spill.write_checkpoint(pending)
+        spill.close()
+        logging.info("Spill queue closed with %d in memory and %d on disk", len(pending), len(spill))
@@ -1,18 +1,33 @@
-import asyncio, uuid, datetime, os, signal, logging, httpx, uvicorn
+import asyncio, uuid, datetime, gzip, json, os, signal, logging, time, httpx, uvicorn
+from collections import deque
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
 
 # --------------- configuration ----------------
 DISTRIBUTOR_URL = os.getenv("DISTRIBUTOR_URL", "http://distributor:8000/log-packet")
+DISTRIBUTOR_BATCH_URL = os.getenv("DISTRIBUTOR_BATCH_URL", DISTRIBUTOR_URL.replace("/log-packet", "/log-packets"))
+SEND_BATCH = int(os.getenv("SEND_BATCH", "100"))              # max packets per POST
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "4"))    # POSTs in flight at once
 EMITTER_ID = os.getenv("EMITTER_ID", "emitter-X")
+NDJSON_HEADERS = {"content-type": "application/x-ndjson", "x-emitter": EMITTER_ID}
 INITIAL_RPS = float(os.getenv("RATE_RPS", "1.0"))
-MAX_RPS = 10
+MAX_RPS = float(os.getenv("MAX_RPS", "10000"))
 assert 0 <= INITIAL_RPS <= MAX_RPS, "RATE_RPS must be between 0 and {MAX_RPS}"
+TICK_MS = float(os.getenv("EMIT_TICK_MS", "10"))              # generation runs in one burst per tick
+MAX_CATCHUP = float(os.getenv("EMIT_MAX_CATCHUP", "0.5"))     # seconds of missed ticks made up after a stall
+BUFFER_SIZE = int(os.getenv("BUFFER_SIZE", "5000"))
+BUFFER_POLICY = os.getenv("BUFFER_POLICY", "drop_oldest")     # drop_oldest | drop_newest, when the buffer is full
+COMPRESSION = os.getenv("COMPRESSION", "off")                  # off | zstd | gzip, used if the distributor accepts it
+COMPRESSION_REFRESH = float(os.getenv("COMPRESSION_REFRESH", "60"))   # seconds between dictionary checks
+DISTRIBUTOR_BASE = DISTRIBUTOR_URL.rsplit("/", 1)[0]
 
 # --------------- state ----------------
-rate_rps = float = INITIAL_RPS
-paused = bool = False
-buffer: asyncio.Queue = asyncio.Queue(maxsize=5000)
+rate_rps: float = INITIAL_RPS
+paused: bool = False
+credit: int = SEND_BATCH        # packets the distributor last said it would accept
+backoff_until: float = 0.0      # monotonic time before which senders hold off (set by a 429)
+# delivery accounting: every generated packet ends up acked or rejected, or is still buffered
+counts = {"generated": 0, "acked": 0, "retried": 0, "rejected": 0, "dropped": 0}
 
 app = FastAPI(title="Emitter {EMITTER_ID}")
 
@@ -52,62 +67,264 @@ async def metrics():
         "emitter_id": EMITTER_ID,
         "rate_rps": rate_rps,
         "paused": paused,
-        "buffer_size": buffer.qsize()
+        "buffer_size": buffer.qsize(),
+        "buffer_capacity": buffer.maxsize,
+        "drop_policy": buffer.policy,
+        **counts,
     }
 
+# --------------- packets ----------------
+# Packets are built from a pre-encoded template with only the id and timestamp filled in, and kept as
+# (packetId, encoded body) so the senders post them without encoding anything.
+Packet = tuple[str, bytes]
+
+LEVEL = "INFO"      # every generated message's level, also sent as X-Packet-Levels with compressed packets
+_TEMPLATE = json.dumps({
+    "packetId": "\0id",
+    "emitter": EMITTER_ID,
+    "messages": [
+        {
+            "ts": "\0ts",
+            "level": LEVEL,
+            "service": "demo_service",
+            "host": EMITTER_ID,
+            "message": f"Sample log message from {EMITTER_ID}",
+        }
+    ]
+}).replace("%", "%%").replace("\\u0000id", "%s").replace("\\u0000ts", "%s").encode()
+# ids are a random per-process UUID prefix plus a counter: unique, UUID-shaped, and no urandom call per packet
+_ID_PREFIX = str(uuid.uuid4())[:24]
+_next_id = 0
+
+def _packet(ts: bytes) -> Packet:
+    global _next_id
+    _next_id += 1
+    packet_id = f"{_ID_PREFIX}{_next_id:012x}"
+    return packet_id, _TEMPLATE % (packet_id.encode(), ts)
+
+# --------------- compression ----------------
+# Opt-in with COMPRESSION. The distributor's /compression lists the encodings it takes, the size below which
+# bodies go plain and its current zstd dictionary. Every packet is compressed as its own frame (packet + "\n"),
+# so the distributor can keep and forward the frames as they are; a batch lists their sizes in X-Frame-Sizes.
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the image
+    zstandard = None
+
+class Compression:
+    def __init__(self):
+        self.encoding: str | None = None      # None until the distributor has agreed to one
+        self.min_bytes = 512
+        self.dictionary: int | None = None
+        self._zstd = None
+        self.stale = asyncio.Event()          # set when the distributor refused our frames
+
+    def frames(self, bodies: list[bytes]) -> list[bytes] | None:
+        """One compressed frame per packet, or None when the request should go plain."""
+        if self.encoding is None or sum(len(b) for b in bodies) < self.min_bytes:
+            return None
+        if self.encoding == "zstd":
+            return [self._zstd.compress(b + b"\n") for b in bodies]
+        return [gzip.compress(b + b"\n", 6, mtime=0) for b in bodies]
+
+    def refused(self):
+        """Go plain until the next sync, which the distributor's 415 brings forward."""
+        self.encoding = None
+        self.stale.set()
+
+    async def sync(self):
+        async with httpx.AsyncClient(timeout=5) as client:
+            while True:
+                try:
+                    await self._adopt(client, (await client.get(f"{DISTRIBUTOR_BASE}/compression")).json())
+                except Exception as exc:
+                    self.encoding = None
+                    logging.warning("Compression setup failed (%s), sending plain", exc)
+                self.stale.clear()
+                try:
+                    await asyncio.wait_for(self.stale.wait(), COMPRESSION_REFRESH)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _adopt(self, client: httpx.AsyncClient, info: dict):
+        if COMPRESSION not in info.get("encodings", ()) or (COMPRESSION == "zstd" and zstandard is None):
+            self.encoding = None
+            return
+        self.min_bytes = info.get("min_bytes", self.min_bytes)
+        if COMPRESSION == "zstd" and (self._zstd is None or info.get("dictionary") != self.dictionary):
+            dict_data = None
+            if info.get("dictionary_url"):
+                response = await client.get(DISTRIBUTOR_BASE + info["dictionary_url"])
+                response.raise_for_status()
+                dict_data = zstandard.ZstdCompressionDict(response.content)
+            self._zstd = zstandard.ZstdCompressor(level=3, dict_data=dict_data)
+            self.dictionary = info.get("dictionary")
+            logging.info("Compressing with zstd, dictionary %s", self.dictionary)
+        self.encoding = COMPRESSION
+
+compression = Compression()
+
+# --------------- packet buffer ----------------
+class RingBuffer:
+    """Bounded FIFO between the generator and the senders that never blocks the generator.
+
+    When full, `drop_oldest` evicts the packet at the head to make room and `drop_newest` discards the
+    incoming one; either way the packet is counted in counts["dropped"]. Packets put back for a retry go to
+    the head, ahead of newer ones.
+    """
+
+    def __init__(self, maxsize: int, policy: str):
+        if policy not in ("drop_oldest", "drop_newest"):
+            raise ValueError(f"unknown buffer policy {policy!r}, expected drop_oldest or drop_newest")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items: deque[Packet] = deque()
+        self._ready = asyncio.Event()
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def put_nowait(self, packet: Packet):
+        if len(self._items) >= self.maxsize:
+            counts["dropped"] += 1
+            if self.policy == "drop_newest":
+                return
+            self._items.popleft()
+        self._items.append(packet)
+        self._ready.set()
+
+    def put_back(self, packets: list[Packet]):
+        for packet in reversed(packets):
+            if len(self._items) >= self.maxsize:
+                counts["dropped"] += 1
+                self._items.pop()       # keep the retried packets, they are the oldest
+            self._items.appendleft(packet)
+        self._ready.set()
+
+    def get_nowait(self) -> Packet:
+        if not self._items:
+            raise asyncio.QueueEmpty
+        return self._items.popleft()
+
+    async def get(self) -> Packet:
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popleft()
+
+buffer = RingBuffer(BUFFER_SIZE, BUFFER_POLICY)
+
 # --------------- packet generation ----------------
 async def generator():
+    """Token bucket on the monotonic clock: every wakeup adds rate * elapsed tokens and emits one packet per whole
+    token, so the long-run rate is exact however long generation and sleeping take."""
+    tick = TICK_MS / 1000
+    tokens = 0.0
+    last = time.monotonic()
     while True:
-        # Generate a sample packet
-        packet = {
-            "packetId": str(uuid.uuid4()),
-            "emitter": EMITTER_ID,
-            "messages": [
-                {
-                    "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-                    "level": "INFO",
-                    "service": "demo_service",
-                    "host": EMITTER_ID,
-                    "message": f"Sample log message from {EMITTER_ID}",
-                }
-            ]
-        }
-        try:
-            if rate_rps > 0:
-                await buffer.put(packet)
-                logging.info("Generated packet: %s", packet["packetId"])
-        except asyncio.QueueFull:
-            _ = await buffer.get()
-            await buffer.put(packet)  # retry putting the packet
-        
-        if rate_rps <= 0:
-            await asyncio.sleep(1)
+        now = time.monotonic()
+        if paused or rate_rps <= 0:
+            tokens, last = 0.0, now
+            await asyncio.sleep(0.1)
             continue
-        await asyncio.sleep(1 / rate_rps)  # control the rate of generation
+        tokens = min(tokens + (now - last) * rate_rps, max(1.0, rate_rps * MAX_CATCHUP))
+        last = now
+        burst = int(tokens)
+        if burst:
+            tokens -= burst
+            ts = datetime.datetime.now(datetime.timezone.utc).isoformat().encode()
+            for _ in range(burst):
+                buffer.put_nowait(_packet(ts))
+            counts["generated"] += burst
+        # wake for the next whole token, but no more often than once a tick
+        spent = time.monotonic() - now
+        await asyncio.sleep(max(tick - spent, (1.0 - tokens) / rate_rps))
+
+def _drain(first: Packet) -> list[Packet]:
+    """Take whatever is already buffered behind `first`, up to SEND_BATCH packets or the granted credit."""
+    batch = [first]
+    limit = max(1, min(SEND_BATCH, credit))
+    while len(batch) < limit:
+        try:
+            batch.append(buffer.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return batch
 
 async def sender():
+    global credit, backoff_until
     async with httpx.AsyncClient(timeout=5) as client:
         while True:
             if paused:
                 await asyncio.sleep(1)
                 continue
-            packet = await buffer.get()
+            wait = backoff_until - asyncio.get_running_loop().time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            batch = _drain(await buffer.get())
+            frames = compression.frames([body for _, body in batch])
             try:
-                response = await client.post(DISTRIBUTOR_URL, json=packet)
+                if len(batch) == 1:
+                    # the headers let a passthrough distributor skip decoding the body
+                    packet_id, body = batch[0]
+                    headers = {"content-type": "application/json", "x-packet-id": packet_id, "x-emitter": EMITTER_ID}
+                    if frames:
+                        # the levels let the distributor index the packet for /logs without decompressing it
+                        body, headers["content-encoding"] = frames[0], compression.encoding
+                        headers["x-packet-levels"] = LEVEL
+                    response = await client.post(DISTRIBUTOR_URL, content=body, headers=headers)
+                else:
+                    # the ids let the distributor drop re-sent duplicates without decoding the body
+                    headers = {**NDJSON_HEADERS, "x-packet-ids": ",".join(packet_id for packet_id, _ in batch)}
+                    if frames:
+                        body = b"".join(frames)
+                        headers["content-encoding"] = compression.encoding
+                        headers["x-frame-sizes"] = ",".join(str(len(f)) for f in frames)
+                        headers["x-packet-levels"] = ",".join([LEVEL] * len(batch))
+                    else:
+                        body = b"\n".join(body for _, body in batch)
+                    response = await client.post(DISTRIBUTOR_BATCH_URL, content=body, headers=headers)
                 if response.status_code == 202:
-                    logging.info("Packet sent successfully: %s", packet["packetId"])
+                    credit = response.json().get("credit", SEND_BATCH)
+                    counts["acked"] += len(batch)
+                    logging.debug("Sent %d packet(s), last: %s", len(batch), batch[-1][0])
+                elif response.status_code == 429:
+                    # out of credit: keep the packets and have every sender wait as long as the distributor asked
+                    retry_after = float(response.headers.get("retry-after", "1"))
+                    credit = 0
+                    backoff_until = asyncio.get_running_loop().time() + retry_after
+                    buffer.put_back(batch)
+                    logging.warning("Distributor throttled %d packet(s), retrying in %.1fs", len(batch), retry_after)
+                elif response.status_code == 415 and frames:
+                    # e.g. the distributor no longer has our dictionary: resend plain while it is re-fetched
+                    compression.refused()
+                    await _retry(batch, "compressed body refused")
+                elif response.status_code >= 500:
+                    # may have been partly queued: the distributor drops the re-sent packets it already has
+                    await _retry(batch, f"status code {response.status_code}")
                 else:
-                    logging.error("Failed to send packet: %s, status code: %d", packet["packetId"], response.status_code)
+                    counts["rejected"] += len(batch)
+                    logging.error("Distributor rejected %d packet(s), status code: %d", len(batch), response.status_code)
             except Exception as exc:
-                await buffer.put(packet)  # put back the packet if sending fails
-                await asyncio.sleep(1)  # wait before retrying
+                await _retry(batch, exc)
+
+async def _retry(batch: list[Packet], reason):
+    """Put the packets back for another attempt (the response may have been lost after they were queued)."""
+    counts["retried"] += len(batch)
+    logging.warning("Failed to send %d packet(s) (%s), retrying", len(batch), reason)
+    buffer.put_back(batch)
+    await asyncio.sleep(1)  # wait before retrying
 
 @app.on_event("startup")
 async def _startup():
     """Start the packet generator and sender."""
     logging.basicConfig(level=logging.INFO)
     asyncio.create_task(generator())
-    asyncio.create_task(sender())
+    if COMPRESSION != "off":
+        asyncio.create_task(compression.sync())
+    for _ in range(SEND_CONCURRENCY):
+        asyncio.create_task(sender())
     logging.info("Emitter %s started with initial rate %f RPS", EMITTER_ID, INITIAL_RPS)
 
 def main():